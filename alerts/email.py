@@ -1,26 +1,128 @@
+import logging
 from django.contrib.auth import get_user_model
-from django.core.mail import EmailMultiAlternatives
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db.models import OuterRef, Q, Subquery, prefetch_related_objects
+from django.template.loader import render_to_string
+from users.models import ProjectAlertStatus, UserProjectAlerts
 
+logger = logging.getLogger(__name__)
 
-def send_email_notification(notification):
-    subject = "GlitchTip"
-    issue_count = notification.issues.count()
-    first_issue = notification.issues.all().first()
-    if issue_count == 1:
-        subject = f"GlitchTip error: {first_issue.title}"
-    elif issue_count > 1:
-        subject = f"GlitchTip {issue_count} errors including {first_issue.title}"
-
-    text_content = "GlitchTip Errors\n"
-    for issue in notification.issues.all():
-        text_content += f"{issue.title}\n"
-    html_content = "<h2>GlitchTip Errors</h2>\n"
-    for issue in notification.issues.all():
-        html_content += f"<div>{issue.title}<div>\n"
 
+def get_recipients(project_ids):
+    """
+    Returns a dict of project id to emails of team members that want alerts.
+    A user's project setting wins over their subscribe by default setting.
+    """
     User = get_user_model()
-    users = User.objects.filter(team__projects__notification=notification)
-    to = users.values_list("email", flat=True)
+    alert_status = UserProjectAlerts.objects.filter(
+        user=OuterRef("pk"), project=OuterRef("team__projects")
+    ).values("status")
+    users = (
+        User.objects.filter(team__projects__in=project_ids, is_active=True)
+        .annotate(alert_status=Subquery(alert_status))
+        .filter(
+            Q(alert_status=ProjectAlertStatus.ON)
+            | Q(alert_status__isnull=True, subscribe_by_default=True)
+        )
+        .values_list("team__projects", "email")
+        .distinct()
+    )
+    recipients = {}
+    for project_id, email in users:
+        recipients.setdefault(project_id, []).append(email)
+    return recipients
+
+
+def build_email(issues, to):
+    """ Render an email listing issues """
+    subject = "GlitchTip"
+    if len(issues) == 1:
+        subject = f"GlitchTip error: {issues[0].title}"
+    elif len(issues) > 1:
+        subject = f"GlitchTip {len(issues)} errors including {issues[0].title}"
+    context = {"issues": issues}
+    text_content = render_to_string("alerts/issue_notification.txt", context)
+    html_content = render_to_string("alerts/issue_notification.html", context)
     msg = EmailMultiAlternatives(subject, text_content, to=to)
     msg.attach_alternative(html_content, "text/html")
-    msg.send()
+    return msg
+
+
+def build_messages(notifications, recipients, digest=False):
+    """
+    Returns a list of (email, notifications it covers). A digest sends each
+    user one email with the issues of all notifications.
+    """
+    if digest:
+        user_issues = {}
+        user_notifications = {}
+        for notification in notifications:
+            for email in recipients.get(notification.project_id, []):
+                user_issues.setdefault(email, []).extend(notification.issues.all())
+                user_notifications.setdefault(email, []).append(notification)
+        return [
+            (build_email(issues, [email]), user_notifications[email])
+            for email, issues in user_issues.items()
+        ]
+    return [
+        (
+            build_email(notification.issues.all(), recipients[notification.project_id]),
+            [notification],
+        )
+        for notification in notifications
+        if notification.project_id in recipients
+    ]
+
+
+def send_email_notifications(notifications, digest=False, recipients=None):
+    """
+    Email many notifications at once. Issues and recipients are fetched with
+    one query each and all messages share one mail server connection.
+    A message that fails to send is logged and doesn't stop the others.
+    Returns the notifications that had emails of which none were sent.
+    """
+    if not notifications:
+        return []
+    prefetch_related_objects(notifications, "issues")
+    if recipients is None:
+        recipients = get_recipients(
+            {notification.project_id for notification in notifications}
+        )
+    messages = build_messages(notifications, recipients, digest)
+    if not messages:
+        return []
+    connection = get_connection()
+    try:
+        connection.open()
+    except Exception:  # pylint: disable=broad-except
+        logger.exception("Unable to connect to the mail server")
+        return list(
+            {
+                notification.pk: notification
+                for _, message_notifications in messages
+                for notification in message_notifications
+            }.values()
+        )
+    sent = set()
+    failed = {}
+    for message, message_notifications in messages:
+        try:
+            connection.send_messages([message])
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Unable to email an alert to %s", message.to)
+            failed.update(
+                (notification.pk, notification)
+                for notification in message_notifications
+            )
+        else:
+            sent.update(notification.pk for notification in message_notifications)
+    try:
+        connection.close()
+    except Exception:  # pylint: disable=broad-except
+        logger.warning("Unable to close the mail server connection", exc_info=True)
+    return [notification for pk, notification in failed.items() if pk not in sent]
+
+
+def send_email_notification(notification):
+    """ Returns True unless its emails couldn't be sent """
+    return not send_email_notifications([notification])
@@ -1,6 +1,12 @@
 from django.db import models
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from glitchtip.cache import LRUCache
 from .email import send_email_notification
 
+# Alert rules of each project, read by ingest for every saved event
+project_alerts_cache = LRUCache(maxsize=4096, ttl=30)
+
 
 class Notification(models.Model):
     created = models.DateField(auto_now_add=True)
@@ -10,9 +16,9 @@ class Notification(models.Model):
 
     def send_notifications(self):
         """ Email only for now, eventually needs to be an extendable system """
-        send_email_notification(self)
-        self.is_sent = True
-        self.save()
+        if send_email_notification(self):
+            self.is_sent = True
+            self.save()
 
 
 class ProjectAlert(models.Model):
@@ -24,3 +30,9 @@ class ProjectAlert(models.Model):
     timespan_minutes = models.PositiveSmallIntegerField(blank=True, null=True)
     quantity = models.PositiveSmallIntegerField(blank=True, null=True)
     created = models.DateTimeField(auto_now_add=True)
+
+
+@receiver(post_save, sender=ProjectAlert)
+@receiver(post_delete, sender=ProjectAlert)
+def project_alert_changed(sender, instance, **kwargs):
+    project_alerts_cache.delete(instance.project_id)
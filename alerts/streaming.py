@@ -0,0 +1,108 @@
+"""
+Evaluate project alerts as events are saved instead of scanning events.
+New events of each issue are counted in one minute buckets in the cache (Redis).
+An alert fires once the buckets within its timespan add up to its quantity.
+
+Only events saved while an alert exists are counted.
+"""
+import time
+from django.core.cache import cache
+from django.db import transaction
+from issues.models import Issue
+from .models import Notification, ProjectAlert, project_alerts_cache
+from .tasks import schedule_notifications
+
+BUCKET_SECONDS = 60
+# Issues are only notified once, remember that without asking the database
+NOTIFIED_TIMEOUT = 86400
+
+
+def get_bucket(timestamp=None):
+    if timestamp is None:
+        timestamp = time.time()
+    return int(timestamp // BUCKET_SECONDS)
+
+
+def bucket_key(issue_id: int, bucket: int):
+    return f"alert_events:{issue_id}:{bucket}"
+
+
+def notified_key(issue_id: int):
+    return f"alert_notified:{issue_id}"
+
+
+def get_project_alerts(project_id: int):
+    """ Returns a list of (timespan minutes, quantity) of the project's alerts """
+    alerts = project_alerts_cache.get(project_id)
+    if alerts is None:
+        alerts = list(
+            ProjectAlert.objects.filter(
+                project_id=project_id,
+                timespan_minutes__isnull=False,
+                quantity__isnull=False,
+            ).values_list("timespan_minutes", "quantity")
+        )
+        project_alerts_cache.set(project_id, alerts)
+    return alerts
+
+
+def count_alert_events(issue_id: int, count: int, alerts):
+    """
+    Add new events to the issue's current bucket
+    Returns True when any alert's quantity is reached within its timespan
+    """
+    bucket = get_bucket()
+    longest = max(timespan for timespan, _ in alerts)
+    key = bucket_key(issue_id, bucket)
+    if not cache.add(key, count, (longest + 1) * BUCKET_SECONDS):
+        cache.incr(key, count)
+    keys = [bucket_key(issue_id, bucket - offset) for offset in range(longest)]
+    counts = cache.get_many(keys)
+    for timespan, quantity in alerts:
+        if sum(counts.get(key, 0) for key in keys[:timespan]) >= quantity:
+            return True
+    return False
+
+
+def notify_issues(project_id: int, issue_ids):
+    """
+    Send a notification for issues that were never part of one.
+    Issues are added to the project's unsent notification if there is one.
+    """
+    issue_ids = [
+        pk for pk in issue_ids if cache.add(notified_key(pk), True, NOTIFIED_TIMEOUT)
+    ]
+    if not issue_ids:
+        return None
+    with transaction.atomic():
+        issue_ids = list(
+            Issue.objects.filter(
+                pk__in=issue_ids, notification__isnull=True
+            ).values_list("pk", flat=True)
+        )
+        if not issue_ids:
+            return None
+        notification = (
+            Notification.objects.filter(project_id=project_id, is_sent=False)
+            .select_for_update(skip_locked=True)
+            .first()
+        )
+        if notification is None:
+            notification = Notification.objects.create(project_id=project_id)
+        notification.issues.add(*issue_ids)
+    schedule_notifications()
+    return notification
+
+
+def record_alert_events(issue_counts):
+    """
+    Count saved events towards alerts and notify as soon as one fires.
+    issue_counts is a dict of (project id, issue id) to number of new events
+    """
+    fired = {}
+    for (project_id, issue_id), count in issue_counts.items():
+        alerts = get_project_alerts(project_id)
+        if alerts and count_alert_events(issue_id, count, alerts):
+            fired.setdefault(project_id, []).append(issue_id)
+    for project_id, issue_ids in fired.items():
+        notify_issues(project_id, issue_ids)
@@ -1,32 +1,135 @@
 from datetime import timedelta
-from django.db.models import Count
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, DateTimeField, DurationField, ExpressionWrapper
+from django.db.models import F, Q, Value
 from django.utils import timezone
 from celery import shared_task
-from projects.models import Project
-from .models import Notification
+from issues.models import Issue
+from .email import get_recipients, send_email_notifications
+from .models import Notification, ProjectAlert
+
+# Notifications fired close together are emailed in one batch
+NOTIFICATION_BATCH_WINDOW = 5
+NOTIFICATION_BATCH_SIZE = 100
+NOTIFICATIONS_SCHEDULED_KEY = "alerts:notifications_scheduled"
+
+
+def schedule_notifications():
+    """
+    Make sure unsent notifications are emailed within the batch window,
+    or the digest window when digests are enabled
+    """
+    window = settings.NOTIFICATION_DIGEST_WINDOW or NOTIFICATION_BATCH_WINDOW
+    if cache.add(NOTIFICATIONS_SCHEDULED_KEY, True, window):
+        send_pending_notifications.apply_async(countdown=window)
 
 
 @shared_task
 def process_alerts():
+    """
+    Notify about issues that reached an alert's quantity of events within its
+    timespan. All alerts are evaluated together with one grouped query.
+    An issue is only ever part of one notification.
+    Ingest already evaluates alerts as events arrive (see streaming.py), this
+    scan is not scheduled and is only needed to catch up on missed events.
+    """
     now = timezone.now()
-    for project in Project.objects.all():
-        for alert in project.projectalert_set.all():
-            start_time = now - timedelta(minutes=alert.timespan_minutes)
-            quantity_in_timespan = alert.quantity
-            issues = (
-                project.issue_set.filter(
-                    notification__isnull=True, event__created__gte=start_time,
-                )
-                .annotate(num_events=Count("event"))
-                .filter(num_events__gte=quantity_in_timespan)
-            )
-            if issues:
-                notification = project.notification_set.create()
-                notification.issues.add(*issues)
-                send_email_notification.delay(notification.pk)
+    alerts = list(
+        ProjectAlert.objects.filter(
+            timespan_minutes__isnull=False, quantity__isnull=False
+        ).order_by("pk")
+    )
+    if not alerts:
+        return
+    longest = max(alert.timespan_minutes for alert in alerts)
+    alert_start = ExpressionWrapper(
+        Value(now)
+        - F("project__projectalert__timespan_minutes")
+        * Value(timedelta(minutes=1), output_field=DurationField()),
+        output_field=DateTimeField(),
+    )
+    issue_alerts = (
+        Issue.objects.filter(
+            # The constant bound lets postgres skip old event partitions
+            Q(event__created__gte=now - timedelta(minutes=longest)),
+            Q(event__created__gte=alert_start),
+            project__projectalert__in=alerts,
+            notification__isnull=True,
+        )
+        .annotate(
+            alert_id=F("project__projectalert"),
+            quantity=F("project__projectalert__quantity"),
+        )
+        .values("pk", "alert_id", "quantity")
+        .annotate(num_events=Count("event"))
+        .filter(num_events__gte=F("quantity"))
+        .order_by("alert_id")
+        .values_list("pk", "alert_id")
+    )
+
+    alert_issues = {}
+    notified = set()
+    for issue_id, alert_id in issue_alerts:
+        if issue_id not in notified:
+            notified.add(issue_id)
+            alert_issues.setdefault(alert_id, []).append(issue_id)
+    if not alert_issues:
+        return
+
+    alert_projects = {alert.pk: alert.project_id for alert in alerts}
+    NotificationIssue = Notification.issues.through
+    with transaction.atomic():
+        notifications = Notification.objects.bulk_create(
+            [Notification(project_id=alert_projects[pk]) for pk in alert_issues]
+        )
+        NotificationIssue.objects.bulk_create(
+            [
+                NotificationIssue(notification_id=notification.pk, issue_id=issue_id)
+                for notification, issue_ids in zip(notifications, alert_issues.values())
+                for issue_id in issue_ids
+            ]
+        )
+    schedule_notifications()
 
 
 @shared_task
 def send_email_notification(notification_id: int):
     notification = Notification.objects.get(pk=notification_id)
     notification.send_notifications()
+
+
+@shared_task(ignore_result=True)
+def send_pending_notifications():
+    """
+    Email up to NOTIFICATION_BATCH_SIZE unsent notifications at once.
+    Notifications are marked sent and committed before they are emailed, so
+    neither concurrent runs nor a failing send email anyone twice. Those whose
+    emails all failed are marked unsent again and retried by a later run.
+    Notifications of projects nobody receives alerts for wait unsent.
+    """
+    cache.delete(NOTIFICATIONS_SCHEDULED_KEY)
+    pending = Notification.objects.filter(is_sent=False)
+    recipients = get_recipients(pending.values("project_id").distinct())
+    with transaction.atomic():
+        notifications = list(
+            pending.filter(project_id__in=recipients.keys())
+            .select_for_update(skip_locked=True)
+            .order_by("pk")[:NOTIFICATION_BATCH_SIZE]
+        )
+        Notification.objects.filter(
+            pk__in=[notification.pk for notification in notifications]
+        ).update(is_sent=True)
+    failed = send_email_notifications(
+        notifications,
+        digest=bool(settings.NOTIFICATION_DIGEST_WINDOW),
+        recipients=recipients,
+    )
+    if failed:
+        Notification.objects.filter(
+            pk__in=[notification.pk for notification in failed]
+        ).update(is_sent=False)
+        schedule_notifications()
+    if len(notifications) == NOTIFICATION_BATCH_SIZE:
+        send_pending_notifications.delay()
@@ -1,14 +1,24 @@
-from datetime import timedelta
+import json
+from datetime import datetime, timedelta
+from smtplib import SMTPException
+from unittest import mock
 from django.core import mail
-from django.test import TestCase
+from django.core.cache import cache
+from django.test import TestCase, override_settings
 from django.utils import timezone
 from django.shortcuts import reverse
 from rest_framework.test import APITestCase
 from model_bakery import baker
 from freezegun import freeze_time
 from glitchtip import test_utils  # pylint: disable=unused-import
-from .tasks import process_alerts
-from .models import Notification, ProjectAlert
+from .email import get_recipients
+from .streaming import notify_issues, record_alert_events
+from .tasks import (
+    process_alerts,
+    send_pending_notifications,
+    NOTIFICATIONS_SCHEDULED_KEY,
+)
+from .models import Notification, ProjectAlert, project_alerts_cache
 
 
 class AlertTestCase(TestCase):
@@ -82,6 +92,135 @@ class AlertTestCase(TestCase):
             process_alerts()
         self.assertEqual(Notification.objects.count(), 1)
 
+    def test_alerts_query_count(self):
+        """ Alerts of all projects are evaluated with the same few queries """
+        for _ in range(3):
+            project = baker.make("projects.Project", organization=self.organization)
+            baker.make(
+                "alerts.ProjectAlert", project=project, timespan_minutes=5, quantity=2
+            )
+            baker.make("issues.Event", issue__project=project)
+        with self.assertNumQueries(2):
+            process_alerts()
+        self.assertEqual(Notification.objects.count(), 0)
+
+    def test_multiple_alerts(self):
+        """ An issue matching several alerts is notified once """
+        baker.make(
+            "alerts.ProjectAlert", project=self.project, timespan_minutes=5, quantity=2
+        )
+        baker.make(
+            "alerts.ProjectAlert", project=self.project, timespan_minutes=60, quantity=3
+        )
+        issue = baker.make("issues.Issue", project=self.project)
+        other_issue = baker.make("issues.Issue", project=self.project)
+        with freeze_time(self.now - timedelta(minutes=30)):
+            baker.make("issues.Event", issue=other_issue, _quantity=2)
+        baker.make("issues.Event", issue=issue, _quantity=3)
+        baker.make("issues.Event", issue=other_issue)
+
+        process_alerts()
+        self.assertEqual(Notification.objects.count(), 2)
+        self.assertEqual(Notification.objects.filter(issues=issue).count(), 1)
+        self.assertEqual(Notification.objects.filter(issues=other_issue).count(), 1)
+
+    def test_send_pending_notifications(self):
+        """ Pending notifications are emailed together with constant queries """
+        projects = [
+            self.project,
+            self.project.team_set.first().projects.create(
+                name="other", organization=self.organization
+            ),
+        ]
+        for project in projects * 2:
+            notification = baker.make("alerts.Notification", project=project)
+            notification.issues.add(
+                *baker.make("issues.Issue", project=project, _quantity=2)
+            )
+        baker.make("alerts.Notification", project=self.project, is_sent=True)
+
+        with self.assertNumQueries(6):
+            send_pending_notifications()
+        self.assertEqual(len(mail.outbox), 4)
+        self.assertIn("GlitchTip 2 errors including", mail.outbox[0].subject)
+        self.assertFalse(Notification.objects.filter(is_sent=False).exists())
+
+    def test_recipient_preferences(self):
+        team = self.project.team_set.first()
+        unsubscribed = baker.make("users.User", subscribe_by_default=False)
+        project_off = baker.make("users.User")
+        project_on = baker.make("users.User", subscribe_by_default=False)
+        team.members.add(unsubscribed, project_off, project_on)
+        baker.make(
+            "users.UserProjectAlerts", user=project_off, project=self.project, status=0
+        )
+        baker.make(
+            "users.UserProjectAlerts", user=project_on, project=self.project, status=1
+        )
+        emails = get_recipients([self.project.pk])[self.project.pk]
+        self.assertIn(project_on.email, emails)
+        self.assertNotIn(project_off.email, emails)
+        self.assertNotIn(unsubscribed.email, emails)
+        self.assertEqual(len(emails), 2)
+
+    def test_failed_notification(self):
+        """ A failed email is retried later, emails already sent are not """
+        notifications = []
+        for _ in range(2):
+            notification = baker.make("alerts.Notification", project=self.project)
+            notification.issues.add(baker.make("issues.Issue", project=self.project))
+            notifications.append(notification)
+        with mock.patch(
+            "django.core.mail.backends.locmem.EmailBackend.send_messages",
+            side_effect=[SMTPException, 1],
+        ), self.assertLogs("alerts.email", "ERROR"):
+            send_pending_notifications()
+        self.assertEqual(
+            list(Notification.objects.filter(is_sent=False)), [notifications[0]]
+        )
+
+        send_pending_notifications()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertFalse(Notification.objects.filter(is_sent=False).exists())
+        cache.delete(NOTIFICATIONS_SCHEDULED_KEY)
+
+    def test_notification_without_recipients(self):
+        """ Notifications wait unsent until someone receives the project's alerts """
+        project = baker.make("projects.Project", organization=self.organization)
+        notification = baker.make("alerts.Notification", project=project)
+        notification.issues.add(baker.make("issues.Issue", project=project))
+        send_pending_notifications()
+        self.assertEqual(len(mail.outbox), 0)
+        notification.refresh_from_db()
+        self.assertFalse(notification.is_sent)
+
+        project.team_set.add(self.project.team_set.first())
+        send_pending_notifications()
+        self.assertEqual(len(mail.outbox), 1)
+        notification.refresh_from_db()
+        self.assertTrue(notification.is_sent)
+
+    @override_settings(NOTIFICATION_DIGEST_WINDOW=300)
+    def test_digest(self):
+        other_project = self.project.team_set.first().projects.create(
+            name="other", organization=self.organization
+        )
+        for project in [self.project, other_project, self.project]:
+            notification = baker.make("alerts.Notification", project=project)
+            notification.issues.add(baker.make("issues.Issue", project=project))
+        send_pending_notifications()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn("GlitchTip 3 errors including", mail.outbox[0].subject)
+
+    def test_coalesce_notifications(self):
+        """ Issues join the project's pending notification """
+        cache.set(NOTIFICATIONS_SCHEDULED_KEY, True)
+        issues = baker.make("issues.Issue", project=self.project, _quantity=2)
+        notification = notify_issues(self.project.pk, [issues[0].pk])
+        self.assertEqual(notify_issues(self.project.pk, [issues[1].pk]), notification)
+        self.assertEqual(notification.issues.count(), 2)
+        cache.delete(NOTIFICATIONS_SCHEDULED_KEY)
+
     def test_alert_one_event(self):
         """ Use same logic to send alert for every new issue """
         baker.make(
@@ -93,6 +232,107 @@ class AlertTestCase(TestCase):
         self.assertEqual(Notification.objects.count(), 1)
 
 
+class StreamingAlertTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        project_alerts_cache.clear()
+        self.start = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        self.project = baker.make("projects.Project")
+        team = baker.make(
+            "teams.Team",
+            organization=self.project.organization,
+            projects=[self.project],
+        )
+        team.members.add(baker.make("users.User"))
+        self.issue = baker.make("issues.Issue", project=self.project)
+
+    def replay(self, stream):
+        """
+        Feed a synthetic event stream of (minutes since start, issue, events)
+        to the evaluator. Returns minutes at which notifications were sent.
+        """
+        fired = []
+        for minutes, issue, count in stream:
+            with freeze_time(self.start + timedelta(minutes=minutes)):
+                before = Notification.objects.count()
+                record_alert_events({(issue.project_id, issue.pk): count})
+                if Notification.objects.count() > before:
+                    fired.append(minutes)
+        return fired
+
+    def test_sliding_window(self):
+        baker.make(
+            "alerts.ProjectAlert",
+            project=self.project,
+            timespan_minutes=10,
+            quantity=10,
+        )
+        stream = [(0, self.issue, 4), (5, self.issue, 4), (11, self.issue, 4)]
+        self.assertEqual(self.replay(stream), [])
+        # 12 events within the last 10 minutes
+        self.assertEqual(self.replay([(12, self.issue, 4)]), [12])
+
+    def test_fires_once(self):
+        baker.make(
+            "alerts.ProjectAlert", project=self.project, timespan_minutes=1, quantity=1,
+        )
+        other_issue = baker.make("issues.Issue", project=self.project)
+        stream = [
+            (0, self.issue, 1),
+            (0.5, self.issue, 1),
+            (30, self.issue, 5),
+            (31, other_issue, 1),
+        ]
+        self.assertEqual(self.replay(stream), [0, 31])
+        self.assertEqual(Notification.objects.count(), 2)
+
+    def test_several_alerts(self):
+        baker.make(
+            "alerts.ProjectAlert",
+            project=self.project,
+            timespan_minutes=5,
+            quantity=50,
+        )
+        baker.make(
+            "alerts.ProjectAlert",
+            project=self.project,
+            timespan_minutes=60,
+            quantity=6,
+        )
+        stream = [(minutes, self.issue, 1) for minutes in range(0, 60, 10)]
+        self.assertEqual(self.replay(stream), [50])
+
+    def test_no_alerts(self):
+        self.assertEqual(self.replay([(0, self.issue, 100)]), [])
+        with self.assertNumQueries(0):
+            record_alert_events({(self.project.pk, self.issue.pk): 1})
+
+    def test_alert_changes(self):
+        self.replay([(0, self.issue, 1)])
+        alert = baker.make(
+            "alerts.ProjectAlert", project=self.project, timespan_minutes=5, quantity=2,
+        )
+        self.assertEqual(self.replay([(1, self.issue, 1), (2, self.issue, 1)]), [2])
+        alert.delete()
+        other_issue = baker.make("issues.Issue", project=self.project)
+        self.assertEqual(self.replay([(3, other_issue, 5)]), [])
+
+    def test_store_event(self):
+        """ Alerts fire while the event is stored, no polling needed """
+        baker.make(
+            "alerts.ProjectAlert", project=self.project, timespan_minutes=1, quantity=1,
+        )
+        projectkey = self.project.projectkey_set.first()
+        url = (
+            reverse("event_store", args=[self.project.id])
+            + f"?sentry_key={projectkey.public_key}"
+        )
+        with open("event_store/test_data/py_hi_event.json") as json_file:
+            data = json.load(json_file)
+        self.client.post(url, data, content_type="application/json")
+        self.assertEqual(Notification.objects.count(), 1)
+
+
 class AlertAPITestCase(APITestCase):
     def setUp(self):
         user = baker.make("users.user")
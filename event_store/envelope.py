@@ -0,0 +1,105 @@
+"""
+Sentry envelopes, the format newer SDKs post to /api/<id>/envelope/
+https://develop.sentry.dev/sdk/envelopes/
+
+An envelope is a JSON header line followed by items. Each item is a JSON header
+line and a payload of `length` bytes, or up to the next newline when the length
+is missing. Items are read one at a time from the request stream, so the whole
+body is never held in memory.
+"""
+import io
+from urllib.parse import urlparse
+from rest_framework.exceptions import ParseError
+from glitchtip.parsers import JSONParser
+
+# Same as Sentry's event size limit, larger items are skipped
+MAX_ITEM_SIZE = 1024 * 1024
+READ_CHUNK = 64 * 1024
+
+
+def parse_json(data: bytes, name: str):
+    try:
+        return JSONParser().parse(io.BytesIO(data))
+    except ParseError as exc:
+        raise ParseError(f"Invalid envelope {name}: {exc.detail}")
+
+
+class Envelope:
+    """
+    Reads the envelope header on creation. Iterating yields
+    (item headers, parsed JSON payload) for items of item_types, other items
+    are read past without keeping them.
+    """
+
+    def __init__(self, stream, item_types):
+        self.stream = stream
+        self.item_types = item_types
+        line = self.stream.readline(MAX_ITEM_SIZE + 1)
+        if not line.endswith(b"\n") and len(line) > MAX_ITEM_SIZE:
+            raise ParseError("Envelope header is too large")
+        self.headers = parse_json(line, "header")
+        if not isinstance(self.headers, dict):
+            raise ParseError("Envelope header must be a JSON object")
+
+    def get_public_key(self):
+        """ Public key of the DSN in the envelope header, used by tunnels """
+        dsn = self.headers.get("dsn")
+        if isinstance(dsn, str):
+            return urlparse(dsn).username
+        return None
+
+    def __iter__(self):
+        while True:
+            line = self.stream.readline(MAX_ITEM_SIZE + 1)
+            if not line:
+                return
+            if not line.strip():  # Newline after a payload of known length
+                continue
+            if not line.endswith(b"\n") and len(line) > MAX_ITEM_SIZE:
+                raise ParseError("Envelope item header is too large")
+            headers = parse_json(line, "item header")
+            if not isinstance(headers, dict):
+                raise ParseError("Envelope item header must be a JSON object")
+
+            length = headers.get("length")
+            if length is not None and (type(length) is not int or length < 0):
+                raise ParseError("Envelope item length must be a positive integer")
+            wanted = headers.get("type") in self.item_types
+            if length is None:
+                payload = self.read_line(keep=wanted)
+            elif wanted and length <= MAX_ITEM_SIZE:
+                payload = self.read(length)
+            else:
+                self.skip(length)
+                payload = None
+            if payload:
+                yield headers, parse_json(payload, "item")
+
+    def read(self, length: int) -> bytes:
+        chunks = []
+        while length:
+            chunk = self.stream.read(min(length, READ_CHUNK))
+            if not chunk:
+                raise ParseError("Envelope item is shorter than its length")
+            chunks.append(chunk)
+            length -= len(chunk)
+        return b"".join(chunks)
+
+    def skip(self, length: int):
+        while length:
+            chunk = self.stream.read(min(length, READ_CHUNK))
+            if not chunk:
+                raise ParseError("Envelope item is shorter than its length")
+            length -= len(chunk)
+
+    def read_line(self, keep: bool):
+        """
+        Payload up to the next newline. Returns None when it isn't kept or is
+        larger than MAX_ITEM_SIZE.
+        """
+        line = self.stream.readline(MAX_ITEM_SIZE + 1 if keep else READ_CHUNK)
+        if keep and (line.endswith(b"\n") or len(line) <= MAX_ITEM_SIZE):
+            return line.rstrip(b"\r\n")
+        while line and not line.endswith(b"\n"):
+            line = self.stream.readline(READ_CHUNK)
+        return None
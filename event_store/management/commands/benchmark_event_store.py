@@ -0,0 +1,82 @@
+import glob
+import json
+import os
+import time
+from django.core.management.base import BaseCommand
+from model_bakery import baker
+from glitchtip.test_utils import generators  # pylint: disable=unused-import
+from event_store import test_data
+from event_store.test_data import django_error_factory
+from event_store.test_data.csp import mdn_sample_csp
+from event_store.test_data.event_generator import make_event_unique
+from event_store.serializers import get_serializer_class, bulk_create_events
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare events per second when saving sample events one at a time "
+        "and in batches. Uses a throwaway organization that is deleted afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("quantity", nargs="?", type=int, default=500)
+        parser.add_argument("--batch-size", type=int, default=100)
+
+    def get_sample_events(self):
+        """ Sample payloads from event_store/test_data """
+        events = list(django_error_factory.all_django_events) + [mdn_sample_csp]
+        test_data_dir = os.path.dirname(test_data.__file__)
+        paths = glob.glob(os.path.join(test_data_dir, "incoming_events", "*.json"))
+        paths += [
+            os.path.join(test_data_dir, name)
+            for name in ("py_error.json", "py_hi_event.json")
+        ]
+        for path in sorted(paths):
+            with open(path) as json_file:
+                events.append(json.load(json_file))
+        return events
+
+    def get_validated_events(self, quantity):
+        samples = self.get_sample_events()
+        serializers = []
+        for i in range(quantity):
+            data = make_event_unique(samples[i % len(samples)])
+            serializer = get_serializer_class(data)(data=data)
+            if serializer.is_valid():
+                serializers.append(serializer)
+        return serializers
+
+    def report(self, label, count, seconds):
+        self.stdout.write(
+            f"{label}: {count} events in {seconds:.2f}s ({count / seconds:.1f} events/sec)"
+        )
+
+    def handle(self, *args, **options):
+        quantity = options["quantity"]
+        batch_size = options["batch_size"]
+
+        project = baker.make("projects.Project")
+        try:
+            serializers = self.get_validated_events(quantity)
+            start = time.perf_counter()
+            for serializer in serializers:
+                serializer.create(project, serializer.data)
+            self.report("Single", len(serializers), time.perf_counter() - start)
+
+            project.issue_set.all().delete()
+            serializers = self.get_validated_events(quantity)
+            start = time.perf_counter()
+            for i in range(0, len(serializers), batch_size):
+                bulk_create_events(
+                    [
+                        (project.pk, serializer.prepare(serializer.data))
+                        for serializer in serializers[i : i + batch_size]
+                    ]
+                )
+            self.report(
+                f"Batched ({batch_size} per batch)",
+                len(serializers),
+                time.perf_counter() - start,
+            )
+        finally:
+            project.organization.delete()
@@ -0,0 +1,73 @@
+import glob
+import io
+import json
+import os
+import time
+from django.core.management.base import BaseCommand
+from rest_framework import parsers, renderers
+from event_store import test_data
+from glitchtip.parsers import JSONParser
+from glitchtip.renderers import JSONRenderer, orjson
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare parsing and rendering the event_store/test_data payloads with "
+        "DRF's stdlib JSON classes and glitchtip's (orjson when installed)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("iterations", nargs="?", type=int, default=100)
+
+    def get_payloads(self):
+        """ Raw JSON of every payload in event_store/test_data """
+        test_data_dir = os.path.dirname(test_data.__file__)
+        paths = glob.glob(os.path.join(test_data_dir, "**", "*.json"), recursive=True)
+        payloads = []
+        for path in sorted(paths):
+            with open(path, "rb") as json_file:
+                payloads.append(json_file.read())
+        return payloads
+
+    def time_parser(self, parser, payloads, iterations):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            for payload in payloads:
+                parser.parse(io.BytesIO(payload))
+        return time.perf_counter() - start
+
+    def time_renderer(self, renderer, data, iterations):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            for item in data:
+                renderer.render(item)
+        return time.perf_counter() - start
+
+    def report(self, label, stdlib_seconds, seconds, count):
+        self.stdout.write(
+            f"{label}: {count} payloads, stdlib {stdlib_seconds * 1e6 / count:.1f}µs, "
+            f"glitchtip {seconds * 1e6 / count:.1f}µs "
+            f"({stdlib_seconds / seconds:.2f}x)"
+        )
+
+    def handle(self, *args, **options):
+        iterations = options["iterations"]
+        payloads = self.get_payloads()
+        data = [json.loads(payload) for payload in payloads]
+        count = len(payloads) * iterations
+        self.stdout.write(
+            f"{len(payloads)} payloads, {sum(map(len, payloads))} bytes, "
+            f"orjson {'installed' if orjson else 'not installed'}"
+        )
+        self.report(
+            "Parse",
+            self.time_parser(parsers.JSONParser(), payloads, iterations),
+            self.time_parser(JSONParser(), payloads, iterations),
+            count,
+        )
+        self.report(
+            "Render",
+            self.time_renderer(renderers.JSONRenderer(), data, iterations),
+            self.time_renderer(JSONRenderer(), data, iterations),
+            count,
+        )
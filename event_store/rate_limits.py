@@ -0,0 +1,34 @@
+"""
+Per project key rate limits of the store endpoints.
+Events are counted in fixed windows of rate_limit_window seconds in the cache
+(Redis), every API server shares the same counters.
+"""
+import math
+import time
+from django.core.cache import cache
+
+
+def rate_limit_key(project_key_id: int, window: int):
+    return f"rate_limit:{project_key_id}:{window}"
+
+
+def check_rate_limit(project_key):
+    """
+    Count an event against the key's rate limit.
+    Returns the seconds until the key may send again when it is over its limit,
+    otherwise None. Keys without a rate_limit_count and window are not limited.
+    """
+    limit = project_key.rate_limit_count
+    seconds = project_key.rate_limit_window
+    if not limit or not seconds:
+        return None
+    now = time.time()
+    window = int(now // seconds)
+    key = rate_limit_key(project_key.pk, window)
+    if cache.add(key, 1, seconds):
+        count = 1
+    else:
+        count = cache.incr(key)
+    if count > limit:
+        return max(math.ceil((window + 1) * seconds - now), 1)
+    return None
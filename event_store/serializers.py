@@ -1,12 +1,149 @@
+import hashlib
+import logging
+from functools import reduce
+from operator import or_
 from urllib.parse import urlparse
-from django.db import transaction
+from uuid import UUID, uuid4
+from django.db import transaction, IntegrityError
+from django.db.models import Q
 from rest_framework import serializers
 from sentry.eventtypes.error import ErrorEvent
 from sentry.eventtypes.base import DefaultEvent
-from issues.models import EventType, Event, Issue
+from alerts.streaming import record_alert_events
+from issues.buffer import increment_counts, increment_event_counts
+from issues.stats import increment_event_stats
+from issues.models import (
+    EventType,
+    Event,
+    EventMapping,
+    EventTag,
+    Issue,
+    IssueTag,
+    grouping_cache,
+)
 
+# Same limits as Sentry, longer tags are truncated
+MAX_TAG_KEY_LENGTH = 32
+MAX_TAG_VALUE_LENGTH = 200
+# Seconds between grouping cache stats in each ingest process's log
+GROUPING_CACHE_STATS_INTERVAL = 300
+logger = logging.getLogger(__name__)
 
-class StoreDefaultSerializer(serializers.Serializer):
+
+def log_grouping_cache_stats():
+    """ Log hits and misses now and then, to help size GROUPING_CACHE_SIZE """
+    stats = grouping_cache.stats_if_due(GROUPING_CACHE_STATS_INTERVAL)
+    if stats:
+        logger.info(
+            "Grouping cache: %(hits)s hits, %(misses)s misses, "
+            "%(size)s of %(maxsize)s entries",
+            stats,
+        )
+
+
+class BaseStoreSerializer(serializers.Serializer):
+    """
+    Shared event creation logic.
+    prepare() turns validated data into issue and event fields, subclasses
+    customize it with get_issue_summary(), get_event_data() and get_tags().
+    """
+
+    type = EventType.DEFAULT
+
+    def get_eventtype(self):
+        """ Sentry event type that summarizes events of this serializer """
+        return DefaultEvent()
+
+    def get_issue_summary(self, data):
+        """ Returns the title, culprit and metadata of the event's issue """
+        eventtype = self.get_eventtype()
+        metadata = eventtype.get_metadata(data)
+        return eventtype.get_title(metadata), eventtype.get_location(data), metadata
+
+    def get_event_data(self, data):
+        """ Event data saved besides the issue summary and event type """
+        return {}
+
+    def get_tags(self, data):
+        """ Returns sorted (key, value) tag pairs of the event """
+        return []
+
+    def prepare(self, data):
+        """
+        Returns a tuple of (issue lookup kwargs, issue defaults, event kwargs)
+        """
+        title, culprit, metadata = self.get_issue_summary(data)
+        event_kwargs = {
+            "timestamp": data.get("timestamp"),
+            "data": {
+                **self.get_event_data(data),
+                "culprit": culprit,
+                "metadata": metadata,
+                "title": title,
+                "type": self.type.label,
+            },
+            "tags": self.get_tags(data),
+        }
+        # Events without an id, like CSP reports, get one when saved
+        if data.get("event_id"):
+            event_kwargs["event_id"] = data["event_id"]
+        issue_kwargs, issue_defaults = self.get_issue_fields(title, culprit, metadata)
+        return issue_kwargs, issue_defaults, event_kwargs
+
+    def get_issue_fields(self, title, culprit, metadata):
+        """
+        Returns issue lookup kwargs and defaults
+        Issues are looked up by a fixed size hash instead of title and culprit
+        """
+        issue_hash = generate_hash(title, culprit, self.type)
+        defaults = {
+            "title": title,
+            "culprit": culprit,
+            "type": self.type,
+            "metadata": metadata,
+        }
+        return {"hash": issue_hash}, defaults
+
+    def create(self, project, data, use_cache=True):
+        """ Returns the saved event, None when its event id is already stored """
+        issue_kwargs, issue_defaults, event_kwargs = self.prepare(data)
+        cache_key = (project.pk, issue_kwargs["hash"])
+        issue_id = grouping_cache.get(cache_key) if use_cache else None
+        try:
+            with transaction.atomic():
+                if issue_id is None:
+                    issue, _ = Issue.objects.get_or_create(
+                        project=project, defaults=issue_defaults, **issue_kwargs
+                    )
+                    issue_id = issue.pk
+                event_kwargs = dict(event_kwargs)
+                event_id = event_kwargs.setdefault("event_id", uuid4())
+                if not EventMapping.add_new([(event_id, issue_id)]):
+                    # SDKs resend events they aren't sure were received
+                    return None
+                tag_ids = EventTag.get_ids(event_kwargs.pop("tags", []))
+                event = Event.objects.create(
+                    issue_id=issue_id, tags=sorted(tag_ids.values()), **event_kwargs
+                )
+                Issue.regress_resolved([issue_id])
+                increment_event_counts({issue_id: (1, event.created)})
+                increment_event_stats([(issue_id, event.created)])
+                increment_counts(
+                    IssueTag, {(issue_id, tag_id): 1 for tag_id in event.tags}
+                )
+        except IntegrityError:
+            if not use_cache:
+                raise
+            # Cached issue may have been deleted by another process
+            grouping_cache.delete(cache_key)
+            return self.create(project, data, use_cache=False)
+        grouping_cache.set(cache_key, issue_id)
+        log_grouping_cache_stats()
+        record_alert_events({(project.pk, issue_id): 1})
+        return event
+
+
+class StoreDefaultSerializer(BaseStoreSerializer):
     """
     Default serializer. Used as both a base class and for default error types
     """
@@ -14,6 +151,7 @@ class StoreDefaultSerializer(serializers.Serializer):
     type = EventType.DEFAULT
     breadcrumbs = serializers.JSONField(required=False)
     contexts = serializers.JSONField(required=False)
+    environment = serializers.CharField(required=False)
     event_id = serializers.UUIDField()
     extra = serializers.JSONField(required=False)
     level = serializers.CharField()
@@ -23,56 +161,65 @@ class StoreDefaultSerializer(serializers.Serializer):
     release = serializers.CharField(required=False)
     request = serializers.JSONField(required=False)
     sdk = serializers.JSONField()
+    server_name = serializers.CharField(required=False)
+    tags = serializers.JSONField(required=False)
     timestamp = serializers.DateTimeField(required=False)
     transaction = serializers.CharField(required=False)
     modules = serializers.JSONField(required=False)
 
     def get_eventtype(self):
         """ Get event type class from self.type """
-        if self.type is EventType.DEFAULT:
-            return DefaultEvent()
         if self.type is EventType.ERROR:
             return ErrorEvent()
+        return super().get_eventtype()
 
-    def create(self, project, data):
-        eventtype = self.get_eventtype()
-        metadata = eventtype.get_metadata(data)
-        title = eventtype.get_title(metadata)
-        culprit = eventtype.get_location(data)
+    def get_tags(self, data):
+        """
+        Returns sorted (key, value) tag pairs of the event.
+        Payload tags are a dict or a list of pairs, built in tags win over them.
+        """
+        tags = {}
+        payload_tags = data.get("tags")
+        if isinstance(payload_tags, dict):
+            tags.update(payload_tags)
+        elif isinstance(payload_tags, list):
+            tags.update(
+                tag for tag in payload_tags if isinstance(tag, list) and len(tag) == 2
+            )
+        for key in ("environment", "level", "release", "server_name"):
+            if data.get(key) not in (None, ""):
+                tags[key] = data[key]
+        contexts = data.get("contexts") or {}
+        for key in ("browser", "os"):
+            context = contexts.get(key)
+            if isinstance(context, dict) and context.get("name"):
+                tags[f"{key}.name"] = context["name"]
+                tags[key] = " ".join(
+                    str(part)
+                    for part in (context["name"], context.get("version"))
+                    if part
+                )
+        return sorted(
+            (str(key)[:MAX_TAG_KEY_LENGTH], str(value)[:MAX_TAG_VALUE_LENGTH])
+            for key, value in tags.items()
+            if key and value not in (None, "")
+        )
+
+    def get_event_data(self, data):
         request = data.get("request")
         if request:
             headers = request.get("headers")
             if headers:
                 request["inferred_content_type"] = headers.get("Content-Type")
                 request["headers"] = sorted([pair for pair in headers.items()])
-        with transaction.atomic():
-            issue, _ = Issue.objects.get_or_create(
-                title=title,
-                culprit=culprit,
-                project=project,
-                type=self.type,
-                defaults={"metadata": metadata},
-            )
-            params = {
-                "event_id": data["event_id"],
-                "issue": issue,
-                "timestamp": data.get("timestamp"),
-                "data": {
-                    "contexts": data.get("contexts"),
-                    "culprit": culprit,
-                    "exception": data.get("exception"),
-                    "metadata": metadata,
-                    "packages": data.get("modules"),
-                    "platform": data["platform"],
-                    "request": request,
-                    "sdk": data["sdk"],
-                    "title": title,
-                    "type": self.type.label,
-                },
-            }
-            event = Event.objects.create(**params)
-            issue.check_for_status_update()
-        return event
+        return {
+            "contexts": data.get("contexts"),
+            "exception": data.get("exception"),
+            "packages": data.get("modules"),
+            "platform": data["platform"],
+            "request": request,
+            "sdk": data["sdk"],
+        }
 
 
 class StoreErrorSerializer(StoreDefaultSerializer):
@@ -82,54 +229,38 @@ class StoreErrorSerializer(StoreDefaultSerializer):
     exception = serializers.JSONField(required=False)
 
 
-class StoreCSPReportSerializer(serializers.Serializer):
+class StoreCSPReportSerializer(BaseStoreSerializer):
     """
     CSP Report Serializer
     Very different format from others Store serializers.
-    Does not extend base class due to differences.
+    Does not extend the default serializer due to differences.
     """
 
     type = EventType.CSP
+    event_id = serializers.UUIDField(required=False)
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         # This is done to support the hyphen
         self.fields.update({"csp-report": serializers.JSONField()})
 
-    def create(self, project, data):
+    def get_issue_summary(self, data):
         csp = data["csp-report"]
         title = self.get_title(csp)
-        culprit = self.get_culprit(csp)
-        uri = self.get_uri(csp)
-        directive = self.get_effective_directive(csp)
         metadata = {
             "message": title,
-            "uri": uri,
-            "directive": directive,
+            "uri": self.get_uri(csp),
+            "directive": self.get_effective_directive(csp),
         }
-        issue, _ = Issue.objects.get_or_create(
-            title=title,
-            culprit=culprit,
-            project=project,
-            type=EventType.CSP,
-            defaults={"metadata": metadata},
-        )
+        return title, self.get_culprit(csp), metadata
+
+    def get_event_data(self, data):
+        csp = data["csp-report"]
         # Convert - to _
         normalized_csp = dict((k.replace("-", "_"), v) for k, v in csp.items())
         if "effective_directive" not in normalized_csp:
-            normalized_csp["effective_directive"] = directive
-        params = {
-            "issue": issue,
-            "data": {
-                "culprit": culprit,
-                "csp": normalized_csp,
-                "title": title,
-                "metadata": metadata,
-                "message": title,
-                "type": EventType.CSP.label,
-            },
-        }
-        return Event.objects.create(**params)
+            normalized_csp["effective_directive"] = self.get_effective_directive(csp)
+        return {"csp": normalized_csp, "message": self.get_title(csp)}
 
     def get_effective_directive(self, data):
         """
@@ -154,3 +285,132 @@ class StoreCSPReportSerializer(serializers.Serializer):
     def get_culprit(self, data):
         # "style-src cdn.example.com"
         return data.get("violated-directive")
+
+
+def get_serializer_class(data):
+    """ Determine event type and return serializer """
+    if "exception" in data and data["exception"]:
+        return StoreErrorSerializer
+    if "platform" not in data:
+        return StoreCSPReportSerializer
+    return StoreDefaultSerializer
+
+
+def generate_hash(title, culprit, type):
+    """
+    Grouping fingerprint, events with the same hash in a project share an issue
+    """
+    fingerprint = [str(int(type)), title or "", culprit or ""]
+    return hashlib.md5("\n".join(fingerprint).encode()).hexdigest()
+
+
+def bulk_create_events(events, use_cache=True):
+    """
+    Save many prepared events at once. Issues for the whole batch are resolved
+    with at most one query and events are written with a single bulk insert.
+    events is a list of (project_id, (issue kwargs, issue defaults, event kwargs))
+    Events with an event id that already exists are skipped.
+    Returns the saved events.
+    """
+    if not events:
+        return []
+
+    def get_issue_ids(keys):
+        lookups = [Q(project_id=project_id, hash=hash) for project_id, hash in keys]
+        return {
+            (project_id, hash): pk
+            for pk, project_id, hash in Issue.objects.filter(
+                reduce(or_, lookups)
+            ).values_list("pk", "project_id", "hash")
+        }
+
+    new_issues = {}
+    for project_id, (issue_kwargs, issue_defaults, _) in events:
+        key = (project_id, issue_kwargs["hash"])
+        new_issues.setdefault(key, (project_id, issue_kwargs, issue_defaults))
+
+    issue_ids = {}
+    if use_cache:
+        for key in new_issues:
+            issue_id = grouping_cache.get(key)
+            if issue_id is not None:
+                issue_ids[key] = issue_id
+
+    try:
+        with transaction.atomic():
+            uncached = [key for key in new_issues if key not in issue_ids]
+            if uncached:
+                issue_ids.update(get_issue_ids(uncached))
+            missing = [key for key in new_issues if key not in issue_ids]
+            if missing:
+                Issue.objects.bulk_create(
+                    [
+                        Issue(
+                            project_id=new_issues[key][0],
+                            **new_issues[key][1],
+                            **new_issues[key][2],
+                        )
+                        for key in missing
+                    ],
+                    ignore_conflicts=True,
+                )
+                issue_ids.update(get_issue_ids(missing))
+
+            tag_ids = EventTag.get_ids(
+                pair
+                for _, (_, _, event_kwargs) in events
+                for pair in event_kwargs.get("tags", [])
+            )
+            new_events = {}
+            for project_id, (issue_kwargs, _, event_kwargs) in events:
+                event_kwargs = dict(event_kwargs)
+                tags = event_kwargs.pop("tags", [])
+                event = Event(
+                    issue_id=issue_ids[(project_id, issue_kwargs["hash"])],
+                    tags=sorted(tag_ids[tuple(pair)] for pair in tags),
+                    **event_kwargs,
+                )
+                new_events.setdefault(UUID(str(event.event_id)), event)
+            added_ids = EventMapping.add_new(
+                (event_id, event.issue_id) for event_id, event in new_events.items()
+            )
+            new_events = [
+                event for event_id, event in new_events.items() if event_id in added_ids
+            ]
+            Event.objects.bulk_create(new_events)
+
+            issue_projects = {
+                issue_id: project_id for (project_id, _), issue_id in issue_ids.items()
+            }
+            counts = {}
+            tag_counts = {}
+            for event in new_events:
+                count, last_seen = counts.get(event.issue_id, (0, event.created))
+                counts[event.issue_id] = (count + 1, max(last_seen, event.created))
+                for tag_id in event.tags:
+                    key = (event.issue_id, tag_id)
+                    tag_counts[key] = tag_counts.get(key, 0) + 1
+            Issue.regress_resolved(counts.keys())
+            increment_event_counts(counts)
+            increment_counts(IssueTag, tag_counts)
+            increment_event_stats(
+                (event.issue_id, event.created) for event in new_events
+            )
+    except IntegrityError:
+        if not use_cache:
+            raise
+        # A cached issue may have been deleted by another process.
+        # Its foreign key fails when the transaction commits.
+        for key in new_issues:
+            grouping_cache.delete(key)
+        return bulk_create_events(events, use_cache=False)
+
+    for key, issue_id in issue_ids.items():
+        grouping_cache.set(key, issue_id)
+    log_grouping_cache_stats()
+    alert_counts = {}
+    for event in new_events:
+        key = (issue_projects[event.issue_id], event.issue_id)
+        alert_counts[key] = alert_counts.get(key, 0) + 1
+    record_alert_events(alert_counts)
+    return new_events
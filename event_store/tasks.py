@@ -0,0 +1,107 @@
+import logging
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DataError, IntegrityError
+from celery import shared_task, current_app
+from kombu import Queue
+from rest_framework.exceptions import ValidationError
+from projects.models import Project
+from .serializers import get_serializer_class, bulk_create_events
+from .validation import validate_event
+
+# Raw event payloads waiting to be saved. Workers drain it in batches.
+ingest_queue = Queue("event_store_ingest", routing_key="event_store_ingest")
+BATCH_SCHEDULED_KEY = "event_store:batch_scheduled"
+logger = logging.getLogger(__name__)
+
+
+def enqueue_event(project_id: int, data: dict):
+    """
+    Add an event to the ingest queue and make sure a batch is scheduled to
+    process it within EVENT_STORE_BATCH_WINDOW seconds.
+    """
+    with current_app.producer_pool.acquire(block=True) as producer:
+        producer.publish(
+            {"project_id": project_id, "data": data},
+            exchange="",
+            routing_key=ingest_queue.routing_key,
+            declare=[ingest_queue],
+            serializer="json",
+            retry=True,
+        )
+    window = settings.EVENT_STORE_BATCH_WINDOW
+    if cache.add(BATCH_SCHEDULED_KEY, True, window):
+        process_event_batch.apply_async(countdown=window)
+
+
+def store_event_batch(payloads):
+    """
+    Validate and save a list of queued {"project_id", "data"} payloads
+    Invalid or malformed events and events for deleted projects are dropped.
+    When the database rejects the batch, events are saved one at a time and
+    rejected ones dropped, so one bad event can't keep the rest of the batch
+    from being stored.
+    """
+    project_ids = set(
+        Project.objects.filter(
+            pk__in={payload["project_id"] for payload in payloads}
+        ).values_list("pk", flat=True)
+    )
+    events = []
+    for payload in payloads:
+        if payload["project_id"] not in project_ids:
+            continue
+        serializer_class = get_serializer_class(payload["data"])
+        try:
+            data = validate_event(serializer_class, payload["data"])
+        except ValidationError:
+            continue
+        try:
+            prepared = serializer_class().prepare(data)
+        except Exception:  # pylint: disable=broad-except
+            # Payloads the schema accepts may still be malformed
+            logger.exception(
+                "Dropped a malformed event of project %s", payload["project_id"]
+            )
+            continue
+        events.append((payload["project_id"], prepared))
+    try:
+        return bulk_create_events(events)
+    except (DataError, IntegrityError):
+        logger.warning("Saving a batch of events failed, saving them one at a time")
+    saved = []
+    for event in events:
+        try:
+            saved += bulk_create_events([event])
+        except (DataError, IntegrityError):
+            logger.exception("Dropped an event of project %s", event[0])
+    return saved
+
+
+@shared_task(ignore_result=True)
+def process_event_batch():
+    """
+    Save up to EVENT_STORE_BATCH_SIZE queued events at once.
+    Reschedules itself right away while the queue has a full batch waiting.
+    """
+    batch_size = settings.EVENT_STORE_BATCH_SIZE
+    cache.delete(BATCH_SCHEDULED_KEY)
+    with current_app.pool.acquire(block=True) as connection:
+        queue = connection.SimpleQueue(ingest_queue)
+        try:
+            messages = []
+            while len(messages) < batch_size:
+                try:
+                    messages.append(queue.get(block=False))
+                except queue.Empty:
+                    break
+            if messages:
+                # Events the database rejects are logged and dropped. Other
+                # errors leave the batch unacked, to be delivered again.
+                store_event_batch([message.payload for message in messages])
+                for message in messages:
+                    message.ack()
+        finally:
+            queue.close()
+    if len(messages) == batch_size:
+        process_event_batch.delay()
@@ -1,25 +1,70 @@
+import gzip
+import io
 import json
+import uuid
+from unittest import mock
+from django.core import management
 from django.shortcuts import reverse
+from django.test import TestCase, TransactionTestCase, override_settings
+from rest_framework import renderers, serializers
+from rest_framework.exceptions import ParseError, ValidationError
 from rest_framework.test import APITestCase
 from model_bakery import baker
 from glitchtip import test_utils  # pylint: disable=unused-import
-from issues.models import Issue, Event, EventStatus
+from glitchtip.middleware.proxy import DecompressBodyMiddleware, brotli, zstandard
+from glitchtip.parsers import JSONParser
+from glitchtip.renderers import JSONRenderer
+from alerts.models import project_alerts_cache
+from issues.models import (
+    Issue,
+    Event,
+    EventStatus,
+    EventType,
+    EventTag,
+    IssueTag,
+    grouping_cache,
+)
+from .serializers import (
+    StoreDefaultSerializer,
+    get_serializer_class,
+    bulk_create_events,
+)
+from .tasks import store_event_batch
+from .test_data import django_error_factory
 from .test_data.csp import mdn_sample_csp
+from .validation import validate_event
 
 
 class EventStoreTestCase(APITestCase):
     def setUp(self):
+        grouping_cache.clear()
+        project_alerts_cache.clear()
         self.project = baker.make("projects.Project")
         self.projectkey = self.project.projectkey_set.first()
         self.params = f"?sentry_key={self.projectkey.public_key}"
         self.url = reverse("event_store", args=[self.project.id]) + self.params
 
+    def test_invalid_json(self):
+        res = self.client.post(self.url, b"{", content_type="application/json")
+        self.assertEqual(res.status_code, 400)
+
     def test_store_api(self):
         with open("event_store/test_data/py_hi_event.json") as json_file:
             data = json.load(json_file)
         res = self.client.post(self.url, data, format="json")
         self.assertEqual(res.status_code, 200)
 
+    def test_grouping_cache_stats(self):
+        """ Synchronous ingest logs grouping cache stats now and then """
+        with open("event_store/test_data/py_hi_event.json") as json_file:
+            data = json.load(json_file)
+        with self.assertLogs("event_store.serializers", "INFO") as logs:
+            self.client.post(self.url, data, format="json")
+            data["event_id"] = uuid.uuid4().hex
+            self.client.post(self.url, data, format="json")
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn("Grouping cache: 0 hits, 1 misses", logs.output[0])
+
     def test_store_api_auth_failure(self):
         url = "/api/1/store/"
         with open("event_store/test_data/py_hi_event.json") as json_file:
@@ -33,6 +78,178 @@ class EventStoreTestCase(APITestCase):
         res = self.client.post(self.url, data, format="json")
         self.assertEqual(res.status_code, 200)
 
+    def test_rate_limit(self):
+        self.projectkey.rate_limit_count = 1
+        self.projectkey.rate_limit_window = 60
+        self.projectkey.save()
+        with open("event_store/test_data/py_hi_event.json") as json_file:
+            data = json.load(json_file)
+        res = self.client.post(self.url, data, format="json")
+        self.assertEqual(res.status_code, 200)
+        res = self.client.post(self.url, data, format="json")
+        self.assertEqual(res.status_code, 429)
+        retry_after = int(res["Retry-After"])
+        self.assertTrue(1 <= retry_after <= 60)
+        self.assertEqual(res["X-Sentry-Rate-Limits"], f"{retry_after}::key")
+        self.assertEqual(Event.objects.count(), 1)
+
+    def test_event_quota(self):
+        organization = self.project.organization
+        organization.event_quota = 1
+        organization.save()
+        with open("event_store/test_data/py_hi_event.json") as json_file:
+            data = json.load(json_file)
+        res = self.client.post(self.url, data, format="json")
+        self.assertEqual(res.status_code, 200)
+        res = self.client.post(self.url, data, format="json")
+        self.assertEqual(res.status_code, 429)
+        self.assertEqual(
+            res["X-Sentry-Rate-Limits"],
+            f"{res['Retry-After']}::organization:usage_exceeded",
+        )
+
+    def test_duplicate_event_id(self):
+        with open("event_store/test_data/py_hi_event.json") as json_file:
+            data = json.load(json_file)
+        for _ in range(2):
+            res = self.client.post(self.url, data, format="json")
+            self.assertEqual(res.status_code, 200)
+        self.assertEqual(Event.objects.count(), 1)
+        self.assertEqual(Issue.objects.get().count, 1)
+
+    def test_gzip_event(self):
+        with open("event_store/test_data/py_hi_event.json", "rb") as json_file:
+            body = gzip.compress(json_file.read())
+        res = self.client.post(
+            self.url,
+            body,
+            content_type="application/json",
+            HTTP_CONTENT_ENCODING="gzip",
+        )
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(Event.objects.exists())
+
+        with override_settings(MAX_DECOMPRESSED_BODY_SIZE=1000):
+            res = self.client.post(
+                self.url,
+                body,
+                content_type="application/json",
+                HTTP_CONTENT_ENCODING="gzip",
+            )
+        self.assertEqual(res.status_code, 413)
+
+    def test_compressed_event(self):
+        """ br and zstd bodies, bombs of both stop at the size limit """
+        with open("event_store/test_data/py_hi_event.json") as json_file:
+            data = json.load(json_file)
+        bomb = b"{" + b" " * (10 * 1024 * 1024) + b"}"
+        encoders = {}
+        if brotli:
+            encoders["br"] = lambda data: brotli.compress(data, quality=1)
+        if zstandard:
+            encoders["zstd"] = zstandard.ZstdCompressor().compress
+        for encoding, compress in encoders.items():
+            data["event_id"] = uuid.uuid4().hex
+            res = self.client.post(
+                self.url,
+                compress(json.dumps(data).encode()),
+                content_type="application/json",
+                HTTP_CONTENT_ENCODING=encoding,
+            )
+            self.assertEqual(res.status_code, 200, encoding)
+            self.assertTrue(Event.objects.filter(pk=data["event_id"]).exists())
+            with override_settings(MAX_DECOMPRESSED_BODY_SIZE=1024 * 1024):
+                res = self.client.post(
+                    self.url,
+                    compress(bomb),
+                    content_type="application/json",
+                    HTTP_CONTENT_ENCODING=encoding,
+                )
+            self.assertEqual(res.status_code, 413, encoding)
+
+        with mock.patch.dict(DecompressBodyMiddleware.decoders, {"br": None}):
+            res = self.client.post(
+                self.url,
+                b"",
+                content_type="application/json",
+                HTTP_CONTENT_ENCODING="br",
+            )
+        self.assertEqual(res.status_code, 415)
+
+    def test_envelope(self):
+        with open("event_store/test_data/py_hi_event.json") as json_file:
+            data = json.load(json_file)
+        event_id = data.pop("event_id")
+        event = json.dumps(data).encode()
+        csp = json.dumps(mdn_sample_csp).encode()
+        attachment = b"not json\n" * 10
+        body = b"\n".join(
+            [
+                json.dumps({"event_id": event_id, "dsn": "https://k@host/1"}).encode(),
+                json.dumps({"type": "event", "length": len(event)}).encode(),
+                event,
+                json.dumps({"type": "attachment", "length": len(attachment)}).encode(),
+                attachment,
+                b'{"type": "session"}',
+                b'{"started": "2020-01-01T00:00:00Z"}',
+                b'{"type": "security"}',
+                csp,
+            ]
+        )
+        url = reverse("envelope_store", args=[self.project.id]) + self.params
+        res = self.client.post(
+            url,
+            gzip.compress(body),
+            content_type="application/x-sentry-envelope",
+            HTTP_CONTENT_ENCODING="gzip",
+        )
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(uuid.UUID(res.data["id"]).hex, event_id)
+        self.assertEqual(Event.objects.count(), 2)
+        self.assertNotEqual(Event.objects.get(pk=event_id).type, "csp")
+        self.assertTrue(Event.objects.filter(issue__type=EventType.CSP).exists())
+
+        # Authenticated by the envelope's DSN
+        url = reverse("envelope_store", args=[self.project.id])
+        dsn = f"https://{self.projectkey.public_key}@host/{self.project.id}"
+        body = b"\n".join(
+            [
+                json.dumps({"dsn": dsn, "event_id": uuid.uuid4().hex}).encode(),
+                b'{"type":"event"}',
+                event,
+            ]
+        )
+        res = self.client.post(url, body, content_type="application/x-sentry-envelope")
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(Event.objects.count(), 3)
+
+        res = self.client.post(url, b"{", content_type="application/x-sentry-envelope")
+        self.assertEqual(res.status_code, 400)
+
+    def test_envelope_rate_limit(self):
+        """ Items over the limit are dropped, stored ones aren't resent """
+        self.projectkey.rate_limit_count = 1
+        self.projectkey.rate_limit_window = 60
+        self.projectkey.save()
+        with open("event_store/test_data/py_hi_event.json") as json_file:
+            data = json.load(json_file)
+        items = []
+        for _ in range(2):
+            items += [
+                b'{"type":"event"}',
+                json.dumps({**data, "event_id": uuid.uuid4().hex}).encode(),
+            ]
+        url = reverse("envelope_store", args=[self.project.id]) + self.params
+        body = b"\n".join([b"{}"] + items)
+        res = self.client.post(url, body, content_type="application/x-sentry-envelope")
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res["X-Sentry-Rate-Limits"].endswith("::key"))
+        self.assertEqual(Event.objects.count(), 1)
+
+        res = self.client.post(url, body, content_type="application/x-sentry-envelope")
+        self.assertEqual(res.status_code, 429)
+        self.assertEqual(Event.objects.count(), 1)
+
     def test_csp_event(self):
         url = reverse("csp_store", args=[self.project.id]) + self.params
         data = mdn_sample_csp
@@ -55,3 +272,237 @@ class EventStoreTestCase(APITestCase):
         self.client.post(self.url, data, format="json")
         issue.refresh_from_db()
         self.assertEqual(issue.status, EventStatus.UNRESOLVED)
+
+    def test_issue_counts(self):
+        with open("event_store/test_data/py_hi_event.json") as json_file:
+            data = json.load(json_file)
+        self.client.post(self.url, data, format="json")
+        data["event_id"] = uuid.uuid4().hex
+        self.client.post(self.url, data, format="json")
+        issue = Issue.objects.get()
+        self.assertEqual(issue.count, 2)
+        self.assertEqual(issue.last_seen, issue.event_set.first().created)
+
+    @override_settings(EVENT_STORE_ASYNC=True)
+    def test_store_api_async(self):
+        with open("event_store/test_data/py_error.json") as json_file:
+            data = json.load(json_file)
+        res = self.client.post(self.url, data, format="json")
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data["id"], data["event_id"])
+        self.assertTrue(Event.objects.filter(event_id=data["event_id"]).exists())
+
+    @override_settings(EVENT_STORE_ASYNC=True)
+    def test_csp_event_async(self):
+        url = reverse("csp_store", args=[self.project.id]) + self.params
+        res = self.client.post(url, mdn_sample_csp, format="json")
+        self.assertEqual(res.status_code, 200)
+        event = Event.objects.get()
+        self.assertEqual(res.data["id"], event.event_id_hex)
+
+
+class BulkCreateEventsTestCase(TestCase):
+    def setUp(self):
+        grouping_cache.clear()
+        project_alerts_cache.clear()
+        self.project = baker.make("projects.Project")
+
+    def prepare(self, data):
+        serializer = get_serializer_class(data)(data=data)
+        serializer.is_valid()
+        return (self.project.pk, serializer.prepare(serializer.data))
+
+    def test_bulk_create_events(self):
+        with open("event_store/test_data/py_hi_event.json") as json_file:
+            data = json.load(json_file)
+        events = [self.prepare(mdn_sample_csp)]
+        for _ in range(3):
+            data["event_id"] = uuid.uuid4().hex
+            events.append(self.prepare(data))
+        issue_kwargs = events[-1][1][0]
+        resolved_issue = baker.make(
+            "issues.Issue",
+            project=self.project,
+            status=EventStatus.RESOLVED,
+            **issue_kwargs,
+        )
+        # Duplicate event id is skipped
+        events.append(self.prepare(data))
+
+        # Includes reading the project's alert rules and creating new tags
+        with self.assertNumQueries(15):
+            bulk_create_events(events)
+        self.assertEqual(Issue.objects.count(), 2)
+        self.assertEqual(Event.objects.count(), 4)
+        resolved_issue.refresh_from_db()
+        self.assertEqual(resolved_issue.status, EventStatus.UNRESOLVED)
+        self.assertEqual(resolved_issue.event_set.count(), 3)
+        self.assertEqual(resolved_issue.count, 3)
+
+    def test_grouping_cache(self):
+        with open("event_store/test_data/py_hi_event.json") as json_file:
+            data = json.load(json_file)
+        bulk_create_events([self.prepare(data)])
+        issue = Issue.objects.get()
+        self.assertEqual(grouping_cache.get((self.project.pk, issue.hash)), issue.pk)
+
+        data["event_id"] = uuid.uuid4().hex
+        events = [self.prepare(data)]
+        # No issue lookup: tag lookup, event id check, insert and counter updates
+        with self.assertNumQueries(9):
+            bulk_create_events(events)
+        issue.refresh_from_db()
+        self.assertEqual(issue.count, 2)
+
+        issue.delete()
+        self.assertIsNone(grouping_cache.get((self.project.pk, issue.hash)))
+
+    def test_tags(self):
+        with open("event_store/test_data/py_hi_event.json") as json_file:
+            data = json.load(json_file)
+        data["environment"] = "production"
+        data["tags"] = {"customer": "acme", "empty": ""}
+        data["contexts"] = {"os": {"name": "Linux", "version": "5.4"}}
+        events = [self.prepare(data)]
+        data["event_id"] = uuid.uuid4().hex
+        data["tags"] = [["customer", "other"]]
+        events.append(self.prepare(data))
+        bulk_create_events(events)
+
+        event = Event.objects.filter(event_id=data["event_id"]).get()
+        tags = {
+            tag.key: tag.value for tag in EventTag.objects.filter(pk__in=event.tags)
+        }
+        self.assertEqual(tags["customer"], "other")
+        self.assertEqual(tags["environment"], "production")
+        self.assertEqual(tags["os"], "Linux 5.4")
+        self.assertEqual(tags["os.name"], "Linux")
+        self.assertNotIn("empty", tags)
+        counts = dict(
+            IssueTag.objects.filter(issue=event.issue).values_list(
+                "tag__value", "count"
+            )
+        )
+        self.assertEqual(counts["production"], 2)
+        self.assertEqual(counts["acme"], 1)
+
+    def test_payload_builtin_tags(self):
+        """ Built in fields only replace payload tags when they have a value """
+        with open("event_store/test_data/py_hi_event.json") as json_file:
+            data = json.load(json_file)
+        data.pop("environment", None)
+        data["tags"] = {"environment": "prod", "release": "payload"}
+        tags = dict(self.prepare(data)[1][2]["tags"])
+        self.assertEqual(tags["environment"], "prod")
+        self.assertEqual(tags["release"], data["release"])
+
+    def test_store_event_batch_bad_event(self):
+        """ An event the database rejects doesn't keep the batch from saving """
+        with open("event_store/test_data/py_hi_event.json") as json_file:
+            data = json.load(json_file)
+        bad_data = {**data, "event_id": uuid.uuid4().hex, "transaction": "x" * 2000}
+        with self.assertLogs("event_store.tasks", "WARNING"):
+            saved = store_event_batch(
+                [
+                    {"project_id": self.project.pk, "data": data},
+                    {"project_id": self.project.pk, "data": bad_data},
+                ]
+            )
+        self.assertEqual(len(saved), 1)
+        self.assertEqual(Event.objects.get().pk.hex, data["event_id"])
+
+    def test_store_event_batch_malformed_event(self):
+        """ Events that pass validation but can't be prepared are dropped """
+        with open("event_store/test_data/py_hi_event.json") as json_file:
+            data = json.load(json_file)
+        csp = {"csp-report": {"blocked-uri": "http://example.com/x.js"}}
+        bad_request = {**data, "event_id": uuid.uuid4().hex, "request": ["x"]}
+        with self.assertLogs("event_store.tasks", "ERROR"):
+            saved = store_event_batch(
+                [
+                    {"project_id": self.project.pk, "data": csp},
+                    {"project_id": self.project.pk, "data": bad_request},
+                    {"project_id": self.project.pk, "data": data},
+                ]
+            )
+        self.assertEqual(len(saved), 1)
+        self.assertEqual(Event.objects.get().pk.hex, data["event_id"])
+
+    def test_benchmark_command(self):
+        management.call_command(
+            "benchmark_event_store", 10, batch_size=4, stdout=io.StringIO()
+        )
+        self.assertFalse(Event.objects.exists())
+
+    def test_benchmark_json_command(self):
+        stdout = io.StringIO()
+        management.call_command("benchmark_json", 1, stdout=stdout)
+        self.assertIn("Parse", stdout.getvalue())
+
+    def test_validate_event(self):
+        """ The slim validator agrees with the DRF serializers """
+        payloads = list(django_error_factory.all_django_events) + [mdn_sample_csp]
+        for name in ("py_hi_event.json", "incoming_events/very_small_event.json"):
+            with open(f"event_store/test_data/{name}") as json_file:
+                payloads.append(json.load(json_file))
+        payloads += [
+            {**payloads[-1], "timestamp": "2020-01-01T10:00:00.5+02:00"},
+            {**payloads[-1], "event_id": 12, "level": " error ", "release": 1.0},
+            {**payloads[-1], "event_id": "nope", "level": "", "timestamp": 1},
+            {**payloads[-1], "platform": None, "extra": None},
+            {"exception": [{}], "sdk": {}},
+        ]
+        for payload in payloads:
+            serializer_class = get_serializer_class(payload)
+            serializer = serializer_class(data=payload)
+            if serializer.is_valid():
+                self.assertEqual(
+                    validate_event(serializer_class, payload), serializer.data
+                )
+            else:
+                with self.assertRaises(ValidationError) as context:
+                    validate_event(serializer_class, payload)
+                self.assertEqual(context.exception.detail, serializer.errors)
+                self.assertEqual(
+                    context.exception.get_codes(),
+                    serializers.ValidationError(serializer.errors).get_codes(),
+                )
+        with self.assertRaises(ValidationError):
+            validate_event(StoreDefaultSerializer, [])
+
+    def test_json_parser_renderer(self):
+        data = {"message": "caf\u00e9 \u2028", "count": 1, "extra": {1: None}}
+        rendered = JSONRenderer().render(data)
+        self.assertEqual(rendered, renderers.JSONRenderer().render(data))
+        self.assertEqual(
+            JSONParser().parse(io.BytesIO(rendered)),
+            {"message": "caf\u00e9 \u2028", "count": 1, "extra": {"1": None}},
+        )
+        with self.assertRaises(ParseError):
+            JSONParser().parse(io.BytesIO(b'{"message": NaN}'))
+
+
+class GroupingCacheTransactionTestCase(TransactionTestCase):
+    """ Foreign keys are checked on commit, so this needs real transactions """
+
+    def setUp(self):
+        grouping_cache.clear()
+        project_alerts_cache.clear()
+        self.project = baker.make("projects.Project")
+
+    def prepare(self, data):
+        serializer = get_serializer_class(data)(data=data)
+        serializer.is_valid()
+        return (self.project.pk, serializer.prepare(serializer.data))
+
+    def test_stale_issue_id(self):
+        with open("event_store/test_data/py_hi_event.json") as json_file:
+            data = json.load(json_file)
+        prepared = self.prepare(data)
+        issue_kwargs = prepared[1][0]
+        # Issue was deleted by another process, the cached id is stale
+        grouping_cache.set((self.project.pk, issue_kwargs["hash"]), 0)
+        bulk_create_events([prepared])
+        issue = Issue.objects.get()
+        self.assertEqual(issue.event_set.count(), 1)
+        self.assertEqual(grouping_cache.get((self.project.pk, issue.hash)), issue.pk)
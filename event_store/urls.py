@@ -1,7 +1,8 @@
 from django.urls import path
-from .views import EventStoreAPIView, CSPStoreAPIView
+from .views import EventStoreAPIView, CSPStoreAPIView, EnvelopeAPIView
 
 urlpatterns = [
     path("<int:id>/store/", EventStoreAPIView.as_view(), name="event_store"),
     path("<int:id>/security/", CSPStoreAPIView.as_view(), name="csp_store"),
+    path("<int:id>/envelope/", EnvelopeAPIView.as_view(), name="envelope_store"),
 ]
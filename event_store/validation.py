@@ -0,0 +1,96 @@
+"""
+One pass validation of store payloads without instantiating DRF serializers.
+
+The schema of each store serializer is compiled once from its declared fields.
+Common values are checked with plain type checks, anything else goes through
+the DRF field, so the result and errors match serializer.data and
+serializer.errors.
+"""
+import uuid
+from rest_framework import serializers
+from rest_framework.exceptions import ErrorDetail
+from rest_framework.fields import empty
+from rest_framework.settings import api_settings
+
+schemas = {}
+
+
+def validate_json(value):
+    if value is not None:
+        return value
+    return empty
+
+
+def validate_char(value):
+    if type(value) is str:
+        value = value.strip()
+        if value and "\x00" not in value:
+            return value
+    return empty
+
+
+def validate_uuid(value):
+    if type(value) is str:
+        try:
+            return str(uuid.UUID(hex=value))
+        except ValueError:
+            pass
+    return empty
+
+
+# Returns the value as serializer.data would, or empty to let the field decide
+FAST_VALIDATORS = {
+    serializers.JSONField: validate_json,
+    serializers.CharField: validate_char,
+    serializers.UUIDField: validate_uuid,
+}
+
+
+def get_schema(serializer_class):
+    """ List of (name, field, fast validator or None) of a serializer class """
+    schema = schemas.get(serializer_class)
+    if schema is None:
+        schema = schemas[serializer_class] = [
+            (name, field, FAST_VALIDATORS.get(type(field)))
+            for name, field in serializer_class().fields.items()
+        ]
+    return schema
+
+
+def validate_event(serializer_class, data) -> dict:
+    """
+    Returns the validated event data, the same as serializer.data after
+    is_valid(). Raises ValidationError with the same detail as serializer.errors
+    """
+    if not isinstance(data, dict):
+        message = serializers.Serializer.default_error_messages["invalid"]
+        raise serializers.ValidationError(
+            {
+                api_settings.NON_FIELD_ERRORS_KEY: [
+                    message.format(datatype=type(data).__name__)
+                ]
+            }
+        )
+
+    result = {}
+    errors = {}
+    for name, field, fast_validator in get_schema(serializer_class):
+        value = data.get(name, empty)
+        if value is empty:
+            if field.required:
+                errors[name] = [
+                    ErrorDetail(field.error_messages["required"], code="required")
+                ]
+            continue
+        if fast_validator is not None:
+            validated = fast_validator(value)
+            if validated is not empty:
+                result[name] = validated
+                continue
+        try:
+            result[name] = field.to_representation(field.run_validation(value))
+        except serializers.ValidationError as exc:
+            errors[name] = exc.detail
+    if errors:
+        raise serializers.ValidationError(errors)
+    return result
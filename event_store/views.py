@@ -1,17 +1,21 @@
 import json
+import uuid
 from django.core.exceptions import SuspiciousOperation
 from django.conf import settings
-from rest_framework import permissions, exceptions
+from rest_framework import permissions, exceptions, status
 from rest_framework.negotiation import BaseContentNegotiation
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from sentry.utils.auth import parse_auth_header
-from projects.models import Project
-from .serializers import (
-    StoreDefaultSerializer,
-    StoreErrorSerializer,
-    StoreCSPReportSerializer,
-)
+from glitchtip.parsers import JSONParser
+from glitchtip.renderers import JSONRenderer
+from organizations_ext.quotas import check_event_quota
+from projects.models import ProjectKey
+from .envelope import Envelope
+from .rate_limits import check_rate_limit
+from .serializers import get_serializer_class
+from .tasks import enqueue_event
+from .validation import validate_event
 
 
 class IgnoreClientContentNegotiation(BaseContentNegotiation):
@@ -37,31 +41,91 @@ class EventStoreAPIView(APIView):
     permission_classes = [permissions.AllowAny]
     authentication_classes = []
     content_negotiation_class = IgnoreClientContentNegotiation
+    parser_classes = [JSONParser]
+    renderer_classes = [JSONRenderer]
     http_method_names = ["post"]
 
     def get_serializer_class(self, data=[]):
         """ Determine event type and return serializer """
-        if "exception" in data and data["exception"]:
-            return StoreErrorSerializer
-        if "platform" not in data:
-            return StoreCSPReportSerializer
-        return StoreDefaultSerializer
+        return get_serializer_class(data)
 
     def post(self, request, *args, **kwargs):
+        # Authenticate and rate limit before the body is parsed
+        sentry_key = EventStoreAPIView.auth_from_request(request)
+        project_key = self.get_project_key(kwargs.get("id"), sentry_key)
+        rate_limited = self.check_limits(project_key)
+        if rate_limited:
+            return rate_limited
         if settings.EVENT_STORE_DEBUG:
             print(json.dumps(request.data))
-        sentry_key = EventStoreAPIView.auth_from_request(request)
-        project = Project.objects.filter(
-            id=kwargs.get("id"), projectkey__public_key=sentry_key
-        ).first()
-        if not project:
+        event_id = self.store_event(project_key.project, request.data)
+        if event_id is None:
+            # TODO {"error": "Invalid api key"}, CSP type, valid json but no type at all
+            return Response()
+        return Response({"id": event_id})
+
+    def get_project_key(self, project_id, sentry_key):
+        project_key = ProjectKey.get_for_store(project_id, sentry_key)
+        if not project_key:
             raise exceptions.PermissionDenied()
-        serializer = self.get_serializer_class(request.data)(data=request.data)
-        if serializer.is_valid():
-            event = serializer.create(project, serializer.data)
-            return Response({"id": event.event_id_hex})
-        # TODO {"error": "Invalid api key"}, CSP type, valid json but no type at all
-        return Response()
+        return project_key
+
+    def check_limits(self, project_key):
+        """
+        Count an event against the key's rate limit and the organization's quota
+        Returns a 429 response when either is used up, otherwise None.
+        """
+        retry_after = check_rate_limit(project_key)
+        if retry_after:
+            return self.rate_limited(retry_after, "key")
+        retry_after = check_event_quota(project_key.project.organization)
+        if retry_after:
+            return self.rate_limited(retry_after, "organization:usage_exceeded")
+        return None
+
+    def store_event(self, project, data):
+        """
+        Save the event, or queue it when EVENT_STORE_ASYNC is on
+        Returns the event id, None when the event is invalid.
+        """
+        if settings.EVENT_STORE_ASYNC:
+            return self.enqueue_event(project, data)
+        serializer_class = self.get_serializer_class(data)
+        try:
+            data = validate_event(serializer_class, data)
+        except exceptions.ValidationError:
+            return None
+        event = serializer_class().create(project, data)
+        if event is None:  # Already stored
+            return data["event_id"]
+        return event.event_id_hex
+
+    def rate_limited(self, retry_after: int, scope: str):
+        """ Tell SDKs to stop sending events for retry_after seconds """
+        return Response(
+            {"detail": "Rate limit exceeded"},
+            status=status.HTTP_429_TOO_MANY_REQUESTS,
+            headers={
+                "Retry-After": str(retry_after),
+                # retry after:categories (all):scope[:reason]
+                "X-Sentry-Rate-Limits": f"{retry_after}::{scope}",
+            },
+        )
+
+    def enqueue_event(self, project, data):
+        """
+        Queue the event for celery workers and return its id right away.
+        Only the shape of the payload is checked here, workers do full
+        validation, grouping and persistence in batches.
+        """
+        if not isinstance(data, dict):
+            raise exceptions.ParseError("Event payload must be a JSON object")
+        try:
+            event_id = uuid.UUID(str(data.get("event_id") or uuid.uuid4()))
+        except ValueError:
+            raise exceptions.ValidationError({"event_id": "Must be a valid UUID."})
+        enqueue_event(project.id, {**data, "event_id": event_id.hex})
+        return event_id.hex
 
     @classmethod
     def auth_from_request(cls, request):
@@ -90,3 +154,53 @@ class EventStoreAPIView(APIView):
 
 class CSPStoreAPIView(EventStoreAPIView):
     pass
+
+
+class EnvelopeAPIView(EventStoreAPIView):
+    """
+    Newer SDKs send events in envelopes, which may hold several items.
+    Event and security (CSP) items are stored like on the store endpoints,
+    other item types are skipped.
+    """
+
+    item_types = {"event", "security"}
+
+    def post(self, request, *args, **kwargs):
+        if request.stream is None:
+            raise exceptions.ParseError("Empty envelope")
+        envelope = Envelope(request.stream, self.item_types)
+        try:
+            sentry_key = self.auth_from_request(request)
+        except exceptions.NotAuthenticated:
+            sentry_key = envelope.get_public_key()
+            if not sentry_key:
+                raise
+        project_key = self.get_project_key(kwargs.get("id"), sentry_key)
+
+        # The header's event id belongs to the envelope's event item
+        event_id = envelope.headers.get("event_id")
+        response_id = event_id
+        stored = False
+        rate_limited = None
+        for headers, data in envelope:
+            if not isinstance(data, dict):
+                continue
+            if rate_limited:  # Items after the first limited one are dropped
+                continue
+            if headers.get("type") == "event" and event_id and not data.get("event_id"):
+                data = {**data, "event_id": event_id}
+            rate_limited = self.check_limits(project_key)
+            if rate_limited:
+                continue
+            stored_id = self.store_event(project_key.project, data)
+            if stored_id:
+                stored = True
+                response_id = response_id or stored_id
+
+        if rate_limited and not stored:
+            return rate_limited
+        response = Response({"id": response_id})
+        if rate_limited:
+            # Stored items must not be resent, only tell the SDK to back off
+            response["X-Sentry-Rate-Limits"] = rate_limited["X-Sentry-Rate-Limits"]
+        return response
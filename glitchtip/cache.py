@@ -0,0 +1,73 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Small in-process least recently used cache with a time to live.
+    Every worker process has its own copy, so invalidation only reaches the
+    current process. Keep the ttl short for data that may change.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._stats_due = 0.0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[1] < time.monotonic():
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+            self._stats_due = 0.0
+
+    def stats(self):
+        """ Hit and miss counts, useful to size the cache """
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def stats_if_due(self, interval):
+        """ stats() at most once per interval seconds, None in between """
+        now = time.monotonic()
+        with self._lock:
+            if now < self._stats_due:
+                return None
+            self._stats_due = now + interval
+        return self.stats()
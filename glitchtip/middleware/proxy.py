@@ -10,7 +10,24 @@ try:
 except ImportError:
     has_uwsgi = False
 
+# Optional decoders for "content-encoding: br" and "content-encoding: zstd"
+try:
+    import brotli
+
+    # Bounded output needs brotli 1.2, older versions can't stop a brotli bomb
+    if not hasattr(brotli.Decompressor, "can_accept_more_data"):
+        brotli = None
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 from django.conf import settings
+from django.core.exceptions import RequestDataTooBig
+from django.http import HttpResponse
 
 logger = logging.getLogger(__name__)
 Z_CHUNK = 1024 * 8
@@ -105,6 +122,72 @@ class GzipDecoder(ZDecoder):
         ZDecoder.__init__(self, fp, zlib.decompressobj(16 + zlib.MAX_WBITS))
 
 
+class BrotliDecoder(io.RawIOBase):
+    """
+    Decoding for "content-encoding: br"
+    Output is produced in chunks of at most Z_CHUNK bytes, a small input can't
+    expand to more than that before SizeLimitedReader counts it.
+    """
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.decompressor = brotli.Decompressor()
+        self.buffer = b""
+        self.eof = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, buf):
+        while not self.buffer and not self.eof:
+            if self.decompressor.can_accept_more_data():
+                chunk = self.fp.read(Z_CHUNK)
+                if not chunk:
+                    self.eof = True
+                    break
+            else:  # Output of earlier input is still pending
+                chunk = b""
+            self.buffer = self.decompressor.process(chunk, output_buffer_limit=Z_CHUNK)
+        n = min(len(buf), len(self.buffer))
+        buf[:n] = self.buffer[:n]
+        self.buffer = self.buffer[n:]
+        return n
+
+
+def ZstdDecoder(fp):
+    """ Decoding for "content-encoding: zstd" """
+    return zstandard.ZstdDecompressor().stream_reader(fp, read_size=Z_CHUNK)
+
+
+class DecompressedBodyTooBig(RequestDataTooBig):
+    pass
+
+
+class SizeLimitedReader(io.RawIOBase):
+    """
+    Read a decoded stream, raising DecompressedBodyTooBig once more than
+    max_size bytes come out of it. Stops zip bombs from using up memory.
+    """
+
+    def __init__(self, fp, max_size):
+        self.fp = fp
+        self.max_size = max_size
+        self.size = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buf):
+        data = self.fp.read(len(buf))
+        self.size += len(data)
+        if self.size > self.max_size:
+            raise DecompressedBodyTooBig(
+                f"Decompressed request body exceeds {self.max_size} bytes"
+            )
+        buf[: len(data)] = data
+        return len(data)
+
+
 class SetRemoteAddrFromForwardedFor(object):
     def __init__(self):
         if not getattr(settings, "SENTRY_USE_X_FORWARDED_FOR", True):
@@ -157,26 +240,34 @@ class ChunkedMiddleware(object):
 
 
 class DecompressBodyMiddleware(object):
+    decoders = {
+        "gzip": GzipDecoder,
+        "deflate": DeflateDecoder,
+        "br": BrotliDecoder if brotli else None,
+        "zstd": ZstdDecoder if zstandard else None,
+    }
+
     def __init__(self, get_response):
         self.get_response = get_response
 
     def __call__(self, request):
-        decode = False
         encoding = request.META.get("HTTP_CONTENT_ENCODING", "").lower()
 
-        if encoding == "gzip":
-            request._stream = GzipDecoder(request._stream)
-            decode = True
-
-        if encoding == "deflate":
-            request._stream = DeflateDecoder(request._stream)
-            decode = True
+        if encoding in self.decoders:
+            decoder = self.decoders[encoding]
+            if decoder is None:
+                return HttpResponse(
+                    f"Unsupported content encoding {encoding}", status=415
+                )
+            max_size = settings.MAX_DECOMPRESSED_BODY_SIZE
+            # Buffered, so readline() doesn't read the body a byte at a time
+            request._stream = io.BufferedReader(
+                SizeLimitedReader(decoder(request._stream), max_size)
+            )
 
-        if decode:
             # Since we don't know the original content length ahead of time, we
-            # need to set the content length reasonably high so read generally
-            # succeeds. This seems to be the only easy way for Django 1.6.
-            request.META["CONTENT_LENGTH"] = "4294967295"  # 0xffffffff
+            # need to set the content length high enough for any allowed body.
+            request.META["CONTENT_LENGTH"] = str(max_size)
 
             # The original content encoding is no longer valid, so we have to
             # remove the header. Otherwise, LazyData will attempt to re-decode
@@ -184,6 +275,11 @@ class DecompressBodyMiddleware(object):
             del request.META["HTTP_CONTENT_ENCODING"]
         return self.get_response(request)
 
+    def process_exception(self, request, exception):
+        if isinstance(exception, DecompressedBodyTooBig):
+            return HttpResponse(str(exception), status=413)
+        return None
+
 
 class ContentLengthHeaderMiddleware(object):
     """
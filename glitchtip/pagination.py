@@ -1,4 +1,7 @@
-from rest_framework.pagination import CursorPagination
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination
 from rest_framework.response import Response
 
 
@@ -25,3 +28,87 @@ class LinkHeaderPagination(CursorPagination):
         headers = {"Link": ", ".join(links)} if links else {}
 
         return Response(data, headers=headers)
+
+
+class KeysetPagination(LinkHeaderPagination):
+    """ Paginate newest first by a sort column and the primary key.
+    Pages continue from the (value, pk) of the row they start after, an index
+    seek that costs the same on deep pages as on the first one.
+    The view's sort_fields maps ?sort= names to columns, the first is default.
+    """
+
+    sort_query_param = "sort"
+    page_size_query_param = "limit"
+    max_page_size = 100
+
+    def get_sort_field(self, request, view):
+        sort_fields = view.sort_fields
+        sort = request.query_params.get(self.sort_query_param)
+        return sort_fields.get(sort, next(iter(sort_fields.values())))
+
+    def decode_position(self, model, position):
+        try:
+            value, pk = position.rsplit("|", 1)
+            return (
+                model._meta.get_field(self.sort_field).to_python(value),
+                model._meta.pk.to_python(pk),
+            )
+        except (ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_position(self, obj):
+        value = obj._meta.get_field(self.sort_field).value_to_string(obj)
+        return f"{value}|{obj.pk}"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.sort_field = self.get_sort_field(request, view)
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor.reverse
+        field = self.sort_field
+
+        if self.cursor is not None:
+            value, pk = self.decode_position(queryset.model, self.cursor.position)
+            # The plain bound on the sort column is what the index seeks to
+            if reverse:
+                queryset = queryset.filter(
+                    Q(**{f"{field}__gt": value}) | Q(**{field: value, "pk__gt": pk}),
+                    **{f"{field}__gte": value},
+                )
+            else:
+                queryset = queryset.filter(
+                    Q(**{f"{field}__lt": value}) | Q(**{field: value, "pk__lt": pk}),
+                    **{f"{field}__lte": value},
+                )
+
+        if reverse:
+            queryset = queryset.order_by(field, "pk")
+        else:
+            queryset = queryset.order_by(f"-{field}", "-pk")
+        results = list(queryset[: self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[: self.page_size]
+        if reverse:
+            self.page.reverse()
+            self.has_next = True
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = self.cursor is not None
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        position = self.encode_position(self.page[-1])
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=position))
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        position = self.encode_position(self.page[0])
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=position))
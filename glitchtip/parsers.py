@@ -0,0 +1,23 @@
+from django.conf import settings
+from rest_framework import parsers
+from rest_framework.exceptions import ParseError
+from .renderers import JSONRenderer, orjson
+
+
+class JSONParser(parsers.JSONParser):
+    """
+    Parses JSON with orjson when it is installed, otherwise with the stdlib.
+    orjson always rejects NaN and Infinity, like DRF's STRICT_JSON.
+    """
+
+    renderer_class = JSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get("encoding", settings.DEFAULT_CHARSET)
+        if orjson is None or encoding.lower().replace("-", "") != "utf8":
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return orjson.loads(stream.read())
+        except ValueError as exc:
+            raise ParseError("JSON parse error - %s" % str(exc))
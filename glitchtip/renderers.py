@@ -0,0 +1,33 @@
+from rest_framework import renderers
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class JSONRenderer(renderers.JSONRenderer):
+    """
+    Renders JSON with orjson when it is installed, otherwise with the stdlib.
+    Output matches DRF's renderer: types orjson doesn't know and datetimes go
+    through DRF's encoder. Indented output, as in the browsable API, uses DRF.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or self.ensure_ascii or not self.compact:
+            return super().render(data, accepted_media_type, renderer_context)
+        if data is None:
+            return b""
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        ret = orjson.dumps(
+            data,
+            default=self.encoder_class().default,
+            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME,
+        )
+        # Same escaping of line and paragraph separators as DRF
+        if b"\xe2\x80\xa8" in ret or b"\xe2\x80\xa9" in ret:
+            ret = ret.replace(b"\xe2\x80\xa8", b"\\u2028")
+            ret = ret.replace(b"\xe2\x80\xa9", b"\\u2029")
+        return ret
@@ -62,6 +62,12 @@ GLITCHTIP_DOMAIN = env.url("GLITCHTIP_DOMAIN", default="http://localhost:8000")
 
 # For development purposes only, prints out inbound event store json
 EVENT_STORE_DEBUG = env.bool("EVENT_STORE_DEBUG", False)
+# Respond to SDKs right away and let celery workers group and save events
+EVENT_STORE_ASYNC = env.bool("EVENT_STORE_ASYNC", False)
+# Async workers save up to this many events at once
+EVENT_STORE_BATCH_SIZE = env.int("EVENT_STORE_BATCH_SIZE", 100)
+# Seconds to collect async events before saving them
+EVENT_STORE_BATCH_WINDOW = env.float("EVENT_STORE_BATCH_WINDOW", 1.0)
 
 
 # GlitchTip can track GlitchTip's own errors.
@@ -142,6 +148,9 @@ MIDDLEWARE = [
     "glitchtip.middleware.proxy.DecompressBodyMiddleware",
 ]
 
+# Requests with a compressed body that decompresses to more bytes fail with 413
+MAX_DECOMPRESSED_BODY_SIZE = env.int("MAX_DECOMPRESSED_BODY_SIZE", 20 * 1024 * 1024)
+
 ROOT_URLCONF = "glitchtip.urls"
 
 TEMPLATES = [
@@ -213,9 +222,55 @@ CELERY_BROKER_TRANSPORT_OPTIONS = {
     "fanout_patterns": True,
 }
 CELERY_RESULT_BACKEND = "django-db"
+CELERY_BEAT_SCHEDULE = {
+    # Events without a daily partition fall into the slow default partition
+    "create-event-partitions": {
+        "task": "issues.tasks.create_future_event_partitions",
+        "schedule": 3600 * 6,
+    },
+    # Project event counts are summed up from issue counts
+    "update-project-stats": {
+        "task": "issues.tasks.update_recent_project_stats",
+        "schedule": 60,
+    },
+}
 CELERY_CACHE_BACKEND = "django-cache"
 CACHES = {"default": {"BACKEND": "redis_cache.RedisCache", "LOCATION": REDIS_URL}}
 
+# Number of hot issues each ingest process remembers to skip issue lookups
+GROUPING_CACHE_SIZE = env.int("GROUPING_CACHE_SIZE", 10000)
+
+# Buffer issue, tag and stat event counts in Redis and write them every few
+# seconds. Avoids row lock contention on busy issues, but counts lag slightly
+# behind
+ISSUE_COUNTER_BUFFER = env.bool("ISSUE_COUNTER_BUFFER", False)
+ISSUE_COUNTER_FLUSH_INTERVAL = env.int("ISSUE_COUNTER_FLUSH_INTERVAL", 10)
+if ISSUE_COUNTER_BUFFER:
+    CELERY_BEAT_SCHEDULE["flush-issue-counters"] = {
+        "task": "issues.tasks.flush_buffered_issue_counters",
+        "schedule": ISSUE_COUNTER_FLUSH_INTERVAL,
+    }
+
+# Seconds to collect alert notifications into one digest email per user
+# 0 emails each notification within a few seconds
+NOTIFICATION_DIGEST_WINDOW = env.int("NOTIFICATION_DIGEST_WINDOW", 0)
+
+# Events are deleted after this many days unless the organization or project
+# sets its own retention. 0 keeps events forever.
+EVENT_RETENTION_DAYS = env.int("EVENT_RETENTION_DAYS", 0)
+CELERY_BEAT_SCHEDULE["cleanup-old-events"] = {
+    "task": "issues.tasks.cleanup_old_events",
+    "schedule": 3600 * 24,
+}
+
+# Events accepted per organization and month unless the organization sets its
+# own quota, 0 is unlimited. Counted in Redis and saved every minute.
+EVENT_QUOTA = env.int("EVENT_QUOTA", 0)
+CELERY_BEAT_SCHEDULE["flush-event-usage"] = {
+    "task": "organizations_ext.tasks.flush_organization_event_usage",
+    "schedule": 60,
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/dev/ref/settings/#auth-password-validators
 
@@ -284,6 +339,15 @@ AUTHENTICATION_BACKENDS = (
 
 REST_FRAMEWORK = {
     "DEFAULT_PERMISSION_CLASSES": ["rest_framework.permissions.IsAuthenticated",],
+    "DEFAULT_PARSER_CLASSES": [
+        "glitchtip.parsers.JSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+    ],
+    "DEFAULT_RENDERER_CLASSES": [
+        "glitchtip.renderers.JSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
     "DEFAULT_PAGINATION_CLASS": "glitchtip.pagination.LinkHeaderPagination",
     "PAGE_SIZE": 50,
     "DEFAULT_FILTER_BACKENDS": ("django_filters.rest_framework.DjangoFilterBackend",),
@@ -341,3 +405,5 @@ elif TESTING:
 
 if TESTING:
     CELERY_TASK_ALWAYS_EAGER = True
+    CELERY_BROKER_URL = "memory://"
+    CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
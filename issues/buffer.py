@@ -0,0 +1,234 @@
+"""
+Buffer issue counter updates in Redis instead of updating Issue, IssueTag and
+IssueStat rows on every event. Busy issues would otherwise serialize ingest on
+their row locks.
+
+Increments are grouped in generations of ISSUE_COUNTER_FLUSH_INTERVAL seconds.
+A generation is one Redis hash of counts, incremented with HINCRBY, and one hash
+of the latest last_seen of each issue. Buffering counts takes one pipelined
+round trip, no matter how many events they are for.
+flush_issue_counters writes closed generations to the database in one
+transaction. A generation is marked flushed before it is written, if the flush
+dies in between its counts are lost rather than added twice.
+"""
+import time
+from datetime import datetime, timedelta
+from functools import lru_cache
+import redis
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .models import Issue
+
+# Unflushed increments are lost after this long, for example when beat is down
+BUFFER_TIMEOUT = 86400
+# Generations with counts one flush reads at most, a backlog takes several
+MAX_FLUSH_GENERATIONS = 100
+# Sorted set of generations with buffered counts
+GENERATIONS_KEY = "issue_buffer:generations"
+FLUSHED_KEY = "issue_buffer:flushed"
+FLUSH_LOCK_KEY = "issue_buffer:flush_lock"
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# Sets fields of the hash KEYS[1] to the larger of their value and the new one
+SET_MAX_SCRIPT = """
+for i = 1, #ARGV, 2 do
+    local current = redis.call("HGET", KEYS[1], ARGV[i])
+    if not current or tonumber(ARGV[i + 1]) > tonumber(current) then
+        redis.call("HSET", KEYS[1], ARGV[i], ARGV[i + 1])
+    end
+end
+"""
+
+
+@lru_cache(maxsize=None)
+def get_redis():
+    return redis.Redis.from_url(settings.REDIS_URL, decode_responses=True)
+
+
+@lru_cache(maxsize=None)
+def get_set_max_script():
+    return get_redis().register_script(SET_MAX_SCRIPT)
+
+
+def get_generation(timestamp=None):
+    if timestamp is None:
+        timestamp = time.time()
+    return int(timestamp // settings.ISSUE_COUNTER_FLUSH_INTERVAL)
+
+
+def generation_key(generation: int, name):
+    return f"issue_buffer:{generation}:{name}"
+
+
+def format_field(label: str, key):
+    """ Hash field of a row's count, key is its id or tuple of ids and dates """
+    parts = key if isinstance(key, tuple) else (key,)
+    return ",".join(
+        [label]
+        + [
+            part.isoformat() if isinstance(part, datetime) else str(part)
+            for part in parts
+        ]
+    )
+
+
+def parse_field(field: str):
+    """ Returns the model label and row key of a hash field """
+    label, *parts = field.split(",")
+    key = tuple(
+        int(part) if part.isdigit() else datetime.fromisoformat(part) for part in parts
+    )
+    return label, key[0] if len(key) == 1 else key
+
+
+def to_microseconds(moment) -> int:
+    return (moment - EPOCH) // timedelta(microseconds=1)
+
+
+def buffer_counts(label: str, counts, last_seens=None):
+    """
+    Add counts of a dict of row key to number to the current generation.
+    last_seens is a dict of issue id to latest event date.
+    """
+    generation = get_generation()
+    counts_key = generation_key(generation, "counts")
+    pipeline = get_redis().pipeline(transaction=False)
+    for key, count in counts.items():
+        pipeline.hincrby(counts_key, format_field(label, key), count)
+    pipeline.expire(counts_key, BUFFER_TIMEOUT)
+    if last_seens:
+        last_seen_key = generation_key(generation, "last_seen")
+        get_set_max_script()(
+            keys=[last_seen_key],
+            args=[
+                arg
+                for pk, last_seen in last_seens.items()
+                for arg in (pk, to_microseconds(last_seen))
+            ],
+            client=pipeline,
+        )
+        pipeline.expire(last_seen_key, BUFFER_TIMEOUT)
+    pipeline.zadd(GENERATIONS_KEY, {generation: generation})
+    pipeline.execute()
+
+
+def buffer_event_counts(counts):
+    """
+    Same as Issue.increment_event_counts, but only touches Redis.
+    counts is a dict of issue id to (number of new events, latest event date)
+    """
+    buffer_counts(
+        Issue._meta.label_lower,
+        {issue_id: count for issue_id, (count, _) in counts.items()},
+        {issue_id: last_seen for issue_id, (_, last_seen) in counts.items()},
+    )
+
+
+def increment_event_counts(counts):
+    """ Update issue counters directly or through the buffer, based on settings """
+    if settings.ISSUE_COUNTER_BUFFER:
+        buffer_event_counts(counts)
+    else:
+        Issue.increment_event_counts(counts)
+
+
+def increment_counts(model, counts):
+    """
+    model.increment_counts(counts) directly or through the buffer, based on
+    settings. Used for IssueTag and IssueStat counts.
+    """
+    if settings.ISSUE_COUNTER_BUFFER:
+        buffer_counts(model._meta.label_lower, counts)
+    else:
+        model.increment_counts(counts)
+
+
+def add_generation_counts(totals, counts, last_seens):
+    """
+    Add the hashes of one generation to totals, a dict of model label to its
+    counts. Issue counts are (count, latest last_seen).
+    """
+    issue_label = Issue._meta.label_lower
+    for field, count in counts.items():
+        label, key = parse_field(field)
+        model_totals = totals.setdefault(label, {})
+        if label != issue_label:
+            model_totals[key] = model_totals.get(key, 0) + int(count)
+            continue
+        if str(key) not in last_seens:
+            continue
+        last_seen = EPOCH + timedelta(microseconds=int(last_seens[str(key)]))
+        total, latest = model_totals.get(key, (0, last_seen))
+        model_totals[key] = (total + int(count), max(latest, last_seen))
+
+
+def save_counts(counts):
+    """ Write the counts of add_generation_counts in one transaction """
+    with transaction.atomic():
+        for label, model_counts in sorted(counts.items()):
+            model = apps.get_model(label)
+            if model is Issue:
+                Issue.increment_event_counts(model_counts)
+            else:
+                model.increment_counts(model_counts)
+
+
+def flush_issue_counters():
+    """
+    Write buffered counts of closed generations to the database.
+    The current and previous generations are left alone so that slow writers
+    and clock skew between servers don't lose increments.
+    Returns the number of rows updated.
+    """
+    client = get_redis()
+    lock_timeout = settings.ISSUE_COUNTER_FLUSH_INTERVAL * 5
+    if not client.set(FLUSH_LOCK_KEY, 1, nx=True, ex=lock_timeout):
+        return 0
+    try:
+        last_closed = get_generation() - 2
+        oldest = get_generation(time.time() - BUFFER_TIMEOUT)
+        flushed = client.get(FLUSHED_KEY)
+        first = oldest if flushed is None else max(int(flushed) + 1, oldest)
+        if last_closed < first:
+            return 0
+        generations = [
+            int(generation)
+            for generation in client.zrangebyscore(
+                GENERATIONS_KEY, first, last_closed, 0, MAX_FLUSH_GENERATIONS
+            )
+        ]
+        if len(generations) == MAX_FLUSH_GENERATIONS:
+            last_closed = generations[-1]
+
+        pipeline = client.pipeline(transaction=False)
+        for generation in generations:
+            pipeline.hgetall(generation_key(generation, "counts"))
+            pipeline.hgetall(generation_key(generation, "last_seen"))
+        hashes = pipeline.execute()
+        counts = {}
+        for generation_counts, last_seens in zip(hashes[::2], hashes[1::2]):
+            add_generation_counts(counts, generation_counts, last_seens)
+
+        client.set(FLUSHED_KEY, last_closed, ex=BUFFER_TIMEOUT)
+        try:
+            save_counts(counts)
+        except Exception:
+            # Nothing was saved, the next flush tries these generations again
+            if flushed is None:
+                client.delete(FLUSHED_KEY)
+            else:
+                client.set(FLUSHED_KEY, flushed, ex=BUFFER_TIMEOUT)
+            raise
+        pipeline = client.pipeline(transaction=False)
+        for generation in generations:
+            pipeline.delete(
+                generation_key(generation, "counts"),
+                generation_key(generation, "last_seen"),
+            )
+        pipeline.zremrangebyscore(GENERATIONS_KEY, "-inf", last_closed)
+        pipeline.execute()
+        return sum(len(model_counts) for model_counts in counts.values())
+    finally:
+        client.delete(FLUSH_LOCK_KEY)
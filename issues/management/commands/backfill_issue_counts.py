@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Min, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from issues.models import Issue, Event
+
+
+class Command(BaseCommand):
+    help = (
+        "Recalculate issue count, first_seen and last_seen from events. "
+        "Run once after upgrading, ingest keeps them up to date afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of issues updated per query",
+        )
+
+    def event_aggregate(self, aggregate):
+        return Subquery(
+            Event.objects.filter(issue=OuterRef("pk"))
+            .order_by()
+            .values("issue")
+            .annotate(value=aggregate)
+            .values("value")
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        issue_ids = list(Issue.objects.order_by("pk").values_list("pk", flat=True))
+        for i in range(0, len(issue_ids), batch_size):
+            batch = issue_ids[i : i + batch_size]
+            Issue.objects.filter(pk__in=batch).update(
+                count=Coalesce(self.event_aggregate(Count("pk")), 0),
+                first_seen=Coalesce(self.event_aggregate(Min("created")), "created"),
+                last_seen=Coalesce(self.event_aggregate(Max("created")), "created"),
+            )
+            self.stdout.write(f"Updated {i + len(batch)} of {len(issue_ids)} issues")
+        self.stdout.write(self.style.SUCCESS("Issue counts are up to date"))
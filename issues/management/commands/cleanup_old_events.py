@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from issues.retention import apply_event_retention
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete events past their organization or project retention, and "
+        "issues left without events. Safe to interrupt and run again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of rows deleted per query",
+        )
+
+    def handle(self, *args, **options):
+        for message in apply_event_retention(options["batch_size"]):
+            self.stdout.write(message)
+        self.stdout.write(self.style.SUCCESS("Old events are cleaned up"))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from issues.partitions import create_event_partitions
+
+
+class Command(BaseCommand):
+    help = (
+        "Create daily event table partitions ahead of time. "
+        "The create-event-partitions beat task runs this regularly."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days", type=int, default=7, help="Number of days ahead to create",
+        )
+
+    def handle(self, *args, **options):
+        for name in create_event_partitions(options["days"]):
+            self.stdout.write(f"Created {name}")
+        self.stdout.write(self.style.SUCCESS("Event partitions are up to date"))
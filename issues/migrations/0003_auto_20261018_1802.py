@@ -0,0 +1,29 @@
+# Generated by Django 3.0.5 on 2026-10-18 18:02
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('issues', '0002_auto_20200306_1546'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='issue',
+            name='count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Number of events'),
+        ),
+        migrations.AddField(
+            model_name='issue',
+            name='first_seen',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddField(
+            model_name='issue',
+            name='last_seen',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
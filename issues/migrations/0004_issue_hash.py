@@ -0,0 +1,55 @@
+# Generated by Django 3.0.5 on 2026-10-18 18:05
+
+import hashlib
+from django.db import migrations, models
+
+
+def generate_hash(title, culprit, type):
+    """ Copy of event_store.serializers.generate_hash at the time of writing """
+    fingerprint = [str(int(type)), title or "", culprit or ""]
+    return hashlib.md5("\n".join(fingerprint).encode()).hexdigest()
+
+
+def set_issue_hashes(apps, schema_editor):
+    Issue = apps.get_model("issues", "Issue")
+    seen = set()
+    batch = []
+    for issue in Issue.objects.order_by("pk").only(
+        "pk", "project_id", "title", "culprit", "type"
+    ).iterator():
+        issue.hash = generate_hash(issue.title, issue.culprit, issue.type)
+        if (issue.project_id, issue.hash) in seen:
+            # Null culprits allowed duplicates before, keep them apart
+            issue.hash = generate_hash(issue.title, f"{issue.culprit}{issue.pk}", issue.type)
+        seen.add((issue.project_id, issue.hash))
+        batch.append(issue)
+        if len(batch) >= 1000:
+            Issue.objects.bulk_update(batch, ["hash"])
+            batch = []
+    Issue.objects.bulk_update(batch, ["hash"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0002_auto_20200429_1721'),
+        ('issues', '0003_auto_20261018_1802'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='issue',
+            name='hash',
+            field=models.CharField(help_text='Grouping fingerprint of type, title and culprit', max_length=32, null=True),
+        ),
+        migrations.RunPython(set_issue_hashes, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='issue',
+            name='hash',
+            field=models.CharField(help_text='Grouping fingerprint of type, title and culprit', max_length=32),
+        ),
+        migrations.AlterUniqueTogether(
+            name='issue',
+            unique_together={('project', 'hash')},
+        ),
+    ]
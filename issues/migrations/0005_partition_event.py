@@ -0,0 +1,86 @@
+"""
+Range partition the event table by day on created.
+
+The existing table is kept as issues_event_legacy, a partition for everything
+before today. Its primary key is rebuilt and attaching it scans the table, on
+large installs run this migration in a maintenance window.
+
+Postgres requires the partition key in the primary key, so the database
+primary key becomes (event_id, created). Django still treats event_id as the
+primary key.
+"""
+from django.db import migrations
+
+
+PARTITION_SQL = """
+ALTER TABLE issues_event RENAME TO issues_event_legacy;
+ALTER TABLE issues_event_legacy DROP CONSTRAINT issues_event_pkey,
+    ADD CONSTRAINT issues_event_legacy_pkey PRIMARY KEY (event_id, created);
+ALTER TABLE issues_event_legacy RENAME CONSTRAINT issues_event_issue_id_c662b365_fk_issues_issue_id TO issues_event_legacy_issue_id_fk;
+ALTER INDEX issues_event_created_0bbf6f0e RENAME TO issues_event_legacy_created;
+ALTER INDEX issues_event_issue_id_c662b365 RENAME TO issues_event_legacy_issue_id;
+
+CREATE TABLE issues_event (
+    event_id uuid NOT NULL,
+    timestamp timestamp with time zone NULL,
+    created timestamp with time zone NOT NULL,
+    data jsonb NOT NULL,
+    issue_id integer NOT NULL,
+    CONSTRAINT issues_event_pkey PRIMARY KEY (event_id, created)
+) PARTITION BY RANGE (created);
+CREATE INDEX issues_event_created_0bbf6f0e ON issues_event (created);
+CREATE INDEX issues_event_issue_id_c662b365 ON issues_event (issue_id);
+ALTER TABLE issues_event ADD CONSTRAINT issues_event_issue_id_c662b365_fk_issues_issue_id
+    FOREIGN KEY (issue_id) REFERENCES issues_issue (id) DEFERRABLE INITIALLY DEFERRED;
+
+CREATE TABLE issues_event_default PARTITION OF issues_event DEFAULT;
+
+DO $$
+DECLARE
+    cutoff timestamp with time zone := date_trunc('day', now() AT TIME ZONE 'UTC') AT TIME ZONE 'UTC';
+    day timestamp with time zone;
+BEGIN
+    -- Partitions for the next week, later ones come from the beat task
+    FOR i IN 0..7 LOOP
+        day := cutoff + make_interval(days => i);
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF issues_event FOR VALUES FROM (%L) TO (%L)',
+            'issues_event_p' || to_char(day AT TIME ZONE 'UTC', 'YYYYMMDD'),
+            day,
+            day + interval '1 day'
+        );
+    END LOOP;
+    -- Events from today onward move to the new partitions
+    INSERT INTO issues_event (event_id, timestamp, created, data, issue_id)
+        SELECT event_id, timestamp, created, data, issue_id
+        FROM issues_event_legacy WHERE created >= cutoff;
+    DELETE FROM issues_event_legacy WHERE created >= cutoff;
+    EXECUTE format(
+        'ALTER TABLE issues_event ATTACH PARTITION issues_event_legacy FOR VALUES FROM (MINVALUE) TO (%L)',
+        cutoff
+    );
+END $$;
+"""
+
+UNPARTITION_SQL = """
+CREATE TABLE issues_event_plain (LIKE issues_event);
+INSERT INTO issues_event_plain SELECT * FROM issues_event;
+DROP TABLE issues_event;
+ALTER TABLE issues_event_plain RENAME TO issues_event;
+ALTER TABLE issues_event ADD CONSTRAINT issues_event_pkey PRIMARY KEY (event_id);
+CREATE INDEX issues_event_created_0bbf6f0e ON issues_event (created);
+CREATE INDEX issues_event_issue_id_c662b365 ON issues_event (issue_id);
+ALTER TABLE issues_event ADD CONSTRAINT issues_event_issue_id_c662b365_fk_issues_issue_id
+    FOREIGN KEY (issue_id) REFERENCES issues_issue (id) DEFERRABLE INITIALLY DEFERRED;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("issues", "0004_issue_hash"),
+    ]
+
+    operations = [
+        migrations.RunSQL(PARTITION_SQL, UNPARTITION_SQL),
+    ]
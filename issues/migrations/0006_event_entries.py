@@ -0,0 +1,19 @@
+# Generated by Django 3.0.5 on 2026-10-18 18:24
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('issues', '0005_partition_event'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='entries',
+            field=django.contrib.postgres.fields.jsonb.JSONField(blank=True, editable=False, help_text='Entries formatted for the API, saved on first read', null=True),
+        ),
+    ]
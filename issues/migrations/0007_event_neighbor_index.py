@@ -0,0 +1,35 @@
+# Generated by Django 3.0.5 on 2026-10-18 18:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('issues', '0006_event_entries'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['issue', 'created', 'event_id'], name='issues_even_issue_i_6ab090_idx'),
+        ),
+        # Only drop the issue_id index, altering the field would also rebuild
+        # and validate the foreign key on the whole event table
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    'DROP INDEX issues_event_issue_id_c662b365',
+                    'CREATE INDEX issues_event_issue_id_c662b365 ON issues_event (issue_id)',
+                ),
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name='event',
+                    name='issue',
+                    field=models.ForeignKey(db_index=False, help_text='Sentry calls this a group', on_delete=django.db.models.deletion.CASCADE, to='issues.Issue'),
+                ),
+            ],
+        ),
+    ]
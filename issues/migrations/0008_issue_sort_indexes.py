@@ -0,0 +1,25 @@
+# Generated by Django 3.0.5 on 2026-10-18 18:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('issues', '0007_event_neighbor_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='issue',
+            index=models.Index(fields=['project', 'status', 'last_seen', 'id'], name='issues_issu_project_91b77d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='issue',
+            index=models.Index(fields=['project', 'status', 'first_seen', 'id'], name='issues_issu_project_347463_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='issue',
+            index=models.Index(fields=['project', 'status', 'count', 'id'], name='issues_issu_project_798650_idx'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 3.0.5 on 2026-10-18 18:33
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+UPDATE_SEARCH_VECTOR = """
+CREATE FUNCTION issues_issue_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := to_tsvector(
+        'simple', coalesce(NEW.title, '') || ' ' || coalesce(NEW.culprit, '')
+    );
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER issues_issue_search_vector_update
+    BEFORE INSERT OR UPDATE OF title, culprit ON issues_issue
+    FOR EACH ROW EXECUTE FUNCTION issues_issue_search_vector_update();
+
+UPDATE issues_issue SET search_vector = to_tsvector(
+    'simple', coalesce(title, '') || ' ' || coalesce(culprit, '')
+);
+"""
+
+DROP_SEARCH_VECTOR_UPDATE = """
+DROP TRIGGER issues_issue_search_vector_update ON issues_issue;
+DROP FUNCTION issues_issue_search_vector_update();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('issues', '0008_issue_sort_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='issue',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunSQL(UPDATE_SEARCH_VECTOR, DROP_SEARCH_VECTOR_UPDATE),
+        migrations.AddIndex(
+            model_name='issue',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='issues_issu_search__5d5ff3_gin'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 3.0.5 on 2026-10-18 18:36
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('issues', '0009_issue_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='tags',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.PositiveIntegerField(), blank=True, default=list, help_text='EventTag ids', size=None),
+        ),
+        migrations.AlterUniqueTogether(
+            name='eventtag',
+            unique_together={('key', 'value')},
+        ),
+        migrations.CreateModel(
+            name='IssueTag',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('issue', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='issues.Issue')),
+                ('tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='issues.EventTag')),
+            ],
+            options={
+                'unique_together': {('issue', 'tag')},
+            },
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 3.0.5 on 2026-10-18 18:39
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0003_project_event_retention_days'),
+        ('issues', '0010_event_tags'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProjectStat',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('interval', models.PositiveSmallIntegerField(choices=[(0, 'hour'), (1, 'day')])),
+                ('start', models.DateTimeField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='projects.Project')),
+            ],
+            options={
+                'unique_together': {('project', 'interval', 'start')},
+            },
+        ),
+        migrations.CreateModel(
+            name='IssueStat',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('interval', models.PositiveSmallIntegerField(choices=[(0, 'hour'), (1, 'day')])),
+                ('start', models.DateTimeField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('issue', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='issues.Issue')),
+            ],
+            options={
+                'unique_together': {('issue', 'interval', 'start')},
+            },
+        ),
+    ]
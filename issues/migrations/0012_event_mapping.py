@@ -0,0 +1,29 @@
+# Generated by Django 3.0.5 on 2026-10-18 19:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Existing events, the newest copy of a duplicated event id wins
+BACKFILL_EVENT_MAPPING = """
+INSERT INTO issues_eventmapping (event_id, issue_id, created)
+SELECT DISTINCT ON (event_id) event_id, issue_id, created
+FROM issues_event ORDER BY event_id, created DESC;
+"""
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('issues', '0011_issue_project_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventMapping',
+            fields=[
+                ('event_id', models.UUIDField(primary_key=True, serialize=False)),
+                ('created', models.DateTimeField(db_index=True)),
+                ('issue', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='issues.Issue')),
+            ],
+        ),
+        migrations.RunSQL(BACKFILL_EVENT_MAPPING, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.0.5 on 2026-10-18 19:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('issues', '0012_event_mapping'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='issuestat',
+            index=models.Index(fields=['start'], name='issues_issu_start_cca473_idx'),
+        ),
+    ]
@@ -1,6 +1,24 @@
 import uuid
-from django.contrib.postgres.fields import JSONField
-from django.db import models
+from uuid import UUID
+from functools import reduce
+from operator import or_
+from django.contrib.postgres.fields import ArrayField, JSONField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.conf import settings
+from django.db import connection, models
+from django.db.models import F, Q, Case, When, Value
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from glitchtip.cache import LRUCache
+
+# Ingest maps (project id, issue hash) to issue ids for the hottest issues.
+# Each worker has its own cache, ingest retries without it if an issue is gone.
+grouping_cache = LRUCache(maxsize=settings.GROUPING_CACHE_SIZE, ttl=300)
+# Tag id to (key, value), tags never change once created
+event_tag_cache = LRUCache(maxsize=10000, ttl=3600)
 
 
 class EventType(models.IntegerChoices):
@@ -38,16 +56,26 @@ class Issue(models.Model):
 
     # annotations Not implemented
     # assigned_to Not implemented
+    count = models.PositiveIntegerField(
+        default=0, editable=False, help_text="Number of events"
+    )
     created = models.DateTimeField(auto_now_add=True, db_index=True)
     culprit = models.CharField(max_length=1024, blank=True, null=True)
+    first_seen = models.DateTimeField(default=timezone.now, editable=False)
     has_seen = models.BooleanField(default=False)
+    hash = models.CharField(
+        max_length=32, help_text="Grouping fingerprint of type, title and culprit"
+    )
     # is_bookmarked Not implement - is per user
     is_public = models.BooleanField(default=False)
+    last_seen = models.DateTimeField(default=timezone.now, editable=False)
     level = models.PositiveSmallIntegerField(
         choices=LogLevel.choices, default=LogLevel.NOTSET
     )
     metadata = JSONField()
     project = models.ForeignKey("projects.Project", on_delete=models.CASCADE)
+    # Title and culprit words, a database trigger keeps it up to date
+    search_vector = SearchVectorField(null=True, editable=False)
     title = models.CharField(max_length=255)
     type = models.PositiveSmallIntegerField(
         choices=EventType.choices, default=EventType.DEFAULT
@@ -57,7 +85,14 @@ class Issue(models.Model):
     )
 
     class Meta:
-        unique_together = ("title", "culprit", "project", "type")
+        unique_together = ("project", "hash")
+        # Issue list sorts, see IssueViewSet.sort_fields
+        indexes = [
+            models.Index(fields=["project", "status", "last_seen", "id"]),
+            models.Index(fields=["project", "status", "first_seen", "id"]),
+            models.Index(fields=["project", "status", "count", "id"]),
+            GinIndex(fields=["search_vector"]),
+        ]
 
     def event(self):
         return self.event_set.first()
@@ -65,20 +100,273 @@ class Issue(models.Model):
     def __str__(self):
         return self.title
 
-    def check_for_status_update(self):
+    @classmethod
+    def increment_event_counts(cls, counts):
+        """
+        Add new events to issue counters with a single UPDATE.
+        counts is a dict of issue id to (number of new events, latest event date)
+        F() expressions keep concurrent ingest from losing increments.
+        """
+        if not counts:
+            return
+        cls.objects.filter(pk__in=counts.keys()).update(
+            count=F("count")
+            + Case(
+                *[When(pk=pk, then=Value(count)) for pk, (count, _) in counts.items()],
+                output_field=models.PositiveIntegerField(),
+            ),
+            last_seen=Greatest(
+                "last_seen",
+                Case(
+                    *[
+                        When(pk=pk, then=Value(last_seen))
+                        for pk, (_, last_seen) in counts.items()
+                    ],
+                    output_field=models.DateTimeField(),
+                ),
+            ),
+        )
+
+    @classmethod
+    def decrement_event_counts(cls, counts):
+        """
+        Remove deleted events from issue counters
+        counts is a dict of issue id to number of deleted events
+        """
+        subtract_counts(cls, ("id",), {(pk,): count for pk, count in counts.items()})
+
+    @classmethod
+    def regress_resolved(cls, issue_ids):
         """
-        Determine if issue should regress back to unresolved
-        Typically run when processing a new event related to the issue
+        Resolved issues with new events become unresolved again.
+        Runs on ingest even when counters are buffered, so a flush doesn't
+        reopen issues resolved after their events.
         """
-        if self.status == EventStatus.RESOLVED:
-            self.status = EventStatus.UNRESOLVED
-            self.save()
+        cls.objects.filter(pk__in=issue_ids, status=EventStatus.RESOLVED).update(
+            status=EventStatus.UNRESOLVED
+        )
 
 
 class EventTag(models.Model):
+    """ A distinct tag key and value, events refer to tags by id """
+
     key = models.CharField(max_length=255)
     value = models.CharField(max_length=225)
 
+    class Meta:
+        unique_together = ("key", "value")
+
+    @classmethod
+    def get_ids(cls, pairs):
+        """
+        Returns a dict of (key, value) to tag id, creating missing tags
+        Takes one query, two when some tags are new
+        """
+        pairs = {tuple(pair) for pair in pairs}
+        if not pairs:
+            return {}
+
+        def get_existing(pairs):
+            lookups = [Q(key=key, value=value) for key, value in pairs]
+            return {
+                (key, value): pk
+                for pk, key, value in cls.objects.filter(
+                    reduce(or_, lookups)
+                ).values_list("pk", "key", "value")
+            }
+
+        ids = get_existing(pairs)
+        missing = pairs - ids.keys()
+        if missing:
+            cls.objects.bulk_create(
+                [cls(key=key, value=value) for key, value in sorted(missing)],
+                ignore_conflicts=True,
+            )
+            ids.update(get_existing(missing))
+        return ids
+
+    @classmethod
+    def get_pairs(cls, ids):
+        """ Returns a dict of tag id to (key, value) """
+        pairs = {}
+        missing = []
+        for pk in ids:
+            pair = event_tag_cache.get(pk)
+            if pair is None:
+                missing.append(pk)
+            else:
+                pairs[pk] = pair
+        if missing:
+            for pk, key, value in cls.objects.filter(pk__in=missing).values_list(
+                "pk", "key", "value"
+            ):
+                pairs[pk] = (key, value)
+                event_tag_cache.set(pk, (key, value))
+        return pairs
+
+
+class IssueTag(models.Model):
+    """ Number of events of an issue with a tag, answers the issue's tag facets """
+
+    issue = models.ForeignKey(Issue, on_delete=models.CASCADE)
+    tag = models.ForeignKey(EventTag, on_delete=models.CASCADE)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ("issue", "tag")
+
+    @classmethod
+    def increment_counts(cls, counts):
+        """
+        Add to the tag counts of issues with a single upsert.
+        counts is a dict of (issue id, tag id) to number of new events
+        """
+        upsert_counts(cls, ("issue_id", "tag_id"), counts)
+
+    @classmethod
+    def decrement_counts(cls, counts):
+        """
+        Remove deleted events from the tag counts of issues, tags no event of
+        the issue has anymore are removed
+        counts is a dict of (issue id, tag id) to number of deleted events
+        """
+        subtract_counts(cls, ("issue_id", "tag_id"), counts)
+        cls.objects.filter(
+            issue_id__in={issue_id for issue_id, _ in counts}, count=0
+        ).delete()
+
+
+class StatInterval(models.IntegerChoices):
+    HOUR = 0, "hour"
+    DAY = 1, "day"
+
+
+class IssueStat(models.Model):
+    """ Number of events of an issue per hour and per day, for sparklines """
+
+    issue = models.ForeignKey(Issue, on_delete=models.CASCADE)
+    interval = models.PositiveSmallIntegerField(choices=StatInterval.choices)
+    start = models.DateTimeField()
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ("issue", "interval", "start")
+        # Project rollups are summed up from recent rows
+        indexes = [models.Index(fields=["start"])]
+
+    @classmethod
+    def increment_counts(cls, counts):
+        """ counts maps (issue id, interval, start) to number of new events """
+        upsert_counts(cls, ("issue_id", "interval", "start"), counts)
+
+
+class ProjectStat(models.Model):
+    """ Number of events of a project per hour and per day """
+
+    project = models.ForeignKey("projects.Project", on_delete=models.CASCADE)
+    interval = models.PositiveSmallIntegerField(choices=StatInterval.choices)
+    start = models.DateTimeField()
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ("project", "interval", "start")
+
+    @classmethod
+    def increment_counts(cls, counts):
+        """ counts maps (project id, interval, start) to number of new events """
+        upsert_counts(cls, ("project_id", "interval", "start"), counts)
+
+
+def upsert_counts(model, columns, counts):
+    """
+    Add counts to rows of model with a single INSERT .. ON CONFLICT statement
+    counts is a dict of a tuple of the unique columns' values to a count.
+    Rows are written in key order so concurrent batches can't deadlock.
+    """
+    if not counts:
+        return
+    rows = sorted(counts.items())
+    table = model._meta.db_table
+    row_sql = "({})".format(", ".join(["%s"] * (len(columns) + 1)))
+    params = [param for key, count in rows for param in (*key, count)]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO {table} ({", ".join(columns)}, count)
+            VALUES {", ".join([row_sql] * len(rows))}
+            ON CONFLICT ({", ".join(columns)})
+            DO UPDATE SET count = {table}.count + EXCLUDED.count
+            """,
+            params,
+        )
+
+
+def subtract_counts(model, columns, counts):
+    """
+    Subtract counts from existing rows of model with a single UPDATE, counts
+    don't go below 0. counts is a dict of a tuple of the columns' values to a
+    count.
+    """
+    if not counts:
+        return
+    rows = sorted(counts.items())
+    table = model._meta.db_table
+    row_sql = "({})".format(", ".join(["%s"] * (len(columns) + 1)))
+    params = [param for key, count in rows for param in (*key, count)]
+    match_sql = " AND ".join(
+        f"{table}.{column} = deleted.{column}" for column in columns
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            UPDATE {table} SET count = GREATEST({table}.count - deleted.count, 0)
+            FROM (VALUES {", ".join([row_sql] * len(rows))})
+            AS deleted ({", ".join(columns)}, count)
+            WHERE {match_sql}
+            """,
+            params,
+        )
+
+
+class EventMapping(models.Model):
+    """
+    Every stored event id. The partitioned event table can't enforce unique
+    event ids, its primary key includes created. Ingest adds ids here in the
+    transaction that saves the events and skips events whose id already exists.
+    """
+
+    event_id = models.UUIDField(primary_key=True)
+    issue = models.ForeignKey(Issue, on_delete=models.CASCADE)
+    created = models.DateTimeField(db_index=True)
+
+    @classmethod
+    def add_new(cls, rows):
+        """
+        Insert (event id, issue id) rows, skipping event ids that already exist.
+        Returns the set of event ids inserted. A concurrent insert of the same id
+        waits for the other transaction to finish.
+        """
+        rows = sorted(
+            {UUID(str(event_id)): issue_id for event_id, issue_id in rows}.items()
+        )
+        if not rows:
+            return set()
+        now = timezone.now()
+        params = [
+            param for event_id, issue_id in rows for param in (event_id, issue_id, now)
+        ]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {cls._meta.db_table} (event_id, issue_id, created)
+                VALUES {", ".join(["(%s, %s, %s)"] * len(rows))}
+                ON CONFLICT (event_id) DO NOTHING
+                RETURNING event_id
+                """,
+                params,
+            )
+            return {UUID(str(row[0])) for row in cursor.fetchall()}
+
 
 class Event(models.Model):
     """
@@ -89,7 +377,10 @@ class Event(models.Model):
 
     event_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     issue = models.ForeignKey(
-        Issue, on_delete=models.CASCADE, help_text="Sentry calls this a group"
+        Issue,
+        on_delete=models.CASCADE,
+        db_index=False,  # Covered by the (issue, created, event_id) index
+        help_text="Sentry calls this a group",
     )
     timestamp = models.DateTimeField(
         blank=True,
@@ -99,9 +390,22 @@ class Event(models.Model):
 
     created = models.DateTimeField(auto_now_add=True, db_index=True)
     data = JSONField()
+    entries = JSONField(
+        blank=True,
+        null=True,
+        editable=False,
+        help_text="Entries formatted for the API, saved on first read",
+    )
+    tags = ArrayField(
+        models.PositiveIntegerField(),
+        default=list,
+        blank=True,
+        help_text="EventTag ids",
+    )
 
     class Meta:
         ordering = ["-created"]
+        indexes = [models.Index(fields=["issue", "created", "event_id"])]
 
     def __str__(self):
         return self.event_id_hex
@@ -122,40 +426,40 @@ class Event(models.Model):
     def culprit(self):
         return self.data.get("culprit")
 
-    @property
-    def entries(self):
+    def get_entries(self):
+        """ API formatted entries, built from data on first read and saved """
+        if self.entries is None:
+            self.entries = self.build_entries()
+            # created lets postgres skip the other event partitions
+            Event.objects.filter(pk=self.pk, created=self.created).update(
+                entries=self.entries
+            )
+        return self.entries
+
+    def build_entries(self):
+        """ Format data as API entries without modifying it """
         entries = []
 
         exception = self.data.get("exception")
         if exception and exception.get("values"):
-            # Some, but not all, keys are made more JS camel case like
+            values = []
             for value in exception["values"]:
-                if "stacktrace" in value and "frames" in value["stacktrace"]:
-                    for frame in value["stacktrace"]["frames"]:
-                        if "abs_path" in frame:
-                            frame["absPath"] = frame.pop("abs_path")
-                        if "lineno" in frame:
-                            frame["lineNo"] = frame.pop("lineno")
-                            base_line_no = frame["lineNo"]
-                            context = []
-                            pre_context = frame.pop("pre_context", None)
-                            if pre_context:
-                                context += self._build_context(
-                                    pre_context, base_line_no, True
-                                )
-                            context.append([base_line_no, frame.get("context_line")])
-                            post_context = frame.pop("post_context", None)
-                            if post_context:
-                                context += self._build_context(
-                                    post_context, base_line_no, False
-                                )
-                            frame["context"] = context
-
-            entries.append({"type": "exception", "data": exception})
+                stacktrace = value.get("stacktrace")
+                if stacktrace and "frames" in stacktrace:
+                    frames = [
+                        self._build_frame(frame) for frame in stacktrace["frames"]
+                    ]
+                    value = {**value, "stacktrace": {**stacktrace, "frames": frames}}
+                values.append(value)
+            entries.append(
+                {"type": "exception", "data": {**exception, "values": values}}
+            )
 
         request = self.data.get("request")
         if request:
-            request["inferredContentType"] = request.pop("inferred_content_type")
+            request = dict(request)
+            if "inferred_content_type" in request:
+                request["inferredContentType"] = request.pop("inferred_content_type")
             entries.append({"type": "request", "data": request})
 
         breadcrumbs = self.data.get("breadcrumbs")
@@ -172,6 +476,25 @@ class Event(models.Model):
 
         return entries
 
+    def _build_frame(self, frame: dict):
+        # Some, but not all, keys are made more JS camel case like
+        frame = dict(frame)
+        if "abs_path" in frame:
+            frame["absPath"] = frame.pop("abs_path")
+        if "lineno" in frame:
+            frame["lineNo"] = frame.pop("lineno")
+            base_line_no = frame["lineNo"]
+            context = []
+            pre_context = frame.pop("pre_context", None)
+            if pre_context:
+                context += self._build_context(pre_context, base_line_no, True)
+            context.append([base_line_no, frame.get("context_line")])
+            post_context = frame.pop("post_context", None)
+            if post_context:
+                context += self._build_context(post_context, base_line_no, False)
+            frame["context"] = context
+        return frame
+
     def _build_context(self, context: list, base_line_no: int, is_pre: bool):
         context_length = len(context)
         result = []
@@ -209,15 +532,37 @@ class Event(models.Model):
     def type(self):
         return self.data.get("type")
 
-    def next(self, *args, **kwargs):
-        try:
-            return self.get_next_by_created(**kwargs)
-        except Event.DoesNotExist:
-            return None
-
-    def previous(self, *args, **kwargs):
-        """ Get previous object by created date, pass filter kwargs """
-        try:
-            return self.get_previous_by_created(**kwargs)
-        except Event.DoesNotExist:
-            return None
+    def get_neighbor_ids(self, **kwargs):
+        """
+        Get previous and next event ids by created date, pass filter kwargs
+        Both come from one query of two index seeks
+        """
+        events = Event.objects.filter(**kwargs)
+        previous_event = (
+            events.filter(
+                Q(created__lt=self.created) | Q(pk__lt=self.pk),
+                created__lte=self.created,
+            )
+            .order_by("-created", "-pk")
+            .annotate(is_next=Value(False, output_field=models.BooleanField()))
+            .values_list("pk", "is_next")[:1]
+        )
+        next_event = (
+            events.filter(
+                Q(created__gt=self.created) | Q(pk__gt=self.pk),
+                created__gte=self.created,
+            )
+            .order_by("created", "pk")
+            .annotate(is_next=Value(True, output_field=models.BooleanField()))
+            .values_list("pk", "is_next")[:1]
+        )
+        neighbors = {
+            is_next: pk.hex
+            for pk, is_next in previous_event.union(next_event, all=True)
+        }
+        return neighbors.get(False), neighbors.get(True)
+
+
+@receiver(post_delete, sender=Issue)
+def issue_deleted(sender, instance, **kwargs):
+    grouping_cache.delete((instance.project_id, instance.hash))
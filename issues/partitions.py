@@ -0,0 +1,70 @@
+"""
+The event table is range partitioned by day on created (Postgres declarative
+partitioning). Queries filtered on created only scan matching partitions and
+old events can be dropped a whole day at a time.
+
+Events older than the partitioning migration live in issues_event_legacy.
+Events without a daily partition land in issues_event_default, so partitions
+should be created ahead of time with create_event_partitions.
+"""
+import logging
+from datetime import datetime, time, timedelta
+from django.db import connection, transaction, DatabaseError
+from django.utils import timezone
+
+PARTITION_PREFIX = "issues_event_p"
+logger = logging.getLogger(__name__)
+
+
+def partition_name(day):
+    return f"{PARTITION_PREFIX}{day:%Y%m%d}"
+
+
+def day_start(day):
+    return timezone.make_aware(datetime.combine(day, time()), timezone.utc)
+
+
+def get_event_partitions():
+    """ Returns a dict of day to table name of the daily event partitions """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT child.relname FROM pg_inherits
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE pg_inherits.inhparent = 'issues_event'::regclass
+            """
+        )
+        names = [row[0] for row in cursor.fetchall()]
+    return {
+        datetime.strptime(name[len(PARTITION_PREFIX) :], "%Y%m%d").date(): name
+        for name in names
+        if name.startswith(PARTITION_PREFIX)
+    }
+
+
+def create_event_partitions(days_ahead=7):
+    """
+    Make sure daily partitions exist from today through days_ahead days.
+    Returns names of the created partitions.
+    """
+    today = timezone.now().date()
+    existing = get_event_partitions()
+    created = []
+    for offset in range(days_ahead + 1):
+        day = today + timedelta(days=offset)
+        if day in existing:
+            continue
+        name = partition_name(day)
+        try:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(
+                    f"CREATE TABLE {name} PARTITION OF issues_event "
+                    "FOR VALUES FROM (%s) TO (%s)",
+                    [day_start(day), day_start(day + timedelta(days=1))],
+                )
+        except DatabaseError:
+            # Usually events for this day already landed in the default partition
+            logger.warning("Unable to create event partition %s", name, exc_info=True)
+            continue
+        created.append(name)
+    return created
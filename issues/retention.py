@@ -0,0 +1,221 @@
+"""
+Event retention. Daily event partitions are dropped once no project keeps
+events that old. Remaining expired events are deleted in small batches so that
+no single statement locks or bloats the table for long. Every batch commits on
+its own, an interrupted run continues where it stopped on the next run.
+
+Issue and tag counts are lowered by the events removed with them. Stat rollups
+are deleted once their hour or day is past retention.
+"""
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from projects.models import Project
+from .models import (
+    Event,
+    EventMapping,
+    Issue,
+    IssueStat,
+    IssueTag,
+    ProjectStat,
+    StatInterval,
+)
+from .partitions import day_start, get_event_partitions
+from .stats import HOURLY_STATS_RETENTION
+
+# Expired partitions are renamed to this prefix until their counts are subtracted
+DETACHED_PREFIX = "issues_event_expired_"
+
+
+def get_retention_groups():
+    """
+    Returns a dict of retention days to ids of the projects using it
+    Projects without any retention setting keep events forever, they are
+    under the None key.
+    """
+    groups = {}
+    projects = Project.objects.values_list(
+        "pk", "event_retention_days", "organization__event_retention_days"
+    )
+    for pk, project_days, organization_days in projects:
+        days = project_days or organization_days or settings.EVENT_RETENTION_DAYS
+        groups.setdefault(days or None, []).append(pk)
+    return groups
+
+
+def subtract_event_counts(issue_counts, tag_counts):
+    """
+    Lower issue and tag counts by deleted events
+    Takes dicts of issue id and of (issue id, tag id) to number of events
+    """
+    Issue.decrement_event_counts(issue_counts)
+    IssueTag.decrement_counts(tag_counts)
+
+
+def get_detached_partitions():
+    """ Names of partitions detached by drop_expired_partitions but not dropped """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT relname FROM pg_class "
+            "WHERE relkind = 'r' AND starts_with(relname::text, %s)",
+            [DETACHED_PREFIX],
+        )
+        return sorted(row[0] for row in cursor.fetchall())
+
+
+def drop_detached_partition(name):
+    """
+    Subtract the events of a detached partition from issue and tag counts and
+    drop it in one transaction, so the counts are subtracted exactly once.
+    Nothing else uses the table anymore, ingest and reads aren't blocked.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"SELECT issue_id, count(*) FROM {name} GROUP BY issue_id")
+        issue_counts = dict(cursor.fetchall())
+        cursor.execute(
+            f"""
+            SELECT issue_id, tag_id, count(*)
+            FROM {name}, unnest(tags) AS tag_id
+            GROUP BY issue_id, tag_id
+            """
+        )
+        tag_counts = {
+            (issue_id, tag_id): count for issue_id, tag_id, count in cursor.fetchall()
+        }
+        subtract_event_counts(issue_counts, tag_counts)
+        cursor.execute(f"DROP TABLE {name}")
+
+
+def drop_expired_partitions(cutoff):
+    """
+    Drop daily partitions that only hold events older than cutoff
+    Partitions are detached and renamed first, which locks the event table only
+    briefly. Detached partitions left by an interrupted run are dropped too.
+    """
+    dropped = []
+    for day, name in sorted(get_event_partitions().items()):
+        if day_start(day + timedelta(days=1)) > cutoff:
+            continue
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f"ALTER TABLE issues_event DETACH PARTITION {name}")
+            cursor.execute(
+                f"ALTER TABLE {name} RENAME TO {DETACHED_PREFIX}{day:%Y%m%d}"
+            )
+        dropped.append(name)
+    for name in get_detached_partitions():
+        drop_detached_partition(name)
+    return dropped
+
+
+def delete_expired_events(project_ids, cutoff, batch_size):
+    """ Delete events older than cutoff, yields the number deleted per batch """
+    expired = Event.objects.filter(issue__project__in=project_ids, created__lt=cutoff)
+    while True:
+        batch = list(
+            expired.order_by("created").values_list("pk", "issue_id", "tags")[
+                :batch_size
+            ]
+        )
+        if not batch:
+            return
+        issue_counts = {}
+        tag_counts = {}
+        for _, issue_id, tags in batch:
+            issue_counts[issue_id] = issue_counts.get(issue_id, 0) + 1
+            for tag_id in tags:
+                key = (issue_id, tag_id)
+                tag_counts[key] = tag_counts.get(key, 0) + 1
+        with transaction.atomic():
+            Event.objects.filter(
+                pk__in=[pk for pk, _, _ in batch], created__lt=cutoff
+            ).delete()
+            subtract_event_counts(issue_counts, tag_counts)
+        yield len(batch)
+
+
+def delete_expired_event_ids(project_ids, cutoff, batch_size):
+    """
+    Delete event ids older than cutoff from the event mapping, including those
+    of dropped partitions. Returns the number deleted.
+    """
+    expired = EventMapping.objects.filter(
+        issue__project__in=project_ids, created__lt=cutoff
+    )
+    deleted = 0
+    while True:
+        batch = list(expired.values_list("pk", flat=True)[:batch_size])
+        if not batch:
+            return deleted
+        deleted += EventMapping.objects.filter(pk__in=batch).delete()[0]
+
+
+def delete_expired_issues(project_ids, cutoff, batch_size):
+    """ Delete issues without events since cutoff, yields the number per batch """
+    expired = Issue.objects.filter(
+        ~Exists(Event.objects.filter(issue=OuterRef("pk"))),
+        project__in=project_ids,
+        last_seen__lt=cutoff,
+    )
+    while True:
+        batch = list(expired.values_list("pk", flat=True)[:batch_size])
+        if not batch:
+            return
+        Issue.objects.filter(pk__in=batch).delete()
+        yield len(batch)
+
+
+def delete_expired_stats():
+    """
+    Delete hourly stats past HOURLY_STATS_RETENTION
+    Returns the number of rows deleted.
+    """
+    hourly_cutoff = timezone.now() - HOURLY_STATS_RETENTION
+    deleted = 0
+    for model in (IssueStat, ProjectStat):
+        deleted += model.objects.filter(
+            interval=StatInterval.HOUR, start__lt=hourly_cutoff
+        ).delete()[0]
+    return deleted
+
+
+def delete_expired_daily_stats(project_ids, cutoff):
+    """ Delete daily stats of projects older than cutoff, returns the number """
+    expired = {"interval": StatInterval.DAY, "start__lt": cutoff}
+    return (
+        IssueStat.objects.filter(issue__project__in=project_ids, **expired).delete()[0]
+        + ProjectStat.objects.filter(project__in=project_ids, **expired).delete()[0]
+    )
+
+
+def apply_event_retention(batch_size=1000):
+    """
+    Remove events and issues past their retention, yields progress messages
+    Events and issues are only removed when EVENT_RETENTION_DAYS or their
+    organization or project sets a retention.
+    """
+    now = timezone.now()
+    groups = get_retention_groups()
+    kept_forever = groups.pop(None, [])
+    deleted_stats = delete_expired_stats()
+    if groups and not kept_forever:
+        # Partitions are shared, they only drop when every project expires them
+        longest = max(groups)
+        for name in drop_expired_partitions(now - timedelta(days=longest)):
+            yield f"Dropped partition {name}"
+
+    for days, project_ids in sorted(groups.items()):
+        cutoff = now - timedelta(days=days)
+        deleted = 0
+        for count in delete_expired_events(project_ids, cutoff, batch_size):
+            deleted += count
+            yield f"Deleted {deleted} events older than {days} days"
+        delete_expired_event_ids(project_ids, cutoff, batch_size)
+        deleted_stats += delete_expired_daily_stats(project_ids, cutoff)
+        deleted = 0
+        for count in delete_expired_issues(project_ids, cutoff, batch_size):
+            deleted += count
+            yield f"Deleted {deleted} issues without events in {days} days"
+    if deleted_stats:
+        yield f"Deleted {deleted_stats} expired event stats"
@@ -0,0 +1,118 @@
+"""
+Issue search queries such as `is:unresolved level:error lastSeen:-24h TypeError`
+
+Terms are compiled to ORM filters, prefix a term with ! to exclude matches.
+Unknown terms are ignored. Anything else is free text, matched as word prefixes
+against the issue's title and culprit through the search_vector GIN index.
+"""
+import re
+import shlex
+from datetime import datetime, time, timedelta
+from django.contrib.postgres.search import SearchQuery
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ParseError
+from .models import EventStatus, EventType, LogLevel
+
+TERM_RE = re.compile(r"^(!?)([a-zA-Z][\w-]*):(.+)$")
+RELATIVE_RE = re.compile(r"^([+-])(\d+)([mhdw])$")
+COMPARISON_RE = re.compile(r"^(>=|<=|>|<)?(.+)$")
+UNITS = {"m": "minutes", "h": "hours", "d": "days", "w": "weeks"}
+LOOKUPS = {">": "gt", ">=": "gte", "<": "lt", "<=": "lte"}
+
+
+def choice_filter(field: str, choices):
+    def compile_term(key: str, value: str):
+        for choice in choices:
+            if choice.label == value.lower():
+                return Q(**{field: choice})
+        raise ParseError(f"Invalid value for {key}: {value}")
+
+    return compile_term
+
+
+def date_filter(field: str):
+    """
+    -24h is within the last 24 hours, +24h is longer ago. Units are m, h, d, w.
+    Dates and datetimes compare with >, >=, < or <=, a bare date matches its day.
+    """
+
+    def compile_term(key: str, value: str):
+        relative = RELATIVE_RE.match(value)
+        if relative:
+            sign, amount, unit = relative.groups()
+            since = timezone.now() - timedelta(**{UNITS[unit]: int(amount)})
+            return Q(**{f"{field}__{'gte' if sign == '-' else 'lt'}": since})
+
+        operator, value = COMPARISON_RE.match(value).groups()
+        try:
+            # Both raise ValueError for well formed but impossible dates
+            date = parse_date(value)
+            moment = None if date else parse_datetime(value)
+        except ValueError:
+            raise ParseError(f"Invalid value for {key}: {value}")
+        if date:
+            start = timezone.make_aware(datetime.combine(date, time()), timezone.utc)
+            if not operator:
+                return Q(
+                    **{
+                        f"{field}__gte": start,
+                        f"{field}__lt": start + timedelta(days=1),
+                    }
+                )
+            if operator in (">", "<="):
+                start += timedelta(days=1)
+                operator = ">=" if operator == ">" else "<"
+            return Q(**{f"{field}__{LOOKUPS[operator]}": start})
+        if moment is None:
+            raise ParseError(f"Invalid value for {key}: {value}")
+        if timezone.is_naive(moment):
+            moment = timezone.make_aware(moment, timezone.utc)
+        return Q(**{f"{field}__{LOOKUPS[operator or '>=']}": moment})
+
+    return compile_term
+
+
+TERMS = {
+    "is": choice_filter("status", EventStatus),
+    "level": choice_filter("level", LogLevel),
+    "type": choice_filter("type", EventType),
+    "firstSeen": date_filter("first_seen"),
+    "first-seen": date_filter("first_seen"),
+    "age": date_filter("first_seen"),
+    "lastSeen": date_filter("last_seen"),
+    "last-seen": date_filter("last_seen"),
+}
+
+
+def text_filter(words):
+    """ Every word must prefix a word of the title or culprit """
+    lexemes = " & ".join(
+        "'{}':*".format(word.replace("\\", "\\\\").replace("'", "''")) for word in words
+    )
+    return Q(search_vector=SearchQuery(lexemes, config="simple", search_type="raw"))
+
+
+def parse_search_query(query: str) -> Q:
+    """ Compile a search query to a Q object of issue filters """
+    try:
+        tokens = shlex.split(query)
+    except ValueError:  # Unbalanced quotes
+        tokens = query.split()
+
+    filters = Q()
+    words = []
+    for token in tokens:
+        term = TERM_RE.match(token)
+        if term:
+            negate, key, value = term.groups()
+            if key in TERMS:
+                term_filter = TERMS[key](key, value)
+                filters &= ~term_filter if negate else term_filter
+            continue
+        if re.search(r"\w", token):
+            words.append(token)
+    if words:
+        filters &= text_filter(words)
+    return filters
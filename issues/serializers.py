@@ -1,6 +1,7 @@
 from rest_framework import serializers
 from projects.serializers.base_serializers import ProjectReferenceSerializer
-from .models import Issue, Event
+from .models import Issue, Event, EventTag
+from .stats import STATS_PERIODS, get_issue_stats
 
 
 class EventSerializer(serializers.ModelSerializer):
@@ -8,7 +9,8 @@ class EventSerializer(serializers.ModelSerializer):
     id = serializers.CharField(source="event_id_hex")
     dateCreated = serializers.DateTimeField(source="timestamp")
     dateReceived = serializers.DateTimeField(source="created")
-    tags = serializers.ListField(default=[])
+    tags = serializers.SerializerMethodField()
+    entries = serializers.SerializerMethodField()
 
     class Meta:
         model = Event
@@ -35,6 +37,26 @@ class EventSerializer(serializers.ModelSerializer):
             # "user",
         )
 
+    def get_entries(self, obj):
+        """ Lists don't save entries, that would write every event of the page """
+        if obj.entries is not None:
+            return obj.entries
+        return obj.build_entries()
+
+    def get_tags(self, obj):
+        """ Listing events reads the tags of all of them with the first one """
+        if obj.pk not in getattr(self, "_tag_events", set()):
+            events = self.parent.instance if self.parent else [obj]
+            self._tag_events = {event.pk for event in events} | {obj.pk}
+            self._tag_pairs = EventTag.get_pairs(
+                {pk for event in events for pk in event.tags} | set(obj.tags)
+            )
+        pairs = self._tag_pairs
+        return [
+            {"key": key, "value": value}
+            for key, value in (pairs[pk] for pk in obj.tags if pk in pairs)
+        ]
+
 
 class EventDetailSerializer(EventSerializer):
     nextEventID = serializers.SerializerMethodField()
@@ -43,35 +65,37 @@ class EventDetailSerializer(EventSerializer):
     class Meta(EventSerializer.Meta):
         fields = EventSerializer.Meta.fields + ("nextEventID", "previousEventID",)
 
-    def get_next_or_previous(self, obj, is_next):
-        kwargs = self.context["view"].kwargs
-        filter_kwargs = {}
-        if kwargs.get("issue_pk"):
-            filter_kwargs["issue"] = kwargs["issue_pk"]
-        if is_next:
-            result = obj.next(**filter_kwargs)
-        else:
-            result = obj.previous(**filter_kwargs)
-        if result:
-            return str(result)
+    def get_entries(self, obj):
+        return obj.get_entries()
+
+    def get_neighbor_ids(self, obj):
+        """ Previous and next event ids, fetched once per event """
+        if getattr(self, "_neighbors_of", None) != obj.pk:
+            kwargs = self.context["view"].kwargs
+            filter_kwargs = {}
+            if kwargs.get("issue_pk"):
+                filter_kwargs["issue"] = kwargs["issue_pk"]
+            self._neighbor_ids = obj.get_neighbor_ids(**filter_kwargs)
+            self._neighbors_of = obj.pk
+        return self._neighbor_ids
 
     def get_nextEventID(self, obj):
-        return self.get_next_or_previous(obj, True)
+        return self.get_neighbor_ids(obj)[1]
 
     def get_previousEventID(self, obj):
-        return self.get_next_or_previous(obj, False)
+        return self.get_neighbor_ids(obj)[0]
 
 
 class IssueSerializer(serializers.ModelSerializer):
     annotations = serializers.JSONField(default=list, read_only=True)
     assignedTo = serializers.CharField(default=None, read_only=True)
     count = serializers.IntegerField(read_only=True)
-    firstSeen = serializers.DateTimeField(read_only=True)
+    firstSeen = serializers.DateTimeField(source="first_seen", read_only=True)
     hasSeen = serializers.BooleanField(source="has_seen", read_only=True)
     isBookmarked = serializers.BooleanField(default=False, read_only=True)
     isPublic = serializers.BooleanField(source="is_public", read_only=True)
     isSubscribed = serializers.BooleanField(default=False, read_only=True)
-    lastSeen = serializers.DateTimeField(read_only=True)
+    lastSeen = serializers.DateTimeField(source="last_seen", read_only=True)
     level = serializers.CharField(source="get_level_display", read_only=True)
     logger = serializers.CharField(default=None, read_only=True)
     metadata = serializers.JSONField(default=dict, read_only=True)
@@ -80,7 +104,7 @@ class IssueSerializer(serializers.ModelSerializer):
     project = ProjectReferenceSerializer(read_only=True)
     shareId = serializers.IntegerField(default=None, read_only=True)
     shortId = serializers.CharField(default="Not implemented", read_only=True)
-    stats = serializers.JSONField(default=dict, read_only=True)
+    stats = serializers.SerializerMethodField()
     status = serializers.CharField(source="get_status_display")
     statusDetails = serializers.JSONField(default=dict, read_only=True)
     subscriptionDetails = serializers.CharField(default=None, read_only=True)
@@ -144,6 +168,21 @@ class IssueSerializer(serializers.ModelSerializer):
             "userCount",
         )
 
+    def get_stats(self, obj):
+        """
+        Event counts for ?statsPeriod=24h (default) or 14d.
+        Listing issues reads the stats of all of them with the first one.
+        """
+        request = self.context.get("request")
+        period = request.query_params.get("statsPeriod", "24h") if request else "24h"
+        if period not in STATS_PERIODS:
+            return {}
+        if obj.pk not in getattr(self, "_stats", {}):
+            issues = self.parent.instance if self.parent else [obj]
+            issue_ids = {issue.pk for issue in issues} | {obj.pk}
+            self._stats = get_issue_stats(issue_ids, period)
+        return {period: self._stats[obj.pk]}
+
     def to_representation(self, obj):
         """ Workaround for a field called "type" """
         primitive_repr = super().to_representation(obj)
@@ -0,0 +1,91 @@
+"""
+Event count time series of issues and projects. Ingest increments hourly and
+daily issue rollups, so a page of issue sparklines takes one small query instead
+of counting events. Project rollups are summed up from recent issue rollups
+every minute, ingest would otherwise serialize on the project's current rows.
+"""
+from datetime import timedelta
+from django.db import connection
+from django.utils import timezone
+from .buffer import increment_counts
+from .models import Issue, IssueStat, ProjectStat, StatInterval
+
+# Sentry's statsPeriod values, as the interval and number of buckets
+STATS_PERIODS = {"24h": (StatInterval.HOUR, 24), "14d": (StatInterval.DAY, 14)}
+INTERVAL_LENGTHS = {
+    StatInterval.HOUR: timedelta(hours=1),
+    StatInterval.DAY: timedelta(days=1),
+}
+# Hourly rows are only read for the last 24 hours
+HOURLY_STATS_RETENTION = timedelta(days=2)
+
+
+def interval_start(moment, interval):
+    """ Start of the UTC hour or day moment falls in """
+    start = moment.astimezone(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    if interval == StatInterval.DAY:
+        start = start.replace(hour=0)
+    return start
+
+
+def increment_event_stats(events):
+    """
+    Count new events in the hourly and daily rollups of their issue
+    events is an iterable of (issue id, created date)
+    Goes through the issue counter buffer when it's enabled.
+    """
+    issue_counts = {}
+    for issue_id, created in events:
+        for interval in StatInterval:
+            key = (issue_id, int(interval), interval_start(created, interval))
+            issue_counts[key] = issue_counts.get(key, 0) + 1
+    increment_counts(IssueStat, issue_counts)
+
+
+def update_project_stats(since=None):
+    """
+    Set project rollups starting at since to the sum of their issue rollups.
+    Defaults to the hours and days since the start of yesterday, older rows
+    are left as they are.
+    """
+    if since is None:
+        since = interval_start(timezone.now() - timedelta(days=1), StatInterval.DAY)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO {ProjectStat._meta.db_table} (project_id, interval, start, count)
+            SELECT issue.project_id, stat.interval, stat.start, SUM(stat.count)
+            FROM {IssueStat._meta.db_table} stat
+            JOIN {Issue._meta.db_table} issue ON issue.id = stat.issue_id
+            WHERE stat.start >= %s
+            GROUP BY issue.project_id, stat.interval, stat.start
+            ON CONFLICT (project_id, interval, start)
+            DO UPDATE SET count = EXCLUDED.count
+            """,
+            [since],
+        )
+
+
+def get_stats(model, field: str, ids, period: str):
+    """
+    Returns a dict of id to a list of [timestamp, event count] for each bucket
+    of period, oldest first. Buckets without events count 0.
+    """
+    interval, length = STATS_PERIODS[period]
+    step = INTERVAL_LENGTHS[interval]
+    last = interval_start(timezone.now(), interval)
+    starts = [last - step * index for index in reversed(range(length))]
+    counts = {
+        (pk, start): count
+        for pk, start, count in model.objects.filter(
+            **{f"{field}__in": ids}, interval=interval, start__gte=starts[0]
+        ).values_list(field, "start", "count")
+    }
+    return {
+        pk: [[int(start.timestamp()), counts.get((pk, start), 0)] for start in starts]
+        for pk in ids
+    }
+
+
+def get_issue_stats(issue_ids, period: str):
+    return get_stats(IssueStat, "issue_id", issue_ids, period)
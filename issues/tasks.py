@@ -0,0 +1,29 @@
+import logging
+from celery import shared_task
+from .buffer import flush_issue_counters
+from .partitions import create_event_partitions
+from .retention import apply_event_retention
+from .stats import update_project_stats
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(ignore_result=True)
+def flush_buffered_issue_counters():
+    flush_issue_counters()
+
+
+@shared_task(ignore_result=True)
+def create_future_event_partitions():
+    create_event_partitions()
+
+
+@shared_task(ignore_result=True)
+def cleanup_old_events():
+    for message in apply_event_retention():
+        logger.info(message)
+
+
+@shared_task(ignore_result=True)
+def update_recent_project_stats():
+    update_project_stats()
@@ -0,0 +1,195 @@
+import json
+import uuid
+from datetime import timedelta
+from unittest import mock, skipUnless
+import redis
+from django.conf import settings
+from django.db import DatabaseError
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from freezegun import freeze_time
+from model_bakery import baker
+from event_store.serializers import get_serializer_class
+from issues.models import EventStatus, Issue, IssueStat, IssueTag, ProjectStat
+from issues.buffer import (
+    FLUSHED_KEY,
+    increment_event_counts,
+    flush_issue_counters,
+    get_generation,
+    get_redis,
+)
+from issues.stats import update_project_stats
+from issues.tasks import flush_buffered_issue_counters
+
+
+def redis_available():
+    try:
+        return get_redis().ping()
+    except redis.ConnectionError:
+        return False
+
+
+@skipUnless(redis_available(), "Redis isn't running")
+@override_settings(ISSUE_COUNTER_BUFFER=True)
+class IssueCounterBufferTestCase(TestCase):
+    def setUp(self):
+        client = get_redis()
+        for key in client.scan_iter("issue_buffer:*"):
+            client.delete(key)
+        self.issue = baker.make("issues.Issue")
+        self.now = timezone.now()
+        self.later = self.now + timedelta(
+            seconds=settings.ISSUE_COUNTER_FLUSH_INTERVAL * 2
+        )
+
+    def test_buffered_counts(self):
+        other_issue = baker.make("issues.Issue")
+        with freeze_time(self.now):
+            with self.assertNumQueries(0):
+                increment_event_counts({self.issue.pk: (2, self.now)})
+                increment_event_counts(
+                    {self.issue.pk: (1, self.now), other_issue.pk: (1, self.now)}
+                )
+            # Generation is still open
+            self.assertEqual(flush_issue_counters(), 0)
+        self.issue.refresh_from_db()
+        self.assertEqual(self.issue.count, 0)
+
+        with freeze_time(self.later):
+            self.assertEqual(flush_issue_counters(), 2)
+            # Already flushed counts are not added twice
+            self.assertEqual(flush_issue_counters(), 0)
+        self.issue.refresh_from_db()
+        self.assertEqual(self.issue.count, 3)
+        self.assertEqual(self.issue.last_seen, self.now)
+        other_issue.refresh_from_db()
+        self.assertEqual(other_issue.count, 1)
+
+    def test_buffer_size(self):
+        """ A generation takes the same keys however many events it counts """
+        with freeze_time(self.now):
+            for _ in range(5):
+                increment_event_counts({self.issue.pk: (1, self.now)})
+        generation = get_generation(self.now.timestamp())
+        self.assertEqual(
+            len(list(get_redis().scan_iter(f"issue_buffer:{generation}:*"))), 2
+        )
+
+    def test_last_seen_keeps_latest(self):
+        with freeze_time(self.now):
+            increment_event_counts({self.issue.pk: (1, self.now)})
+            increment_event_counts({self.issue.pk: (1, self.now - timedelta(1))})
+        with freeze_time(self.later):
+            flush_issue_counters()
+        self.issue.refresh_from_db()
+        self.assertEqual(self.issue.last_seen, self.now)
+
+    def test_failed_flush(self):
+        """ Counts of a failed flush are saved once by the next flush """
+        with freeze_time(self.now):
+            increment_event_counts({self.issue.pk: (1, self.now)})
+        with freeze_time(self.later):
+            with mock.patch.object(
+                Issue, "increment_event_counts", side_effect=DatabaseError
+            ):
+                with self.assertRaises(DatabaseError):
+                    flush_issue_counters()
+            self.assertEqual(flush_issue_counters(), 1)
+            self.assertEqual(flush_issue_counters(), 0)
+        self.issue.refresh_from_db()
+        self.assertEqual(self.issue.count, 1)
+
+    @mock.patch("issues.buffer.MAX_FLUSH_GENERATIONS", 2)
+    def test_flush_backlog(self):
+        """ A flush reads a limited number of generations, later ones continue """
+        interval = settings.ISSUE_COUNTER_FLUSH_INTERVAL
+        for index in range(3):
+            with freeze_time(self.now + timedelta(seconds=interval * index)):
+                increment_event_counts({self.issue.pk: (1, self.now)})
+        get_redis().set(FLUSHED_KEY, get_generation(self.now.timestamp()) - 1)
+        with freeze_time(self.now + timedelta(seconds=interval * 5)):
+            self.assertEqual(flush_issue_counters(), 1)
+            self.issue.refresh_from_db()
+            self.assertEqual(self.issue.count, 2)
+            flush_issue_counters()
+        self.issue.refresh_from_db()
+        self.assertEqual(self.issue.count, 3)
+
+    def test_flush_task(self):
+        with freeze_time(self.now):
+            increment_event_counts({self.issue.pk: (1, self.now)})
+        with freeze_time(self.later):
+            flush_buffered_issue_counters()
+        self.issue.refresh_from_db()
+        self.assertEqual(self.issue.count, 1)
+
+    def test_regression(self):
+        """ Issues regress on ingest, flushing doesn't reopen them """
+        with open("event_store/test_data/py_hi_event.json") as json_file:
+            data = json.load(json_file)
+        serializer = get_serializer_class(data)(data=data)
+        serializer.is_valid()
+        with freeze_time(self.now):
+            event = serializer.create(self.issue.project, serializer.data)
+        issue = event.issue
+        self.assertEqual(issue.count, 0)
+        Issue.objects.filter(pk=issue.pk).update(status=EventStatus.RESOLVED)
+
+        data["event_id"] = uuid.uuid4().hex
+        serializer = get_serializer_class(data)(data=data)
+        serializer.is_valid()
+        with freeze_time(self.now):
+            serializer.create(self.issue.project, serializer.data)
+        issue.refresh_from_db()
+        self.assertEqual(issue.status, EventStatus.UNRESOLVED)
+
+        Issue.objects.filter(pk=issue.pk).update(status=EventStatus.RESOLVED)
+        with freeze_time(self.later):
+            flush_issue_counters()
+        issue.refresh_from_db()
+        self.assertEqual(issue.count, 2)
+        self.assertEqual(issue.status, EventStatus.RESOLVED)
+
+    def test_buffered_stats_and_tags(self):
+        """ Stat rollups and tag counts are written by the flush, not by ingest """
+        with open("event_store/test_data/py_hi_event.json") as json_file:
+            data = json.load(json_file)
+        serializer = get_serializer_class(data)(data=data)
+        serializer.is_valid()
+        with freeze_time(self.now):
+            event = serializer.create(self.issue.project, serializer.data)
+        self.assertFalse(IssueStat.objects.exists())
+        self.assertFalse(ProjectStat.objects.exists())
+        self.assertTrue(event.tags)
+        self.assertFalse(IssueTag.objects.exists())
+
+        with freeze_time(self.later):
+            flush_issue_counters()
+            update_project_stats()
+        self.assertEqual(
+            sorted(
+                IssueStat.objects.filter(issue=event.issue).values_list(
+                    "interval", "count"
+                )
+            ),
+            [(0, 1), (1, 1)],
+        )
+        self.assertEqual(
+            ProjectStat.objects.filter(project=self.issue.project).count(), 2
+        )
+        self.assertEqual(
+            list(
+                IssueTag.objects.filter(issue=event.issue).values_list(
+                    "count", flat=True
+                )
+            ),
+            [1] * len(event.tags),
+        )
+
+
+class UnbufferedIssueCounterTestCase(TestCase):
+    def test_unbuffered_counts(self):
+        issue = baker.make("issues.Issue")
+        increment_event_counts({issue.pk: (1, timezone.now())})
+        issue.refresh_from_db()
+        self.assertEqual(issue.count, 1)
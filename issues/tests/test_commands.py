@@ -1,7 +1,13 @@
 import random
+from datetime import timedelta
+from io import StringIO
 from django.core import management
+from django.db import connection
 from django.test import TestCase
+from django.utils import timezone
+from model_bakery import baker
 from issues.models import Event
+from issues.partitions import get_event_partitions, partition_name
 
 
 class CommandsTestCase(TestCase):
@@ -27,3 +33,28 @@ class CommandsTestCase(TestCase):
         """ Default is one random event """
         management.call_command("make_sample_issues", only_fake=True)
         self.assertEqual(Event.objects.all().count(), 1)
+
+    def test_backfill_issue_counts(self):
+        issue = baker.make("issues.Issue")
+        baker.make("issues.Issue")
+        events = baker.make("issues.Event", issue=issue, _quantity=3)
+        management.call_command("backfill_issue_counts", stdout=StringIO())
+        issue.refresh_from_db()
+        self.assertEqual(issue.count, 3)
+        self.assertEqual(issue.first_seen, events[0].created)
+        self.assertEqual(issue.last_seen, events[-1].created)
+
+    def test_create_event_partitions(self):
+        management.call_command("create_event_partitions", days=10, stdout=StringIO())
+        today = timezone.now().date()
+        partitions = get_event_partitions()
+        for offset in range(11):
+            self.assertIn(today + timedelta(days=offset), partitions)
+
+        event = baker.make("issues.Event")
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT tableoid::regclass::text FROM issues_event WHERE event_id = %s",
+                [event.pk],
+            )
+            self.assertEqual(cursor.fetchone()[0], partition_name(today))
@@ -0,0 +1,146 @@
+from datetime import timedelta
+from io import StringIO
+from django.core import management
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from freezegun import freeze_time
+from model_bakery import baker
+from issues.models import Event, EventMapping, EventTag, Issue, IssueTag
+from issues.partitions import create_event_partitions, get_event_partitions
+from issues.retention import (
+    DETACHED_PREFIX,
+    apply_event_retention,
+    drop_expired_partitions,
+    get_detached_partitions,
+)
+
+
+@override_settings(EVENT_RETENTION_DAYS=90)
+class EventRetentionTestCase(TestCase):
+    def setUp(self):
+        self.project = baker.make("projects.Project")
+        self.issue = baker.make("issues.Issue", project=self.project)
+
+    def make_event(self, issue, days_old):
+        event = baker.make("issues.Event", issue=issue)
+        created = timezone.now() - timedelta(days=days_old)
+        Event.objects.filter(pk=event.pk).update(created=created)
+        EventMapping.objects.create(event_id=event.pk, issue=issue, created=created)
+        Issue.objects.filter(pk=issue.pk).update(last_seen=created)
+        return event
+
+    def test_retention(self):
+        short_project = baker.make(
+            "projects.Project",
+            organization=self.project.organization,
+            event_retention_days=10,
+        )
+        short_issue = baker.make("issues.Issue", project=short_project)
+        old_event = self.make_event(self.issue, 100)
+        recent_event = self.make_event(self.issue, 20)
+        short_event = self.make_event(short_issue, 20)
+
+        management.call_command("cleanup_old_events", batch_size=1, stdout=StringIO())
+        self.assertFalse(Event.objects.filter(pk=old_event.pk).exists())
+        self.assertTrue(Event.objects.filter(pk=recent_event.pk).exists())
+        self.assertFalse(Event.objects.filter(pk=short_event.pk).exists())
+        self.assertEqual(
+            list(EventMapping.objects.values_list("pk", flat=True)), [recent_event.pk]
+        )
+        self.assertTrue(Issue.objects.filter(pk=self.issue.pk).exists())
+        self.assertFalse(Issue.objects.filter(pk=short_issue.pk).exists())
+
+    def test_retention_counts(self):
+        """ Issue and tag counts only include events that are kept """
+        tag_ids = EventTag.get_ids([("release", "1.0"), ("release", "1.1")])
+        old_tag, recent_tag = tag_ids[("release", "1.0")], tag_ids[("release", "1.1")]
+        old_event = self.make_event(self.issue, 100)
+        recent_event = self.make_event(self.issue, 20)
+        Event.objects.filter(pk=old_event.pk).update(tags=[old_tag, recent_tag])
+        Event.objects.filter(pk=recent_event.pk).update(tags=[recent_tag])
+        Issue.objects.filter(pk=self.issue.pk).update(count=2)
+        IssueTag.increment_counts(
+            {(self.issue.pk, old_tag): 1, (self.issue.pk, recent_tag): 2}
+        )
+
+        list(apply_event_retention())
+        self.issue.refresh_from_db()
+        self.assertEqual(self.issue.count, 1)
+        self.assertEqual(
+            list(
+                IssueTag.objects.filter(issue=self.issue).values_list("tag_id", "count")
+            ),
+            [(recent_tag, 1)],
+        )
+
+    @override_settings(EVENT_RETENTION_DAYS=0)
+    def test_keep_forever(self):
+        """ Only projects with a retention setting lose events """
+        event = self.make_event(self.issue, 1000)
+        short_project = baker.make(
+            "projects.Project",
+            organization=self.project.organization,
+            event_retention_days=10,
+        )
+        short_event = self.make_event(
+            baker.make("issues.Issue", project=short_project), 20
+        )
+        list(apply_event_retention())
+        self.assertTrue(Event.objects.filter(pk=event.pk).exists())
+        self.assertFalse(Event.objects.filter(pk=short_event.pk).exists())
+
+    def test_organization_retention(self):
+        organization = self.project.organization
+        organization.event_retention_days = 200
+        organization.save()
+        event = self.make_event(self.issue, 100)
+        list(apply_event_retention())
+        self.assertTrue(Event.objects.filter(pk=event.pk).exists())
+
+    def test_drop_partitions(self):
+        day = timezone.now() + timedelta(days=200)
+        with freeze_time(day):
+            create_event_partitions(0)
+            event = baker.make("issues.Event", issue=self.issue)
+            Issue.objects.filter(pk=self.issue.pk).update(last_seen=day)
+        with freeze_time(day + timedelta(days=60)):
+            create_event_partitions(0)
+            recent_event = baker.make("issues.Event", issue=self.issue)
+        Issue.objects.filter(pk=self.issue.pk).update(count=2)
+        with connection.cursor() as cursor:
+            # Run deferred foreign key checks, tables with pending ones can't drop
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+        self.assertIn(day.date(), get_event_partitions())
+
+        with freeze_time(day + timedelta(days=91)):
+            messages = list(apply_event_retention())
+        self.assertIn(f"Dropped partition issues_event_p{day:%Y%m%d}", messages)
+        self.assertNotIn(day.date(), get_event_partitions())
+        self.assertFalse(Event.objects.filter(pk=event.pk).exists())
+        self.assertTrue(Event.objects.filter(pk=recent_event.pk).exists())
+        self.issue.refresh_from_db()
+        self.assertEqual(self.issue.count, 1)
+
+    def test_detached_partition(self):
+        """ A partition detached by an interrupted run is dropped once """
+        day = timezone.now() + timedelta(days=200)
+        with freeze_time(day):
+            create_event_partitions(0)
+            baker.make("issues.Event", issue=self.issue)
+        Issue.objects.filter(pk=self.issue.pk).update(count=3)
+        with connection.cursor() as cursor:
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+            cursor.execute(
+                f"ALTER TABLE issues_event DETACH PARTITION issues_event_p{day:%Y%m%d}"
+            )
+            cursor.execute(
+                f"ALTER TABLE issues_event_p{day:%Y%m%d} "
+                f"RENAME TO {DETACHED_PREFIX}{day:%Y%m%d}"
+            )
+
+        self.assertEqual(drop_expired_partitions(timezone.now()), [])
+        self.assertEqual(get_detached_partitions(), [])
+        drop_expired_partitions(timezone.now())
+        self.issue.refresh_from_db()
+        self.assertEqual(self.issue.count, 2)
@@ -1,8 +1,23 @@
+from datetime import timedelta
+from django.db import connection
 from django.shortcuts import reverse
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from rest_framework.test import APITestCase
 from model_bakery import baker
 from organizations_ext.models import OrganizationUserRole
-from issues.models import Issue, EventStatus
+from issues.models import (
+    Issue,
+    event_tag_cache,
+    IssueTag,
+    Event,
+    EventStatus,
+    EventTag,
+    LogLevel,
+    ProjectStat,
+    StatInterval,
+)
+from issues.stats import increment_event_stats, update_project_stats
 
 
 class EventTestCase(APITestCase):
@@ -30,6 +45,28 @@ class EventTestCase(APITestCase):
         self.assertContains(res, event.pk.hex)
         self.assertNotContains(res, not_my_event.pk.hex)
 
+    def test_events_list_queries(self):
+        """ Listing events doesn't save entries and reads all tags at once """
+        issue = baker.make("issues.Issue", project=self.project)
+        tag_ids = EventTag.get_ids([("release", "1.0"), ("release", "1.1")])
+        for tag_id in tag_ids.values():
+            baker.make(
+                "issues.Event",
+                issue=issue,
+                data={"message": "hi"},
+                tags=[tag_id],
+                _quantity=2,
+            )
+        event_tag_cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(self.url)
+        self.assertEqual(len(res.data), 4)
+        self.assertEqual(res.data[0]["entries"][0]["type"], "message")
+        sql = [query["sql"] for query in queries.captured_queries]
+        self.assertFalse([query for query in sql if query.startswith("UPDATE")])
+        self.assertEqual(len([query for query in sql if "issues_eventtag" in query]), 1)
+        self.assertFalse(Event.objects.filter(entries__isnull=False).exists())
+
     def test_events_latest(self):
         """
         Should show more recent event with previousEventID of previous/first event
@@ -56,6 +93,17 @@ class EventTestCase(APITestCase):
         self.assertContains(res, issue1_event2.pk.hex)
         self.assertEqual(res.data["previousEventID"], issue1_event1.pk.hex)
 
+    def test_neighbor_ids_same_created(self):
+        """ Events created at the same time are ordered by event id """
+        issue = baker.make("issues.Issue", project=self.project)
+        baker.make("issues.Event", issue=issue, _quantity=3)
+        Event.objects.filter(issue=issue).update(created=timezone.now())
+        events = list(Event.objects.filter(issue=issue).order_by("pk"))
+        with self.assertNumQueries(1):
+            neighbor_ids = events[1].get_neighbor_ids(issue=issue)
+        self.assertEqual(neighbor_ids, (events[0].pk.hex, events[2].pk.hex))
+        self.assertEqual(events[0].get_neighbor_ids(issue=issue)[0], None)
+
     def test_entries_emtpy(self):
         """ A minimal or incomplete data set should result in an empty entries array """
         data = {
@@ -95,6 +143,41 @@ class EventTestCase(APITestCase):
         res = self.client.get(self.url)
         self.assertTrue("entries" in res.data[0])
 
+    def test_entries_saved(self):
+        """ Entries are built once, without changing event data """
+        data = {
+            "exception": {
+                "values": [
+                    {
+                        "type": "Error",
+                        "stacktrace": {
+                            "frames": [
+                                {
+                                    "abs_path": "/app/main.py",
+                                    "lineno": 10,
+                                    "pre_context": ["a", "b"],
+                                    "context_line": "c",
+                                    "post_context": ["d"],
+                                }
+                            ]
+                        },
+                    }
+                ]
+            },
+        }
+        event = baker.make("issues.Event", issue__project=self.project, data=data)
+        url = reverse("event-issues-latest", args=[event.issue_id])
+        res = self.client.get(url)
+        frame = res.data["entries"][0]["data"]["values"][0]["stacktrace"]["frames"][0]
+        self.assertEqual(frame["absPath"], "/app/main.py")
+        self.assertEqual(frame["context"], [[8, "a"], [9, "b"], [10, "c"], [11, "d"]])
+
+        event = Event.objects.get(pk=event.pk)
+        self.assertEqual(event.data, data)
+        self.assertEqual(event.entries, res.data["entries"])
+        with self.assertNumQueries(0):
+            self.assertEqual(event.get_entries(), res.data["entries"])
+
 
 class IssuesAPITestCase(APITestCase):
     def setUp(self):
@@ -116,6 +199,23 @@ class IssuesAPITestCase(APITestCase):
         self.assertContains(res, issue.title)
         self.assertNotContains(res, not_my_issue.title)
 
+    def test_issue_list_two_teams(self):
+        """ Issues of a project in two of the user's teams are listed once """
+        team = baker.make("teams.Team", organization=self.organization)
+        team.members.add(self.user)
+        self.project.team_set.add(team)
+        issue = baker.make("issues.Issue", project=self.project)
+        event = baker.make("issues.Event", issue=issue)
+
+        res = self.client.get(self.url)
+        self.assertEqual([item["id"] for item in res.data], [issue.id])
+        res = self.client.get(reverse("issue-detail", args=[issue.id]))
+        self.assertEqual(res.status_code, 200)
+        res = self.client.get(f"/api/0/issues/{issue.id}/tags/")
+        self.assertEqual(res.status_code, 200)
+        res = self.client.get(f"/api/0/issues/{issue.id}/events/")
+        self.assertEqual([item["eventID"] for item in res.data], [event.pk.hex])
+
     def test_issue_retrieve(self):
         issue = baker.make("issues.Issue", project=self.project)
         not_my_issue = baker.make("issues.Issue")
@@ -193,6 +293,140 @@ class IssuesAPITestCase(APITestCase):
         self.assertContains(res, unresolved_issue.title)
         self.assertNotContains(res, resolved_issue.title)
 
+    def test_issue_list_sort(self):
+        """ Pages continue after the last issue, ties are ordered by id """
+        now = timezone.now()
+        issues = [
+            baker.make(Issue, project=self.project, last_seen=now, count=count)
+            for count in (3, 1, 2)
+        ]
+        Issue.objects.filter(pk=issues[0].pk).update(last_seen=now - timedelta(hours=1))
+
+        res = self.client.get(self.url, {"limit": 2})
+        self.assertEqual(
+            [issue["id"] for issue in res.data], [issues[2].id, issues[1].id]
+        )
+        previous_link, next_link = res["Link"].split(", ")
+        self.assertIn('results="false"', previous_link)
+        res = self.client.get(next_link.split(">")[0][1:])
+        self.assertEqual([issue["id"] for issue in res.data], [issues[0].id])
+        previous_link, next_link = res["Link"].split(", ")
+        self.assertIn('results="false"', next_link)
+        res = self.client.get(previous_link.split(">")[0][1:])
+        self.assertEqual(len(res.data), 2)
+
+        res = self.client.get(self.url, {"sort": "freq"})
+        self.assertEqual(
+            [issue["id"] for issue in res.data],
+            [issues[0].id, issues[2].id, issues[1].id],
+        )
+
+    def test_search(self):
+        """ Free text matches word prefixes of title and culprit """
+        issue = baker.make(
+            Issue,
+            project=self.project,
+            title="TypeError: foo is undefined",
+            culprit="app/main.py in get_user",
+            level=LogLevel.ERROR,
+        )
+        other_issue = baker.make(
+            Issue, project=self.project, title="Bar", level=LogLevel.WARNING
+        )
+        for query in ("typeerr undef", "get_user", '"foo is"', "level:error"):
+            res = self.client.get(self.url, {"query": query})
+            self.assertEqual([row["id"] for row in res.data], [issue.id], query)
+        res = self.client.get(self.url, {"query": "typeerror bar"})
+        self.assertEqual(len(res.data), 0)
+
+        issue.title = "Bar"
+        issue.save()
+        res = self.client.get(self.url, {"query": "!level:warning bar"})
+        self.assertEqual([row["id"] for row in res.data], [issue.id])
+
+    def test_search_dates(self):
+        now = timezone.now()
+        old_issue = baker.make(
+            Issue, project=self.project, first_seen=now - timedelta(days=3)
+        )
+        new_issue = baker.make(Issue, project=self.project, first_seen=now)
+        day = f"{old_issue.first_seen:%Y-%m-%d}"
+        queries = {
+            "firstSeen:-24h": new_issue,
+            "age:+1d": old_issue,
+            f"firstSeen:{day}": old_issue,
+            f"firstSeen:>{day}": new_issue,
+            f"firstSeen:<={day}": old_issue,
+        }
+        for query, issue in queries.items():
+            res = self.client.get(self.url, {"query": query})
+            self.assertEqual([row["id"] for row in res.data], [issue.id], query)
+        for query in (
+            "lastSeen:yesterday",
+            "firstSeen:2020-13-45",
+            "lastSeen:>=2020-02-30",
+            "lastSeen:<2020-02-30T10:00:00",
+        ):
+            res = self.client.get(self.url, {"query": query})
+            self.assertEqual(res.status_code, 400, query)
+
+    def test_issue_tags(self):
+        """ Tag facets come from the issue tag rollup """
+        issue = baker.make(Issue, project=self.project)
+        tag_ids = EventTag.get_ids(
+            [("release", "1.0"), ("release", "1.1"), ("os", "Linux")]
+        )
+        IssueTag.increment_counts(
+            {(issue.pk, tag_id): 2 for tag_id in tag_ids.values()}
+        )
+        IssueTag.increment_counts({(issue.pk, tag_ids[("release", "1.1")]): 1})
+        event = baker.make(
+            "issues.Event", issue=issue, tags=[tag_ids[("release", "1.1")]]
+        )
+
+        url = reverse("issue-tags", args=[issue.id])
+        res = self.client.get(url, {"key": "release"})
+        self.assertEqual(len(res.data), 1)
+        self.assertEqual(res.data[0]["totalValues"], 5)
+        self.assertEqual(
+            [(value["value"], value["count"]) for value in res.data[0]["topValues"]],
+            [("1.1", 3), ("1.0", 2)],
+        )
+
+        url = reverse("event-issues-latest", args=[issue.id])
+        res = self.client.get(url)
+        self.assertEqual(res.data["tags"], [{"key": "release", "value": "1.1"}])
+
+    def test_issue_stats(self):
+        now = timezone.now()
+        issues = baker.make(Issue, project=self.project, _quantity=2)
+        increment_event_stats(
+            [
+                (issues[0].pk, now),
+                (issues[0].pk, now),
+                (issues[0].pk, now - timedelta(hours=2)),
+                (issues[1].pk, now - timedelta(days=2)),
+            ]
+        )
+        res = self.client.get(self.url)
+        stats = {issue["id"]: issue["stats"]["24h"] for issue in res.data}
+        self.assertEqual(len(stats[issues[0].pk]), 24)
+        self.assertEqual(stats[issues[0].pk][-1][1], 2)
+        self.assertEqual(stats[issues[0].pk][-3][1], 1)
+        self.assertEqual(sum(count for _, count in stats[issues[1].pk]), 0)
+
+        res = self.client.get(self.url, {"statsPeriod": "14d"})
+        stats = {issue["id"]: issue["stats"]["14d"] for issue in res.data}
+        self.assertEqual(stats[issues[1].pk][-3][1], 1)
+        self.assertFalse(ProjectStat.objects.exists())
+        update_project_stats(now - timedelta(days=3))
+        project_stats = ProjectStat.objects.filter(interval=StatInterval.DAY)
+        self.assertEqual(sum(stat.count for stat in project_stats), 4)
+        # Updating again doesn't count events twice
+        update_project_stats()
+        project_stats = ProjectStat.objects.filter(interval=StatInterval.DAY)
+        self.assertEqual(sum(stat.count for stat in project_stats), 4)
+
     def test_issue_serializer_type(self):
         """
         Ensure type field is show in serializer
@@ -1,14 +1,21 @@
-from django.db.models import Count, Min, Max
+from datetime import timedelta
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
 from rest_framework import viewsets
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from .models import Issue, Event, EventStatus
+from glitchtip.pagination import KeysetPagination
+from teams.models import Team
+from .models import Issue, IssueTag, Event, EventStatus
 from .serializers import (
     IssueSerializer,
     EventSerializer,
     EventDetailSerializer,
 )
 from .filters import IssueFilter
+from .search import parse_search_query
+
+TOP_TAG_VALUES = 9
 
 
 class IssueViewSet(viewsets.ModelViewSet):
@@ -23,19 +30,29 @@ class IssueViewSet(viewsets.ModelViewSet):
 
     - id (int) — a list of IDs of the issues to be removed.  This parameter shall be repeated for each issue.
     - query (string) — querystring for structured search. Example: "is:unresolved" searches for status=unresolved.
+      Supports is, level, type, firstSeen and lastSeen (-24h, +7d, >=2020-01-01) terms, anything else searches title and culprit.
+    - sort (string) — date (last seen, default), new (first seen) or freq (event count)
     """
 
     queryset = Issue.objects.all()
     serializer_class = IssueSerializer
     filterset_class = IssueFilter
+    pagination_class = KeysetPagination
+    sort_fields = {"date": "last_seen", "new": "first_seen", "freq": "count"}
 
     def get_queryset(self):
         qs = (
             super()
             .get_queryset()
             .filter(
+                # Exists keeps issues of projects in several of the user's teams
+                # from repeating, and the sort indexes usable
+                Exists(
+                    Team.objects.filter(
+                        members=self.request.user, projects=OuterRef("project")
+                    )
+                ),
                 project__organization__users=self.request.user,
-                project__team__members=self.request.user,
             )
         )
 
@@ -46,20 +63,10 @@ class IssueViewSet(viewsets.ModelViewSet):
         if "project_slug" in self.kwargs:
             qs = qs.filter(project__slug=self.kwargs["project_slug"],)
 
-        queries = self.request.GET.get("query")
-        if queries:
-            for query in queries.split():
-                query_part = query.split(":", 1)
-                if len(query_part) == 2:
-                    query_name, query_value = query_part
-                    if query_name == "is":
-                        qs = qs.filter(status=EventStatus.from_string(query_value))
-
-        qs = qs.annotate(
-            count=Count("event"),
-            firstSeen=Min("event__created"),
-            lastSeen=Max("event__created"),
-        )
+        query = self.request.GET.get("query")
+        if query:
+            qs = qs.filter(parse_search_query(query))
+
         return qs
 
     def bulk_update(self, request, *args, **kwargs):
@@ -70,6 +77,33 @@ class IssueViewSet(viewsets.ModelViewSet):
         queryset.update(status=status)
         return Response({"status": status.label})
 
+    @action(detail=True, methods=["get"])
+    def tags(self, request, *args, **kwargs):
+        """
+        Tag keys of the issue's events with their most common values.
+        Counts come from the issue tag rollup. Limit keys with ?key=release
+        """
+        issue = self.get_object()
+        issue_tags = IssueTag.objects.filter(issue=issue).order_by(
+            "tag__key", "-count", "tag__value"
+        )
+        keys = request.GET.getlist("key")
+        if keys:
+            issue_tags = issue_tags.filter(tag__key__in=keys)
+        facets = {}
+        for key, value, count in issue_tags.values_list(
+            "tag__key", "tag__value", "count"
+        ):
+            facet = facets.setdefault(
+                key, {"key": key, "name": key, "totalValues": 0, "topValues": []}
+            )
+            facet["totalValues"] += count
+            if len(facet["topValues"]) < TOP_TAG_VALUES:
+                facet["topValues"].append(
+                    {"key": key, "name": value, "value": value, "count": count}
+                )
+        return Response(list(facets.values()))
+
 
 class EventViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Event.objects.all()
@@ -85,8 +119,12 @@ class EventViewSet(viewsets.ReadOnlyModelViewSet):
             super()
             .get_queryset()
             .filter(
+                Exists(
+                    Team.objects.filter(
+                        members=self.request.user, projects=OuterRef("issue__project")
+                    )
+                ),
                 issue__project__organization__users=self.request.user,
-                issue__project__team__members=self.request.user,
             )
         )
         if "issue_pk" in self.kwargs:
@@ -101,6 +139,20 @@ class EventViewSet(viewsets.ReadOnlyModelViewSet):
 
     @action(detail=False, methods=["get"])
     def latest(self, request, *args, **kwargs):
-        instance = self.get_queryset().first()
+        queryset = self.get_queryset()
+        # Events are partitioned by created, so look in recent partitions first
+        if "issue_pk" in self.kwargs:
+            since = (
+                Issue.objects.filter(pk=self.kwargs["issue_pk"])
+                .values_list("last_seen", flat=True)
+                .first()
+            )
+        else:
+            since = timezone.now() - timedelta(days=1)
+        instance = None
+        if since:
+            instance = queryset.filter(created__gte=since).first()
+        if instance is None:
+            instance = queryset.first()
         serializer = self.get_serializer(instance)
         return Response(serializer.data)
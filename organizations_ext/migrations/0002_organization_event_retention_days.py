@@ -0,0 +1,18 @@
+# Generated by Django 3.0.5 on 2026-10-18 18:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('organizations_ext', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='organization',
+            name='event_retention_days',
+            field=models.PositiveIntegerField(blank=True, help_text='Days to keep events, defaults to EVENT_RETENTION_DAYS', null=True),
+        ),
+    ]
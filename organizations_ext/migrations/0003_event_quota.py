@@ -0,0 +1,31 @@
+# Generated by Django 3.0.5 on 2026-10-18 18:44
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('organizations_ext', '0002_organization_event_retention_days'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='organization',
+            name='event_quota',
+            field=models.PositiveIntegerField(blank=True, help_text='Events accepted per month, defaults to EVENT_QUOTA', null=True),
+        ),
+        migrations.CreateModel(
+            name='OrganizationUsage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(help_text='First day of the month')),
+                ('event_count', models.PositiveIntegerField(default=0)),
+                ('organization', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='organizations_ext.Organization')),
+            ],
+            options={
+                'unique_together': {('organization', 'month')},
+            },
+        ),
+    ]
@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import connection, models
 from django.utils.translation import ugettext_lazy as _
 from organizations.base import (
     OrganizationBase,
@@ -26,6 +26,16 @@ class Organization(SharedBaseModel, OrganizationBase):
         unique=True,
         help_text=_("The name in all lowercase, suitable for URL identification"),
     )
+    event_retention_days = models.PositiveIntegerField(
+        blank=True,
+        null=True,
+        help_text=_("Days to keep events, defaults to EVENT_RETENTION_DAYS"),
+    )
+    event_quota = models.PositiveIntegerField(
+        blank=True,
+        null=True,
+        help_text=_("Events accepted per month, defaults to EVENT_QUOTA"),
+    )
 
     def add_user(self, user, role=OrganizationUserRole.MEMBER):
         """
@@ -66,3 +76,35 @@ class OrganizationUser(SharedBaseModel, OrganizationUserBase):
 
 class OrganizationOwner(OrganizationOwnerBase):
     """ Only usage is for billing contact currently """
+
+
+class OrganizationUsage(models.Model):
+    """ Events an organization sent in a month, saved from the cache counters """
+
+    organization = models.ForeignKey(Organization, on_delete=models.CASCADE)
+    month = models.DateField(help_text=_("First day of the month"))
+    event_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ("organization", "month")
+
+    @classmethod
+    def save_event_counts(cls, counts):
+        """
+        Save counts, a dict of (organization id, month) to event count.
+        Counts only grow, so saving the same or an older count changes nothing.
+        """
+        if not counts:
+            return
+        rows = sorted(counts.items())
+        table = cls._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {table} (organization_id, month, event_count)
+                VALUES {", ".join(["(%s, %s, %s)"] * len(rows))}
+                ON CONFLICT (organization_id, month) DO UPDATE
+                SET event_count = GREATEST({table}.event_count, EXCLUDED.event_count)
+                """,
+                [param for key, count in rows for param in (*key, count)],
+            )
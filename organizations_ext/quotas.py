@@ -0,0 +1,99 @@
+"""
+Monthly event quotas of organizations.
+Events are counted per organization and month in the cache (Redis), so the
+store endpoint checks quotas without touching the database.
+flush_event_usage saves the counters to OrganizationUsage. A lost counter
+starts again from the saved count.
+"""
+from datetime import date, datetime, timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from .models import Organization, OrganizationUsage
+
+# Counters outlive their month, so the last flush still finds them
+USAGE_TIMEOUT = 86400 * 40
+FLUSH_BATCH_SIZE = 1000
+
+
+def get_month(now=None) -> date:
+    """ First day of the current month """
+    if now is None:
+        now = timezone.now()
+    return now.date().replace(day=1)
+
+
+def get_next_month(month: date) -> date:
+    if month.month == 12:
+        return month.replace(year=month.year + 1, month=1)
+    return month.replace(month=month.month + 1)
+
+
+def usage_key(organization_id: int, month: date):
+    return f"event_usage:{organization_id}:{month:%Y%m}"
+
+
+def exceeded_key(organization_id: int, month: date):
+    return f"event_quota_exceeded:{organization_id}:{month:%Y%m}"
+
+
+def check_event_quota(organization):
+    """
+    Count an event against the organization's monthly quota.
+    Returns the seconds until the next month when the quota is used up,
+    otherwise None. Organizations over quota only cost one cache read.
+    """
+    now = timezone.now()
+    month = get_month(now)
+    quota = organization.event_quota or settings.EVENT_QUOTA
+    # The flag holds the exceeded quota, a raised quota applies right away
+    if quota and cache.get(exceeded_key(organization.pk, month)) == quota:
+        return get_seconds_until(get_next_month(month), now)
+
+    key = usage_key(organization.pk, month)
+    try:
+        count = cache.incr(key)
+    except ValueError:
+        saved = (
+            OrganizationUsage.objects.filter(organization=organization, month=month)
+            .values_list("event_count", flat=True)
+            .first()
+        )
+        cache.add(key, saved or 0, USAGE_TIMEOUT)
+        count = cache.incr(key)
+
+    if quota and count > quota:
+        timeout = get_seconds_until(get_next_month(month), now)
+        cache.set(exceeded_key(organization.pk, month), quota, timeout)
+        return timeout
+    return None
+
+
+def get_seconds_until(month: date, now: datetime) -> int:
+    start = timezone.make_aware(
+        datetime(month.year, month.month, month.day), timezone.utc
+    )
+    return max(int((start - now).total_seconds()), 1)
+
+
+def flush_event_usage():
+    """
+    Save the event counters of this and last month to OrganizationUsage.
+    Returns the number of counters saved.
+    """
+    month = get_month()
+    previous_month = (month - timedelta(days=1)).replace(day=1)
+    organization_ids = list(Organization.objects.values_list("pk", flat=True))
+    saved = 0
+    for index in range(0, len(organization_ids), FLUSH_BATCH_SIZE):
+        keys = {
+            usage_key(pk, usage_month): (pk, usage_month)
+            for pk in organization_ids[index : index + FLUSH_BATCH_SIZE]
+            for usage_month in (previous_month, month)
+        }
+        counts = {
+            keys[key]: count for key, count in cache.get_many(keys.keys()).items()
+        }
+        OrganizationUsage.save_event_counts(counts)
+        saved += len(counts)
+    return saved
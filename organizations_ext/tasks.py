@@ -0,0 +1,7 @@
+from celery import shared_task
+from .quotas import flush_event_usage
+
+
+@shared_task(ignore_result=True)
+def flush_organization_event_usage():
+    flush_event_usage()
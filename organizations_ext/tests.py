@@ -1,8 +1,15 @@
 from django.conf import settings
+from django.core.cache import cache
 from django.shortcuts import reverse
 from django.test import TestCase, RequestFactory
 from rest_framework.test import APITestCase
-from organizations_ext.models import OrganizationUser
+from organizations_ext.models import OrganizationUser, OrganizationUsage
+from organizations_ext.quotas import (
+    check_event_quota,
+    flush_event_usage,
+    get_month,
+    usage_key,
+)
 from model_bakery import baker
 from glitchtip import test_utils  # pylint: disable=unused-import
 
@@ -37,6 +44,33 @@ class OrganizationModelTestCase(TestCase):
         self.assertEqual(callback(request), organization)
 
 
+class EventQuotaTestCase(TestCase):
+    def test_event_quota(self):
+        organization = baker.make("organizations_ext.Organization", event_quota=2)
+        self.assertIsNone(check_event_quota(organization))
+        self.assertIsNone(check_event_quota(organization))
+        self.assertTrue(check_event_quota(organization) > 0)
+
+        organization.event_quota = 4
+        self.assertIsNone(check_event_quota(organization))
+
+    def test_flush_event_usage(self):
+        organization = baker.make("organizations_ext.Organization")
+        for _ in range(3):
+            check_event_quota(organization)
+        flush_event_usage()
+        usage = OrganizationUsage.objects.get(organization=organization)
+        self.assertEqual(usage.month, get_month())
+        self.assertEqual(usage.event_count, 3)
+
+        # A lost counter continues from the saved count
+        cache.delete(usage_key(organization.pk, get_month()))
+        check_event_quota(organization)
+        flush_event_usage()
+        usage.refresh_from_db()
+        self.assertEqual(usage.event_count, 4)
+
+
 class OrganizationsAPITestCase(APITestCase):
     def setUp(self):
         self.user = baker.make("users.user")
@@ -0,0 +1,18 @@
+# Generated by Django 3.0.5 on 2026-10-18 18:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0002_auto_20200429_1721'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='event_retention_days',
+            field=models.PositiveIntegerField(blank=True, help_text='Days to keep events, defaults to the organization setting', null=True),
+        ),
+    ]
@@ -1,10 +1,21 @@
 from urllib.parse import urlparse
-from uuid import uuid4
+from uuid import uuid4, UUID
 from django.contrib.postgres.fields import JSONField
 from django.conf import settings
+from django.core.cache import cache
 from django.db import models
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 from django.utils.text import slugify
 from django_extensions.db.fields import AutoSlugField
+from glitchtip.cache import LRUCache
+
+# Store endpoint key lookups. Keys rarely change, so they are cached per process
+# and in the shared cache. Missing keys are cached briefly as well.
+PROJECT_KEY_CACHE_TIMEOUT = 3600
+PROJECT_KEY_LOCAL_TIMEOUT = 30
+PROJECT_KEY_MISSING_TIMEOUT = 10
+project_key_cache = LRUCache(maxsize=2048, ttl=PROJECT_KEY_LOCAL_TIMEOUT)
 
 
 class Project(models.Model):
@@ -22,6 +33,11 @@ class Project(models.Model):
     )
     created = models.DateTimeField(auto_now_add=True, db_index=True)
     platform = models.CharField(max_length=64, blank=True, null=True)
+    event_retention_days = models.PositiveIntegerField(
+        blank=True,
+        null=True,
+        help_text="Days to keep events, defaults to the organization setting",
+    )
 
     class Meta:
         unique_together = (("organization", "slug"),)
@@ -76,6 +92,41 @@ class ProjectKey(models.Model):
             # so anything downstream expecting DoesNotExist works fine
             raise ProjectKey.DoesNotExist("ProjectKey matching query does not exist.")
 
+    @classmethod
+    def get_for_store(cls, project_id, public_key):
+        """
+        Get the key, with its project, used to authenticate an event store request
+        Returns None when the key does not exist or does not belong to the project
+        """
+        try:
+            project_id = int(project_id)
+            public_key = UUID(str(public_key))
+        except (TypeError, ValueError):
+            return None
+        cache_key = project_key_cache_key(project_id, public_key)
+
+        project_key = project_key_cache.get(cache_key)
+        if project_key is None:
+            project_key = cache.get(cache_key)
+        if project_key is None:
+            project_key = (
+                cls.objects.filter(project_id=project_id, public_key=public_key)
+                .select_related("project__organization")
+                .first()
+            )
+            if project_key:
+                cache.set(cache_key, project_key, PROJECT_KEY_CACHE_TIMEOUT)
+            else:
+                # Cache missing keys as False to tell them apart from cache misses
+                project_key = False
+                cache.set(cache_key, project_key, PROJECT_KEY_MISSING_TIMEOUT)
+        project_key_cache.set(
+            cache_key,
+            project_key,
+            PROJECT_KEY_LOCAL_TIMEOUT if project_key else PROJECT_KEY_MISSING_TIMEOUT,
+        )
+        return project_key or None
+
     @property
     def public_key_hex(self):
         """ The public key without dashes """
@@ -98,3 +149,37 @@ class ProjectKey(models.Model):
             urlparts.netloc + urlparts.path,
             self.project_id,
         )
+
+
+def project_key_cache_key(project_id: int, public_key: UUID):
+    return f"projectkey:{project_id}:{public_key.hex}"
+
+
+def invalidate_project_key(project_id: int, public_key: UUID):
+    cache_key = project_key_cache_key(project_id, public_key)
+    project_key_cache.delete(cache_key)
+    cache.delete(cache_key)
+
+
+@receiver(post_save, sender=ProjectKey)
+@receiver(post_delete, sender=ProjectKey)
+def project_key_changed(sender, instance, **kwargs):
+    invalidate_project_key(instance.project_id, instance.public_key)
+
+
+@receiver(post_save, sender=Project)
+def project_changed(sender, instance, **kwargs):
+    """ Cached keys contain the project, drop them when it changes """
+    for public_key in ProjectKey.objects.filter(project=instance).values_list(
+        "public_key", flat=True
+    ):
+        invalidate_project_key(instance.pk, public_key)
+
+
+@receiver(post_save, sender="organizations_ext.Organization")
+def organization_changed(sender, instance, **kwargs):
+    """ Cached keys contain the organization's quota too """
+    for project_id, public_key in ProjectKey.objects.filter(
+        project__organization=instance
+    ).values_list("project_id", "public_key"):
+        invalidate_project_key(project_id, public_key)
@@ -1,10 +1,13 @@
+from uuid import uuid4
 from django.conf import settings
+from django.core.cache import cache
 from django.shortcuts import reverse
+from django.test import TestCase
 from rest_framework.test import APITestCase
 from model_bakery import baker
 from glitchtip import test_utils  # pylint: disable=unused-import
 from organizations_ext.models import OrganizationUserRole
-from .models import ProjectKey, Project
+from .models import ProjectKey, Project, project_key_cache
 
 
 class ProjectsAPITestCase(APITestCase):
@@ -125,3 +128,52 @@ class TeamProjectsAPITestCase(APITestCase):
         org2_project = Project.objects.create(name=name, organization=org2)
         # The same slug can exist between multiple organizations
         self.assertEqual(projects[0].slug, org2_project.slug)
+
+
+class ProjectKeyCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        project_key_cache.clear()
+        self.project = baker.make("projects.Project")
+        self.project_key = self.project.projectkey_set.first()
+
+    def test_get_for_store_cached(self):
+        project_key = ProjectKey.get_for_store(
+            self.project.id, self.project_key.public_key_hex
+        )
+        self.assertEqual(project_key, self.project_key)
+        with self.assertNumQueries(0):
+            project_key = ProjectKey.get_for_store(
+                self.project.id, self.project_key.public_key_hex
+            )
+            self.assertEqual(project_key.project, self.project)
+
+        # Shared cache is used when the process cache is cold
+        project_key_cache.clear()
+        with self.assertNumQueries(0):
+            ProjectKey.get_for_store(self.project.id, self.project_key.public_key)
+
+    def test_get_for_store_missing(self):
+        other_project = baker.make("projects.Project")
+        self.assertIsNone(
+            ProjectKey.get_for_store(other_project.id, self.project_key.public_key)
+        )
+        self.assertIsNone(ProjectKey.get_for_store(self.project.id, "not a key"))
+        public_key = uuid4()
+        self.assertIsNone(ProjectKey.get_for_store(self.project.id, public_key))
+        with self.assertNumQueries(0):
+            self.assertIsNone(ProjectKey.get_for_store(self.project.id, public_key))
+
+    def test_get_for_store_invalidation(self):
+        ProjectKey.get_for_store(self.project.id, self.project_key.public_key)
+        self.project.name = "renamed"
+        self.project.save()
+        project_key = ProjectKey.get_for_store(
+            self.project.id, self.project_key.public_key
+        )
+        self.assertEqual(project_key.project.name, "renamed")
+
+        self.project_key.delete()
+        self.assertIsNone(
+            ProjectKey.get_for_store(self.project.id, self.project_key.public_key)
+        )